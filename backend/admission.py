@@ -0,0 +1,129 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+# Inferences allowed to run at once per model, and requests allowed to wait for a slot
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 8))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 32))
+# Seconds a queued request waits for a slot before giving up
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 30))
+
+# Largest upload accepted per media type
+UPLOAD_LIMITS = {
+    "image": int(float(os.environ.get('MAX_IMAGE_UPLOAD_MB', 25)) * 1024 * 1024),
+    "video": int(float(os.environ.get('MAX_VIDEO_UPLOAD_MB', 500)) * 1024 * 1024),
+    "batch": int(float(os.environ.get('MAX_BATCH_UPLOAD_MB', 1000)) * 1024 * 1024),
+}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted. `status_code` is 429 when the
+    wait queue is full and 503 when the request timed out waiting."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Gate:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Moving average of how long a request holds its slot
+        self.mean_hold = 0.0
+
+
+class AdmissionController:
+    """Caps concurrent inferences per key (a model id), with a bounded wait queue.
+
+    A request runs at once when a slot is free, waits when the queue has
+    room, and is rejected straight away otherwise, with a Retry-After
+    estimated from recent hold times.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._gates: Dict[str, _Gate] = {}
+
+    def _gate(self, key: str) -> _Gate:
+        if key not in self._gates:
+            self._gates[key] = _Gate(self.max_concurrent)
+        return self._gates[key]
+
+    def _retry_after(self, gate: _Gate) -> int:
+        # Time for the queue ahead to drain through the slots
+        backlog = (gate.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(backlog * (gate.mean_hold or 1.0)))
+
+    async def acquire(self, key: str):
+        gate = self._gate(key)
+        if gate.semaphore.locked():
+            if gate.waiting >= self.max_queue:
+                gate.rejected += 1
+                raise AdmissionRejected(f"Too many requests for {key}; try again later", 429,
+                                        self._retry_after(gate))
+            gate.waiting += 1
+            gate.queued += 1
+            try:
+                await asyncio.wait_for(gate.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                gate.timed_out += 1
+                raise AdmissionRejected(f"Timed out waiting for {key}; try again later", 503,
+                                        self._retry_after(gate))
+            finally:
+                gate.waiting -= 1
+        else:
+            await gate.semaphore.acquire()
+        gate.running += 1
+        gate.admitted += 1
+
+    def release(self, key: str, held: Optional[float] = None):
+        gate = self._gates[key]
+        gate.running -= 1
+        gate.semaphore.release()
+        if held is not None:
+            gate.mean_hold = held if not gate.mean_hold else 0.9 * gate.mean_hold + 0.1 * held
+
+    @asynccontextmanager
+    async def admit(self, key: str) -> AsyncIterator[None]:
+        await self.acquire(key)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(key, time.perf_counter() - start)
+
+    def queue_depth(self) -> Dict[str, int]:
+        return {key: gate.waiting for key, gate in self._gates.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "models": {key: {
+                "running": gate.running,
+                "waiting": gate.waiting,
+                "admitted": gate.admitted,
+                "queued": gate.queued,
+                "rejected": gate.rejected,
+                "timed_out": gate.timed_out,
+                "mean_hold_seconds": gate.mean_hold,
+            } for key, gate in self._gates.items()},
+        }
+
+
+def admission_from_env() -> AdmissionController:
+    return AdmissionController()
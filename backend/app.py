@@ -1,49 +1,54 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import time
-import io
-from PIL import Image
 import traceback
 import os
-import cv2
-import numpy as np
 import tempfile
 import uuid
-from ultralytics import YOLO
+from admission import UPLOAD_LIMITS
+from postprocess import DetectionBatch
+from stages import MediaError, decode_image, decode_target_size, original_scale, process_video_file
+from frame_sampler import SamplingStrategy
+from scene_gate import DEFAULT_SCENE_THRESHOLD
+from quality import resolve_tier
+from tracking import TrackingOptions
+from model_registry import ModelUnavailableError, UnknownModelError, registry_from_env
+from metrics import CONTENT_TYPE, StageTimer, labels, metrics
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Enable CORS for all routes and origins
+# Werkzeug answers larger uploads with a 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = max(UPLOAD_LIMITS["image"], UPLOAD_LIMITS["video"])
 
-# Check if model files exist
-waste_model_path = os.environ.get('YOLO_MODEL_PATH', 'best.pt')
-drone_model_path = os.environ.get('DRONE_MODEL_PATH', 'best2.pt')
+# Models are loaded on first use from the MODEL_CONFIG file (or YOLO_MODEL_PATH and
+# DRONE_MODEL_PATH), kept within a memory budget and reloaded when their weights change
+registry = registry_from_env()
+registry.preload()
 
-waste_model_exists = os.path.exists(waste_model_path)
-drone_model_exists = os.path.exists(drone_model_path)
+# Prometheus metrics, served on /metrics
+requests_total = metrics.counter("binsavvy_requests_total", "HTTP requests by route and status")
+request_seconds = metrics.histogram("binsavvy_request_seconds", "HTTP request duration by route")
+requests_in_flight = metrics.gauge("binsavvy_requests_in_flight", "HTTP requests being handled")
+metrics.gauge("binsavvy_model_loaded", "Whether each model is loaded (1) or not (0)",
+              lambda: {labels(model=model_id): float(status["loaded"]) for model_id, status in registry.status().items()})
+metrics.gauge("binsavvy_model_size_bytes", "Memory held by each loaded model",
+              lambda: {labels(model=model_id): status["size_bytes"] for model_id, status in registry.status().items()})
 
-# Load the YOLO models
-waste_model = None
-drone_model = None
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    requests_in_flight.inc()
 
-if waste_model_exists:
-    try:
-        waste_model = YOLO(waste_model_path)
-        print(f"Waste model loaded successfully from {waste_model_path}")
-    except Exception as e:
-        print(f"Error loading waste model: {e}")
-        traceback.print_exc()
-else:
-    print(f"Waste model file not found at {waste_model_path}")
+@app.teardown_request
+def end_request_metrics(error=None):
+    requests_in_flight.dec()
 
-if drone_model_exists:
-    try:
-        drone_model = YOLO(drone_model_path)
-        print(f"Drone model loaded successfully from {drone_model_path}")
-    except Exception as e:
-        print(f"Error loading drone model: {e}")
-        traceback.print_exc()
-else:
-    print(f"Drone model file not found at {drone_model_path}")
+@app.after_request
+def record_request_metrics(response):
+    path = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_seconds.observe(time.perf_counter() - g.request_start, path=path)
+    requests_total.inc(path=path, status=response.status_code)
+    return response
 
 @app.route('/detect', methods=['POST'])
 def detect():
@@ -59,28 +64,65 @@ def detect():
     
     print(f"Received request: model={model_id}, media_type={media_type}, confidence={confidence}, file={file.filename}")
     
-    # Select the appropriate model
-    if model_id == 'yolo':
-        model = waste_model
-        model_path = waste_model_path
-    elif model_id == 'best2':
-        model = drone_model
-        model_path = drone_model_path
-    else:
-        return jsonify({"error": f"Unknown model: {model_id}"}), 400
+    limit = UPLOAD_LIMITS.get(media_type)
+    if limit is not None and (request.content_length or 0) > limit:
+        return jsonify({"error": f"{media_type.capitalize()} uploads are limited to {limit / (1024 * 1024):g} MB"}), 413
+    
+    # Video frame sampling options
+    try:
+        sampling = SamplingStrategy(
+            target_fps=request.form.get('sample_fps', type=float),
+            stride=request.form.get('sample_stride', type=int),
+            max_frames=request.form.get('max_frames', type=int)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Skip inference on near-duplicate video frames when requested
+    scene_threshold = None
+    if request.form.get('scene_gate', 'false').lower() == 'true':
+        scene_threshold = request.form.get('scene_threshold', DEFAULT_SCENE_THRESHOLD, type=float)
+        if scene_threshold < 0:
+            return jsonify({"error": "scene_threshold must not be negative"}), 400
     
-    # Check if model is loaded
-    if model is None:
-        return jsonify({
-            "error": f"Model not loaded. Check if the model file exists at {model_path} and the model can be loaded correctly."
-        }), 500
+    # Detector on keyframes only, with tracked boxes in between
+    tracking = None
+    if request.form.get('track', 'false').lower() == 'true':
+        try:
+            tracking = TrackingOptions(request.form.get('keyframe_interval', TrackingOptions().keyframe_interval, type=int))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    
+    # Speed/accuracy tier, with explicit settings overriding the tier's.
+    # INT8 variants are only served by the FastAPI app.
+    try:
+        tier = resolve_tier(
+            request.form.get('quality'),
+            imgsz=request.form.get('imgsz', type=int),
+            max_det=request.form.get('max_det', type=int)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Select the appropriate model, loading it on first use
+    try:
+        loaded = registry.get(model_id)
+        model = loaded.model
+    except UnknownModelError as e:
+        return jsonify({"error": str(e)}), 400
+    except ModelUnavailableError as e:
+        return jsonify({"error": str(e)}), 500
+    
+    # Per-stage timings, returned in the response when asked for
+    timer = StageTimer(model=loaded.spec.id, media_type=media_type)
+    include_timings = request.form.get('timings', 'false').lower() == 'true'
     
     try:
         # Process based on media type
         if media_type == 'image':
-            return process_image(file, model, confidence)
+            return process_image(file, model, confidence, tier, timer, include_timings)
         elif media_type == 'video':
-            return process_video(file, model, confidence)
+            return process_video(file, model, confidence, sampling, scene_threshold, tier, timer, include_timings, tracking)
         else:
             return jsonify({"error": f"Unsupported media type: {media_type}"}), 400
             
@@ -89,214 +131,137 @@ def detect():
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-def process_image(image_file, model, confidence_threshold=0.25):
+def process_image(image_file, model, confidence_threshold=0.25, tier=None, timer=None, include_timings=False):
+    timer = timer or StageTimer()
     try:
         # Open and validate the image
         try:
-            img = Image.open(image_file.stream)
-            img.verify()  # Verify that it's a valid image
-            img = Image.open(image_file.stream)  # Reopen after verify
-        except Exception as e:
+            with timer.stage("read"):
+                contents = image_file.read()
+            with timer.stage("decode"):
+                img, original_size = decode_image(contents, decode_target_size(tier))
+        except MediaError as e:
             print(f"Invalid image: {e}")
-            return jsonify({"error": f"Invalid image: {str(e)}"}), 400
+            return jsonify({"error": str(e)}), 400
         
-        # Get image dimensions for density calculation
-        img_width, img_height = img.size
+        # Get image dimensions for density calculation (the true size, not the decoded size)
+        img_width, img_height = original_size
         img_area = img_width * img_height
         
         # Start timing
         start_time = time.time()
         
         # Run inference with YOLOv8
-        results = model(img, conf=confidence_threshold)
+        with timer.stage("inference"):
+            results = model(img, conf=confidence_threshold, **(tier.predict_args() if tier else {}))
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
-        # Process results
-        detections = []
-        class_counts = {}
-        total_waste_area = 0
-        
         # Convert YOLOv8 results to JSON-serializable format
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                # Get box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                # Get confidence
-                conf = box.conf[0].item()
-                # Get class
-                cls = int(box.cls[0].item())
-                # Get class name
-                class_name = model.names[cls]
-                
-                # Calculate box area for density
-                box_width = x2 - x1
-                box_height = y2 - y1
-                box_area = box_width * box_height
-                total_waste_area += box_area
-                
-                # Update class counts
-                if class_name in class_counts:
-                    class_counts[class_name] += 1
-                else:
-                    class_counts[class_name] = 1
-                
-                detections.append({
-                    "box": [float(x1), float(y1), float(x2 - x1), float(y2 - y1)],
-                    "class_name": class_name,
-                    "confidence": float(conf)
-                })
+        with timer.stage("postprocess"):
+            batch = DetectionBatch.from_results(results, model.names).scaled(*original_scale(img, original_size))
         
-        # Calculate waste density (percentage of image covered by waste)
-        waste_density = (total_waste_area / img_area) * 100 if img_area > 0 else 0
+        with timer.stage("serialize"):
+            detections = batch.to_dicts()
+            
+            # Calculate waste density (percentage of image covered by waste)
+            waste_density = batch.density(img_area)
+            
+            response_data = {
+                "detections": detections,
+                "processing_time": processing_time,
+                "class_counts": batch.class_counts(),
+                "waste_density": waste_density,
+                "quality": tier.describe() if tier else None
+            }
         
-        response_data = {
-            "detections": detections,
-            "processing_time": processing_time,
-            "class_counts": class_counts,
-            "waste_density": waste_density
-        }
+        if include_timings:
+            response_data["timings"] = timer.breakdown()
+        with timer.stage("encode"):
+            response = jsonify(response_data)
+        timer.observe()
         
         print(f"Processed image with {len(detections)} detections in {processing_time:.2f}s, waste density: {waste_density:.2f}%")
-        return jsonify(response_data)
+        return response
         
     except Exception as e:
         print(f"Error processing image: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
-def process_video(video_file, model, confidence_threshold=0.25):
+def process_video(video_file, model, confidence_threshold=0.25, sampling=None, scene_threshold=None, tier=None,
+                  timer=None, include_timings=False, tracking=None):
+    timer = timer or StageTimer()
     try:
         # Save the uploaded video to a temporary file
         temp_dir = tempfile.gettempdir()
         temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}.mp4")
-        video_file.save(temp_path)
-        
-        # Open the video file
-        cap = cv2.VideoCapture(temp_path)
-        if not cap.isOpened():
-            return jsonify({"error": "Could not open video file"}), 400
-        
-        # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        frame_area = frame_width * frame_height
-        
-        print(f"Video properties: {frame_count} frames at {fps} FPS, dimensions: {frame_width}x{frame_height}")
-        
-        # Process a sample of frames (e.g., every 30th frame)
-        sample_interval = max(1, int(frame_count / 10))  # Process ~10 frames
-        frames_to_process = list(range(0, frame_count, sample_interval))
+        with timer.stage("read"):
+            video_file.save(temp_path)
         
         # Start timing
         start_time = time.time()
         
-        all_detections = []
-        class_counts = {}
-        total_waste_area = 0
-        frames_processed = 0
-        
-        for frame_idx in frames_to_process:
-            # Set the frame position
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = cap.read()
-            
-            if not ret:
-                continue
-                
-            # Convert BGR to RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_pil = Image.fromarray(frame_rgb)
-            
-            # Run inference with YOLOv8
-            results = model(frame_pil, conf=confidence_threshold)
-            
-            frame_waste_area = 0
-            
-            # Process results for this frame
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    # Get box coordinates
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    # Get confidence
-                    conf = box.conf[0].item()
-                    # Get class
-                    cls = int(box.cls[0].item())
-                    # Get class name
-                    class_name = model.names[cls]
-                    
-                    # Calculate box area for density
-                    box_width = x2 - x1
-                    box_height = y2 - y1
-                    box_area = box_width * box_height
-                    frame_waste_area += box_area
-                    
-                    # Update class counts
-                    if class_name in class_counts:
-                        class_counts[class_name] += 1
-                    else:
-                        class_counts[class_name] = 1
-                    
-                    all_detections.append({
-                        "box": [float(x1), float(y1), float(x2 - x1), float(y2 - y1)],
-                        "class_name": class_name,
-                        "confidence": float(conf),
-                        "frame": frame_idx
-                    })
-            
-            total_waste_area += frame_waste_area
-            frames_processed += 1
-        
-        # Clean up
-        cap.release()
-        os.remove(temp_path)
+        # Decode, infer and postprocess the sampled frames
+        try:
+            result = process_video_file(temp_path, model, confidence_threshold, sampling, scene_threshold, tier, tracking)
+        except MediaError as e:
+            return jsonify({"error": str(e)}), 400
+        finally:
+            # Clean up, whether or not the video could be processed
+            os.remove(temp_path)
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
-        # Calculate average waste density across processed frames
-        avg_waste_density = (total_waste_area / (frame_area * frames_processed)) * 100 if frames_processed > 0 else 0
+        # Pipeline stages overlap, so these add up to more than the wall time
+        for stage, seconds in result["timings"].items():
+            timer.add(stage, seconds)
         
         # Prepare response
-        response_data = {
-            "detections": all_detections,
-            "processing_time": processing_time,
-            "class_counts": class_counts,
-            "waste_density": avg_waste_density,
-            "frame_count": frame_count,
-            "fps": fps
-        }
+        with timer.stage("serialize"):
+            detections = result["detections"].to_dicts()
+            response_data = {
+                "detections": detections,
+                "processing_time": processing_time,
+                "class_counts": result["class_counts"],
+                "waste_density": result["waste_density"],
+                "frame_count": result["frame_count"],
+                "fps": result["fps"],
+                "frames_inferred": result["frames_inferred"],
+                "frames_reused": result["frames_reused"],
+                "frames_tracked": result["frames_tracked"] or None,
+                "unique_counts": result["unique_counts"],
+                "tracks": result["tracks"],
+                "quality": tier.describe() if tier else None
+            }
+        
+        if include_timings:
+            response_data["timings"] = timer.breakdown()
+        with timer.stage("encode"):
+            response = jsonify(response_data)
+        timer.observe()
         
-        print(f"Processed video with {len(all_detections)} detections across {len(frames_to_process)} frames in {processing_time:.2f}s, avg waste density: {avg_waste_density:.2f}%")
-        return jsonify(response_data)
+        print(f"Processed video with {len(detections)} detections across {result['frames_sampled']} frames in {processing_time:.2f}s, avg waste density: {result['waste_density']:.2f}%")
+        return response
         
     except Exception as e:
         print(f"Error processing video: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype=CONTENT_TYPE)
+
 # Add a simple health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
         "status": "ok",
-        "models": {
-            "waste": {
-                "loaded": waste_model is not None,
-                "path": waste_model_path,
-                "exists": waste_model_exists
-            },
-            "drone": {
-                "loaded": drone_model is not None,
-                "path": drone_model_path,
-                "exists": drone_model_exists
-            }
-        }
+        "models": registry.status(),
+        "registry": registry.describe()
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,427 @@
+"""Offline batch detection over directories of images and videos.
+
+Walks the given files and directories (expanding zip/tar archives), shards
+the work across a pool of worker processes that each load the model once,
+and writes one row per file with the fields of a /detect response to CSV or
+Parquet. Finished files are recorded in a manifest next to the output, so
+running the same command again after an interruption picks up where it
+stopped.
+
+    python batch_cli.py /data/survey --output survey.csv
+    python batch_cli.py /data/archive --model drone --workers 8 --output archive.parquet
+
+Rows are written before their files are marked done, so a crash between the
+two can repeat the last few files' rows on resume, but never loses any.
+
+CSV output needs nothing beyond the backend's requirements. Parquet output
+needs the optional pyarrow package (pip install pyarrow).
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from batch_input import ARCHIVE_SUFFIXES, iter_archive
+from frame_sampler import SamplingStrategy
+from postprocess import DetectionBatch
+from quality import QualityTier, resolve_tier
+from scene_gate import DEFAULT_SCENE_THRESHOLD
+from stages import decode_image, decode_target_size, get_worker_model, original_scale, process_video_file, run_model
+from tracking import TRACK_KEYFRAME_INTERVAL, TrackingOptions
+
+# Parquet output needs pyarrow; CSV works without it
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+VIDEO_SUFFIXES = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v", ".mpg", ".mpeg", ".ts")
+
+# A /detect response's fields, with the nested ones stored as JSON
+COLUMNS = ["path", "media_type", "detections", "detection_count", "processing_time", "class_counts",
+           "waste_density", "frame_count", "fps", "frames_inferred", "frames_reused", "frames_tracked",
+           "unique_counts", "tracks", "quality", "error"]
+JSON_COLUMNS = {"detections", "class_counts", "unique_counts", "tracks", "quality"}
+
+# A unit of work: ("images", [paths]), ("video", [path]) or ("archive", [path])
+Task = Tuple[str, List[str]]
+
+
+def media_type(path: str) -> Optional[str]:
+    name = path.lower()
+    if name.endswith(IMAGE_SUFFIXES):
+        return "image"
+    if name.endswith(VIDEO_SUFFIXES):
+        return "video"
+    if name.endswith(ARCHIVE_SUFFIXES):
+        return "archive"
+    return None
+
+
+def walk(paths: List[str]) -> Iterator[str]:
+    """Every file under the given files and directories, in a stable order"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if not name.startswith("."):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def plan_tasks(paths: List[str], done: Set[str], images_per_task: int) -> Iterator[Task]:
+    """Group the files not yet done into tasks; images are batched so workers run them through the model together"""
+    images = []
+    for path in walk(paths):
+        kind = media_type(path)
+        if kind is None or path in done:
+            continue
+        if kind == "image":
+            images.append(path)
+            if len(images) >= images_per_task:
+                yield "images", images
+                images = []
+        else:
+            yield kind, [path]
+    if images:
+        yield "images", images
+
+
+# Settings and model of this worker process, set by _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(settings: Dict[str, Any], torch_threads: int):
+    # One intra-op thread per worker by default, so throughput scales with processes rather than threads
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except Exception as e:
+        print(f"Could not set torch threads in worker: {e}")
+    try:
+        import cv2
+        cv2.setNumThreads(torch_threads)
+    except Exception:
+        pass
+    _worker.update(
+        settings,
+        tier=QualityTier(**settings["tier"]),
+        sampling=SamplingStrategy(**settings["sampling"]),
+        tracking=TrackingOptions(**settings["tracking"]) if settings["tracking"] else None,
+    )
+    # Load the model up front rather than on the first task
+    get_worker_model(settings["model_path"])
+
+
+def _row(path: str, media: str, **fields) -> Dict[str, Any]:
+    row = dict.fromkeys(COLUMNS)
+    row.update(path=path, media_type=media, **fields)
+    return row
+
+
+def _detect_images(items: List[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+    # Decode each image, then run the model once over all of them
+    rows, decoded = [], []
+    for name, contents in items:
+        try:
+            decoded.append((name, *decode_image(contents, decode_target_size(_worker["tier"]))))
+        except Exception as e:
+            rows.append(_row(name, "image", error=str(e)))
+    if not decoded:
+        return rows
+    start_time = time.time()
+    results = run_model(_worker["model_path"], [img for _, img, _ in decoded], _worker["confidence"], _worker["tier"])
+    processing_time = (time.time() - start_time) / len(decoded)
+    for (name, img, original_size), result in zip(decoded, results):
+        batch = DetectionBatch.from_results([result]).scaled(*original_scale(img, original_size))
+        rows.append(_row(
+            name, "image",
+            detections=batch.to_dicts() if _worker["keep_detections"] else None,
+            detection_count=len(batch),
+            processing_time=processing_time,
+            class_counts=batch.class_counts(),
+            waste_density=batch.density(original_size[0] * original_size[1]),
+            quality=_worker["quality"],
+        ))
+    return rows
+
+
+def _detect_video(name: str, path: str) -> Dict[str, Any]:
+    start_time = time.time()
+    try:
+        result = process_video_file(path, _worker["model_path"], _worker["confidence"], _worker["sampling"],
+                                    _worker["scene_threshold"], _worker["tier"], _worker["tracking"])
+    except Exception as e:
+        return _row(name, "video", error=str(e))
+    detections = result["detections"]
+    return _row(
+        name, "video",
+        detections=detections.to_dicts() if _worker["keep_detections"] else None,
+        detection_count=result["detection_count"],
+        processing_time=time.time() - start_time,
+        class_counts=result["class_counts"],
+        waste_density=result["waste_density"],
+        frame_count=result["frame_count"],
+        fps=result["fps"],
+        frames_inferred=result["frames_inferred"],
+        frames_reused=result["frames_reused"],
+        frames_tracked=result["frames_tracked"] or None,
+        unique_counts=result["unique_counts"],
+        tracks=result["tracks"],
+        quality=_worker["quality"],
+    )
+
+
+def _detect_archive(path: str) -> List[Dict[str, Any]]:
+    # Members are named archive/member; videos are written out, since the decoder needs a file
+    rows, images = [], []
+    with open(path, "rb") as f:
+        for member, contents, error in iter_archive(path, f):
+            name = f"{path}/{member}"
+            kind = media_type(member)
+            if error is not None:
+                rows.append(_row(name, kind or "unknown", error=error))
+            elif kind == "image":
+                images.append((name, contents))
+                if len(images) >= _worker["images_per_task"]:
+                    rows += _detect_images(images)
+                    images = []
+            elif kind == "video":
+                with tempfile.NamedTemporaryFile(suffix=os.path.splitext(member)[1]) as video:
+                    video.write(contents)
+                    video.flush()
+                    rows.append(_detect_video(name, video.name))
+    return rows + _detect_images(images)
+
+
+def run_task(task: Task) -> Tuple[Task, List[Dict[str, Any]]]:
+    """Process one task on a worker, returning rows; a failure becomes an error row per file"""
+    kind, paths = task
+    try:
+        if kind == "images":
+            rows, items = [], []
+            for path in paths:
+                try:
+                    with open(path, "rb") as f:
+                        items.append((path, f.read()))
+                except OSError as e:
+                    rows.append(_row(path, "image", error=str(e)))
+            return task, rows + _detect_images(items)
+        if kind == "video":
+            return task, [_detect_video(paths[0], paths[0])]
+        return task, _detect_archive(paths[0])
+    except Exception as e:
+        # Inference over the whole batch, or a broken archive, fails every file of the task
+        return task, [_row(path, "image" if kind == "images" else kind, error=str(e)) for path in paths]
+
+
+def read_manifest(path: str, retry_failed: bool) -> Set[str]:
+    """Files a previous run finished (or gave up on, unless retrying those)"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by a crash; that file is simply redone
+                continue
+            if entry["status"] == "done" or not retry_failed:
+                done.add(entry["path"])
+            else:
+                done.discard(entry["path"])
+    return done
+
+
+def _serialize(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: json.dumps(value) if name in JSON_COLUMNS and value is not None else value
+            for name, value in row.items()}
+
+
+class CsvOutput:
+    """Appends rows to a CSV file, writing the header only once"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, rows: List[Dict[str, Any]]):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            if new:
+                writer.writeheader()
+            writer.writerows(_serialize(row) for row in rows)
+
+
+class ParquetOutput:
+    """Writes rows as numbered part files in a directory, which readers treat as one table"""
+
+    def __init__(self, path: str):
+        if pyarrow is None:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow); use a .csv output instead")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.part = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+        text, number, count = pyarrow.string(), pyarrow.float64(), pyarrow.int64()
+        self.schema = pyarrow.schema([
+            (name, count if name in ("detection_count", "frame_count", "frames_inferred", "frames_reused", "frames_tracked")
+             else number if name in ("processing_time", "waste_density", "fps") else text)
+            for name in COLUMNS
+        ])
+
+    def write(self, rows: List[Dict[str, Any]]):
+        table = pyarrow.Table.from_pylist([_serialize(row) for row in rows], schema=self.schema)
+        pyarrow.parquet.write_table(table, os.path.join(self.path, f"part-{self.part:05d}.parquet"))
+        self.part += 1
+
+
+def open_output(path: str, output_format: Optional[str]):
+    output_format = output_format or ("parquet" if path.lower().endswith(".parquet") else "csv")
+    return ParquetOutput(path) if output_format == "parquet" else CsvOutput(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect objects in directories of images and videos offline")
+    parser.add_argument("paths", nargs="+", help="Files, directories or zip/tar archives to process")
+    parser.add_argument("--output", required=True, help="CSV file, or Parquet directory when ending in .parquet")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="Output format, instead of going by the extension")
+    parser.add_argument("--manifest", help="Checkpoint of finished files (default: <output>.manifest.jsonl)")
+    parser.add_argument("--retry-failed", action="store_true", help="Process files that failed in a previous run again")
+    parser.add_argument("--model", default="yolo", help="Model id or alias (from MODEL_CONFIG), or a weights path")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes, each with its own model")
+    parser.add_argument("--torch-threads", type=int, help="Torch threads per worker (default: cores / workers)")
+    parser.add_argument("--images-per-task", type=int, default=16, help="Images a worker runs through the model at once")
+    parser.add_argument("--flush-every", type=int, default=50, help="Tasks between writes of the output and manifest")
+    parser.add_argument("--confidence", type=float, default=0.25)
+    parser.add_argument("--quality", help="Quality tier (fast, balanced, full)")
+    parser.add_argument("--imgsz", type=int)
+    parser.add_argument("--max-det", type=int)
+    parser.add_argument("--int8", action="store_true", default=None)
+    parser.add_argument("--sample-fps", type=float)
+    parser.add_argument("--sample-stride", type=int)
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--scene-gate", action="store_true", help="Reuse detections on near-duplicate video frames")
+    parser.add_argument("--scene-threshold", type=float, default=DEFAULT_SCENE_THRESHOLD)
+    parser.add_argument("--track", action="store_true", help="Track objects through videos, inferring on keyframes only")
+    parser.add_argument("--keyframe-interval", type=int)
+    parser.add_argument("--summary-only", action="store_true", help="Leave out the per-box detections column")
+    args = parser.parse_args()
+
+    try:
+        tier = resolve_tier(args.quality, args.imgsz, args.max_det, args.int8)
+        sampling = SamplingStrategy(args.sample_fps, args.sample_stride, args.max_frames)
+        tracking = TrackingOptions(args.keyframe_interval or TRACK_KEYFRAME_INTERVAL) if args.track else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        output = open_output(args.output, args.format)
+    except RuntimeError as e:
+        parser.error(str(e))
+
+    manifest_path = args.manifest or f"{args.output.rstrip(os.sep)}.manifest.jsonl"
+    done = read_manifest(manifest_path, args.retry_failed)
+    if done:
+        print(f"Resuming: {len(done)} files already processed according to {manifest_path}")
+    images_per_task = max(1, args.images_per_task)
+    tasks = plan_tasks(args.paths, done, images_per_task)
+    # Nothing left to do means no model to load and no pool to start
+    first_task = next(tasks, None)
+    if first_task is None:
+        print(f"Nothing to process; all files are done according to {manifest_path}")
+        return 0
+    tasks = itertools.chain([first_task], tasks)
+
+    if os.path.exists(args.model):
+        model_path, precision = args.model, "fp32"
+    else:
+        from model_registry import ModelUnavailableError, UnknownModelError, registry_from_env
+        # Only the workers need the model, so the registry just resolves the file to load (exporting it if needed)
+        registry = registry_from_env(worker_loader=lambda ref: 0)
+        try:
+            model_path, precision = registry.get(args.model).runtime_path(tier.int8)
+        except (UnknownModelError, ModelUnavailableError) as e:
+            parser.error(str(e))
+
+    workers = max(1, args.workers)
+    torch_threads = max(1, args.torch_threads or (os.cpu_count() or 1) // workers)
+    settings = {
+        "model_path": model_path,
+        "confidence": args.confidence,
+        "tier": {"name": tier.name, "imgsz": tier.imgsz, "max_det": tier.max_det, "int8": tier.int8},
+        "quality": tier.describe(precision),
+        "sampling": {"target_fps": sampling.target_fps, "stride": sampling.stride, "max_frames": sampling.max_frames},
+        "scene_threshold": args.scene_threshold if args.scene_gate else None,
+        "tracking": vars(tracking) if tracking else None,
+        "keep_detections": not args.summary_only,
+        "images_per_task": images_per_task,
+    }
+
+    print(f"Processing with {workers} workers x {torch_threads} torch threads, model {model_path}")
+    rows: List[Dict[str, Any]] = []
+    finished: List[Dict[str, str]] = []
+    files = failed = pending = 0
+    start_time = time.time()
+
+    def flush():
+        # Rows first, then the manifest, so a file is never marked done without its rows
+        if rows:
+            output.write(rows)
+        with open(manifest_path, "a") as f:
+            for entry in finished:
+                f.write(json.dumps(entry) + "\n")
+        rows.clear()
+        finished.clear()
+
+    if workers == 1:
+        _init_worker(settings, torch_threads)
+        pool = None
+        results = map(run_task, tasks)
+    else:
+        # spawn avoids forking a parent that already holds torch/OpenMP threads
+        pool = multiprocessing.get_context("spawn").Pool(workers, initializer=_init_worker,
+                                                          initargs=(settings, torch_threads))
+        results = pool.imap_unordered(run_task, tasks)
+    try:
+        for (kind, paths), task_rows in results:
+            rows.extend(task_rows)
+            errors = {row["path"] for row in task_rows if row["error"]}
+            # Archives are checkpointed as a whole
+            failed_task = kind == "archive" and bool(task_rows) and len(errors) == len(task_rows)
+            for path in paths:
+                finished.append({"path": path, "status": "failed" if path in errors or failed_task else "done"})
+            files += len(task_rows)
+            failed += len(errors)
+            pending += 1
+            if pending >= args.flush_every:
+                flush()
+                pending = 0
+                elapsed = time.time() - start_time
+                print(f"{files} files ({failed} failed) in {elapsed:.0f}s, {files / elapsed:.1f} files/s")
+    except KeyboardInterrupt:
+        print("Interrupted; saving progress")
+    finally:
+        flush()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    elapsed = time.time() - start_time
+    print(f"Done: {files} files ({failed} failed) in {elapsed:.1f}s, {files / max(elapsed, 1e-9):.1f} files/s. "
+          f"Results in {args.output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
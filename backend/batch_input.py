@@ -0,0 +1,113 @@
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+# Most files accepted by one batch request, counting archive members
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 1000))
+# Archive members larger than this are reported as failed instead of being read
+BATCH_MAX_FILE_BYTES = int(os.environ.get('BATCH_MAX_FILE_BYTES', 50 * 1024 * 1024))
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# (filename, contents, error); contents is None when the file was skipped with an error
+BatchItem = Tuple[str, Optional[bytes], Optional[str]]
+
+
+class BatchInputError(ValueError):
+    """Raised when a batch upload can't be read"""
+
+
+class TooManyFilesError(BatchInputError):
+    """Raised when a batch upload holds more than the allowed number of files"""
+
+
+def is_archive(filename: str, fileobj: BinaryIO) -> bool:
+    if (filename or "").lower().endswith(ARCHIVE_SUFFIXES):
+        return True
+    # Zip archives uploaded without an extension
+    is_zip = zipfile.is_zipfile(fileobj)
+    fileobj.seek(0)
+    return is_zip
+
+
+def _skip(name: str) -> bool:
+    # Directories and the metadata macOS adds to zips
+    base = os.path.basename(name.rstrip("/"))
+    return not base or base.startswith(".") or name.startswith("__MACOSX/")
+
+
+def _zip_files(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return [info for info in archive.infolist() if not info.is_dir() and not _skip(info.filename)]
+
+
+def iter_archive(filename: str, fileobj: BinaryIO, max_file_bytes: int = BATCH_MAX_FILE_BYTES) -> Iterator[BatchItem]:
+    """Yield an archive's files one at a time, reading each member only when it's reached.
+
+    Zips are read through their central directory; tars are read as a stream,
+    so even compressed tars are never held in memory whole.
+    """
+    try:
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in _zip_files(archive):
+                    if info.file_size > max_file_bytes:
+                        yield info.filename, None, f"File is larger than {max_file_bytes} bytes"
+                        continue
+                    yield info.filename, archive.read(info), None
+            return
+        fileobj.seek(0)
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or _skip(member.name):
+                    continue
+                if member.size > max_file_bytes:
+                    yield member.name, None, f"File is larger than {max_file_bytes} bytes"
+                    continue
+                yield member.name, archive.extractfile(member).read(), None
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        raise BatchInputError(f"Could not read archive {filename}: {e}")
+
+
+def iter_batch_inputs(uploads: List[Tuple[str, BinaryIO]], max_files: int = BATCH_MAX_FILES,
+                      max_file_bytes: int = BATCH_MAX_FILE_BYTES) -> Iterator[BatchItem]:
+    """Yield every file in a batch upload, expanding archives in place"""
+    # Zips list their members up front, so most oversized batches are refused before any work.
+    # Tars can only be counted as they're read.
+    known = 0
+    for filename, fileobj in uploads:
+        if not is_archive(filename, fileobj):
+            known += 1
+        elif zipfile.is_zipfile(fileobj):
+            try:
+                with zipfile.ZipFile(fileobj) as archive:
+                    known += len(_zip_files(archive))
+            except zipfile.BadZipFile:
+                # Reported when the archive is read
+                pass
+        fileobj.seek(0)
+    if known > max_files:
+        raise TooManyFilesError(f"Batch has more than {max_files} files")
+    
+    count = 0
+    for filename, fileobj in uploads:
+        if is_archive(filename, fileobj):
+            items = iter_archive(filename, fileobj, max_file_bytes)
+        else:
+            items = iter([(filename, fileobj.read(), None)])
+        for item in items:
+            count += 1
+            if count > max_files:
+                raise TooManyFilesError(f"Batch has more than {max_files} files")
+            yield item
+
+
+def take(items: Iterator[BatchItem], count: int) -> List[BatchItem]:
+    """The next `count` items (fewer at the end)"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= count:
+            break
+    return chunk
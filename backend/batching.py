@@ -0,0 +1,174 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+class BatchStats:
+    """Running statistics for a micro-batcher"""
+
+    def __init__(self, window: int = 1000):
+        self.batches = 0
+        self.requests = 0
+        self.max_batch_size_seen = 0
+        self.total_inference_time = 0.0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        # Keep a window of recent queue waits for percentile estimates
+        self.recent_waits = deque(maxlen=window)
+
+    def record(self, batch_size: int, waits: List[float], inference_time: float):
+        self.batches += 1
+        self.requests += batch_size
+        self.max_batch_size_seen = max(self.max_batch_size_seen, batch_size)
+        self.total_inference_time += inference_time
+        for wait in waits:
+            self.total_queue_wait += wait
+            self.max_queue_wait = max(self.max_queue_wait, wait)
+            self.recent_waits.append(wait)
+
+    def snapshot(self) -> Dict[str, float]:
+        waits = sorted(self.recent_waits)
+        p95_wait = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "max_batch_size_seen": self.max_batch_size_seen,
+            "mean_inference_ms": (self.total_inference_time / self.batches) * 1000 if self.batches else 0.0,
+            "mean_queue_wait_ms": (self.total_queue_wait / self.requests) * 1000 if self.requests else 0.0,
+            "p95_queue_wait_ms": p95_wait * 1000,
+            "max_queue_wait_ms": self.max_queue_wait * 1000,
+        }
+
+
+class _PendingRequest:
+    def __init__(self, image: Any, confidence: float, future: asyncio.Future):
+        self.image = image
+        self.confidence = confidence
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collects concurrent single-image inference requests into batched model calls.
+
+    `infer_fn(images, conf)` must run the model on a list of images and return
+    one result per image. It runs on `executor` (a StageExecutor) when given,
+    otherwise on the event loop's default thread pool. Each batch is run at
+    the lowest confidence requested in it, and the detections are then
+    filtered back to each caller's own threshold, so callers see exactly what
+    a solo call would have returned.
+
+    Up to `max_in_flight` batches (by default one per executor worker) run at
+    once; the next batch is collected while earlier ones are inferred.
+    """
+
+    def __init__(self, infer_fn: Callable[[List[Any], float], List[Any]], max_batch_size: int = 8,
+                 max_wait_ms: float = 10.0, name: str = "model", executor=None,
+                 max_in_flight: Optional[int] = None):
+        self.infer_fn = infer_fn
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_in_flight = max(1, max_in_flight or (executor.workers if executor is not None else 1))
+        self.name = name
+        self.stats = BatchStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Batches being inferred, kept referenced until they finish
+        self._batches: Set[asyncio.Task] = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, image: Any, confidence: float):
+        """Queue one image for inference and wait for its result"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingRequest(image, confidence, future))
+        return await future
+
+    async def _collect_batch(self) -> List[_PendingRequest]:
+        # Block for the first request, then fill the batch until it is full
+        # or the oldest request has waited max_wait
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _infer(self, images: List[Any], conf: float):
+        if self.executor is not None:
+            return await self.executor.run(self.infer_fn, images, conf)
+        return await asyncio.get_running_loop().run_in_executor(None, self.infer_fn, images, conf)
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first, so requests keep filling the next batch while all are busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Drop requests whose callers have gone away (e.g. client disconnect)
+            batch = [req for req in batch if not req.future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: List[_PendingRequest]):
+        try:
+            dispatched_at = time.perf_counter()
+            waits = [dispatched_at - req.enqueued_at for req in batch]
+            batch_conf = min(req.confidence for req in batch)
+            images = [req.image for req in batch]
+
+            try:
+                results = await self._infer(images, batch_conf)
+            except Exception as e:
+                print(f"Batched inference failed for {self.name}: {e}")
+                traceback.print_exc()
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+                return
+
+            self.stats.record(len(batch), waits, time.perf_counter() - dispatched_at)
+
+            for req, result in zip(batch, results):
+                if req.future.done():
+                    continue
+                if req.confidence > batch_conf:
+                    result = filter_by_confidence(result, req.confidence)
+                req.future.set_result([result])
+        finally:
+            self._slots.release()
+
+
+def filter_by_confidence(result, confidence: float):
+    """Drop detections below `confidence` from an ultralytics Results object"""
+    if result.boxes is None or len(result.boxes) == 0:
+        return result
+    return result[result.boxes.conf >= confidence]
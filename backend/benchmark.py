@@ -0,0 +1,485 @@
+"""Offline benchmark for the detection service.
+
+Generates synthetic images and videos, drives the Flask and FastAPI apps
+in-process at a set concurrency and reports throughput and p50/p95/p99
+latency, both end to end and for the individual pipeline stages. Results are
+written to JSON; pass a previous run with --compare to flag regressions.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --compare bench.json
+
+By default a stub model with fixed per-call and per-image costs stands in for
+YOLO, so timings measure the service rather than the weights. Use --model to
+benchmark real weights instead.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from ultralytics.engine.results import Results
+
+
+class StubModel:
+    """Stands in for a YOLO model with deterministic output and timing.
+
+    Each call sleeps `call_ms` plus `image_ms` per image (sleeping releases the
+    GIL, as torch does during inference) and returns `boxes` detections per
+    image, placed by a seed derived from the image size.
+    """
+
+    def __init__(self, call_ms: float = 5.0, image_ms: float = 20.0, boxes: int = 8,
+                 names: Optional[Dict[int, str]] = None):
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+        self.boxes = boxes
+        self.names = names or {0: "plastic", 1: "metal", 2: "paper", 3: "glass"}
+
+    def __call__(self, source, conf: float = 0.25, max_det: int = 300, **kwargs) -> List[Results]:
+        images = source if isinstance(source, list) else [source]
+        time.sleep((self.call_ms + self.image_ms * len(images)) / 1000)
+        return [self._result(image, conf, max_det) for image in images]
+
+    def _result(self, image, conf: float, max_det: int) -> Results:
+        width, height = image.size if isinstance(image, Image.Image) else (image.shape[1], image.shape[0])
+        rng = np.random.default_rng(width * 100003 + height)
+        x1 = rng.uniform(0, width * 0.8, self.boxes)
+        y1 = rng.uniform(0, height * 0.8, self.boxes)
+        w = rng.uniform(0.02, 0.2, self.boxes) * width
+        h = rng.uniform(0.02, 0.2, self.boxes) * height
+        scores = np.linspace(0.95, 0.1, self.boxes)
+        classes = np.arange(self.boxes) % len(self.names)
+        data = np.stack([x1, y1, np.minimum(x1 + w, width), np.minimum(y1 + h, height), scores, classes], axis=1)
+        data = data[scores >= conf][:max_det]
+        # Results only reads the image's shape, so a zero-stride view avoids allocating one
+        orig_img = np.broadcast_to(np.zeros(1, np.uint8), (height, width, 3))
+        return Results(orig_img, path="", names=self.names, boxes=torch.from_numpy(data.astype(np.float32)))
+
+
+# Synthetic media
+
+
+def parse_sizes(text: str) -> List[Tuple[int, int]]:
+    return [tuple(int(v) for v in size.split("x")) for size in text.split(",") if size]
+
+
+def synthetic_frame(width: int, height: int, t: float, rng: np.random.Generator) -> np.ndarray:
+    """A BGR frame with a gradient background and rectangles drifting with `t`"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), np.uint8)
+    frame[:, :, 0] = (x * 0.5 + y * 0.3).astype(np.uint8)
+    frame[:, :, 1] = (y * 0.6 + 40).astype(np.uint8)
+    frame[:, :, 2] = (255 - x * 0.4).astype(np.uint8)
+    for i in range(12):
+        cx = int((rng.uniform(0, 1) + 0.05 * t * (i % 3 + 1)) % 1 * width)
+        cy = int(rng.uniform(0, 1) * height)
+        size = int(rng.uniform(0.03, 0.12) * min(width, height))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(frame, (cx, cy), (cx + size, cy + size), color, -1)
+    return frame
+
+
+def make_image(width: int, height: int, seed: int = 0) -> bytes:
+    frame = synthetic_frame(width, height, 0.0, np.random.default_rng(seed))
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def make_video(path: str, width: int, height: int, seconds: float, fps: float = 25.0, seed: int = 0) -> str:
+    if os.path.exists(path):
+        return path
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(int(seconds * fps)):
+        # Same seed every frame so the rectangles move rather than jump
+        writer.write(synthetic_frame(width, height, i / fps, np.random.default_rng(seed)))
+    writer.release()
+    return path
+
+
+# Measurement
+
+
+def summarize(latencies: List[float], wall_time: float, errors: int = 0) -> Dict[str, Any]:
+    """Throughput and latency percentiles (in ms) for a list of latencies in seconds"""
+    ms = np.array(latencies) * 1000
+    summary = {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput_per_s": len(latencies) / wall_time if wall_time > 0 else 0.0,
+    }
+    if len(ms):
+        summary.update({
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+        })
+    return summary
+
+
+def time_stage(fn: Callable[[], Any], iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def frame_handoff(path: str, reuse_buffers: bool) -> Tuple[int, List[int]]:
+    """Decode every frame of a video into what the model is handed, as the video path did
+    before (RGB PIL images, turned back into BGR arrays by ultralytics) or does now (BGR
+    arrays read into recycled buffers). Returns the frame count and bytes allocated per frame."""
+    from frame_sampler import FramePool, FrameSampler
+
+    cap = cv2.VideoCapture(path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    sampler = FrameSampler(cap, list(range(frame_count)), pool=FramePool(2) if reuse_buffers else None)
+    allocated = []
+    tracing = tracemalloc.is_tracing()
+    before = tracemalloc.get_traced_memory()[0] if tracing else 0
+    try:
+        for _, frame in sampler:
+            if reuse_buffers:
+                image = frame
+            else:
+                image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                image = np.ascontiguousarray(np.asarray(image)[..., ::-1])
+            if tracing:
+                # Peak since the last frame: everything this frame's read and handoff allocated
+                allocated.append(tracemalloc.get_traced_memory()[1] - before)
+                del image
+                sampler.release(frame)
+                del frame
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            else:
+                sampler.release(frame)
+    finally:
+        cap.release()
+    return sampler.reads, allocated
+
+
+def bench_frame_handoff(videos: Dict[str, str], iterations: int) -> List[Dict[str, Any]]:
+    """Compare per-frame latency and memory traffic of the old and new decode-to-model handoff"""
+    results = []
+    for name, path in videos.items():
+        for stage, reuse_buffers in (("handoff_pil", False), ("handoff_bgr", True)):
+            tracemalloc.start()
+            try:
+                frames, allocated = frame_handoff(path, reuse_buffers)
+            finally:
+                tracemalloc.stop()
+            timing = time_stage(lambda: frame_handoff(path, reuse_buffers), max(1, iterations // 5))
+            results.append({
+                "stage": stage,
+                "media": name,
+                **timing,
+                "frames": frames,
+                "ms_per_frame": timing["p50_ms"] / max(1, frames),
+                # Skips the first frames, which fill the buffer pool
+                "bytes_per_frame": float(np.mean(allocated[2:] or allocated)) if allocated else 0.0,
+            })
+    return results
+
+
+def bench_stages(images: Dict[str, bytes], videos: Dict[str, str], model, iterations: int) -> List[Dict[str, Any]]:
+    """Time decode, inference and postprocessing on their own, outside any web framework"""
+    from encoding import COLUMNAR_JSON, MSGPACK, encode
+    from postprocess import DetectionBatch
+    from stages import decode_image, original_scale, process_video_file, run_model
+
+    results = []
+    for name, contents in images.items():
+        img, original_size = decode_image(contents)
+        model_results = run_model(model, img, 0.25)
+        batch = DetectionBatch.from_results(model_results, model.names)
+        stages = {
+            "decode": lambda: decode_image(contents),
+            "inference": lambda: run_model(model, img, 0.25),
+            "postprocess": lambda: DetectionBatch.from_results(model_results, model.names)
+                .scaled(*original_scale(img, original_size)).to_dicts(),
+            "encode": lambda: json.dumps(batch.to_dicts()),
+            "encode_columnar": lambda: encode(batch.to_columns(), COLUMNAR_JSON),
+            "encode_msgpack": lambda: encode(batch.to_columns(), MSGPACK),
+        }
+        for stage, fn in stages.items():
+            results.append({"stage": stage, "media": name, **time_stage(fn, iterations)})
+    for name, path in videos.items():
+        results.append({"stage": "video", "media": name,
+                        **time_stage(lambda: process_video_file(path, model, 0.25), max(1, iterations // 5))})
+    return results + bench_frame_handoff(videos, iterations)
+
+
+def request_fields(media: str, extra: Dict[str, str]) -> Dict[str, str]:
+    return {"model": "yolo", "confidence": "0.25", "media_type": media, "timings": "true", **extra}
+
+
+async def bench_fastapi(scenarios, concurrency_levels: List[int], requests: int, warmup: int) -> List[Dict[str, Any]]:
+    import httpx
+    import fastapi_app
+
+    results = []
+    # One lifespan for every run, since shutting it down also stops the stage executor
+    async with fastapi_app.lifespan(fastapi_app.app):
+        transport = httpx.ASGITransport(app=fastapi_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            for concurrency, (name, media, filename, contents, extra) in (
+                    (c, scenario) for c in concurrency_levels for scenario in scenarios):
+                print(f"  fastapi {name} at concurrency {concurrency}")
+                async def send():
+                    t = time.perf_counter()
+                    response = await client.post("/detect", files={"file": (filename, contents)},
+                                                 data=request_fields(media, extra))
+                    return time.perf_counter() - t, response
+
+                for _ in range(warmup):
+                    await send()
+                limit = asyncio.Semaphore(concurrency)
+
+                async def limited():
+                    async with limit:
+                        return await send()
+
+                start = time.perf_counter()
+                responses = await asyncio.gather(*[limited() for _ in range(requests)])
+                results.append(scenario_result("fastapi", name, concurrency, responses, time.perf_counter() - start))
+    return results
+
+
+def bench_flask(scenarios, concurrency_levels: List[int], requests: int, warmup: int) -> List[Dict[str, Any]]:
+    import app as flask_app
+
+    local = threading.local()
+    results = []
+    for concurrency, (name, media, filename, contents, extra) in (
+            (c, scenario) for c in concurrency_levels for scenario in scenarios):
+        print(f"  flask {name} at concurrency {concurrency}")
+        def send():
+            # Test clients aren't shared between threads
+            if not hasattr(local, "client"):
+                local.client = flask_app.app.test_client()
+            t = time.perf_counter()
+            response = local.client.post("/detect", data={"file": (io.BytesIO(contents), filename),
+                                                          **request_fields(media, extra)})
+            return time.perf_counter() - t, response
+
+        for _ in range(warmup):
+            send()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            start = time.perf_counter()
+            responses = list(pool.map(lambda _: send(), range(requests)))
+            results.append(scenario_result("flask", name, concurrency, responses, time.perf_counter() - start))
+    return results
+
+
+def scenario_result(target: str, name: str, concurrency: int, responses, wall_time: float) -> Dict[str, Any]:
+    ok = [(latency, r) for latency, r in responses if r.status_code == 200]
+    # Flask test responses have get_json(), httpx responses json()
+    bodies = [r.get_json() if hasattr(r, "get_json") else r.json() for _, r in ok]
+    stage_latencies: Dict[str, List[float]] = {}
+    for body in bodies:
+        for stage, ms in (body.get("timings") or {}).items():
+            stage_latencies.setdefault(stage, []).append(ms / 1000)
+    return {
+        "target": target,
+        "scenario": name,
+        "concurrency": concurrency,
+        "request": summarize([latency for latency, _ in ok], wall_time, errors=len(responses) - len(ok)),
+        # Time the app reports for its own work; the rest is upload, routing and encoding
+        "server": summarize([body["processing_time"] for body in bodies], wall_time),
+        # The app's own per-stage timings for each request
+        "server_stages": {stage: summarize(values, wall_time) for stage, values in stage_latencies.items()},
+    }
+
+
+# Comparison
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    if "stage" in result:
+        return f"stage/{result['stage']}/{result['media']}"
+    return f"{result['target']}/{result['scenario']}/c{result['concurrency']}"
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """Describe results whose p95 latency or throughput got worse by more than `max_regression`"""
+    def index(run):
+        entries = {}
+        for result in run["stages"]:
+            entries[result_key(result)] = result
+        for result in run["requests"]:
+            entries[result_key(result)] = result["request"]
+        return entries
+
+    old, new = index(baseline), index(current)
+    regressions = []
+    print(f"\n{'benchmark':<48} {'p95 ms':>18} {'throughput/s':>20}")
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        if "p95_ms" not in before or "p95_ms" not in after:
+            continue
+        p95_change = after["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        tput_change = after["throughput_per_s"] / before["throughput_per_s"] - 1 if before["throughput_per_s"] else 0.0
+        print(f"{key:<48} {after['p95_ms']:>9.1f} ({p95_change:+6.1%}) {after['throughput_per_s']:>10.1f} ({tput_change:+6.1%})")
+        if p95_change > max_regression or tput_change < -max_regression:
+            regressions.append(f"{key}: p95 {p95_change:+.1%}, throughput {tput_change:+.1%}")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_summary(run: Dict[str, Any]):
+    print(f"\n{'stage':<14} {'media':<22} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+    for r in run["stages"]:
+        print(f"{r['stage']:<14} {r['media']:<22} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['throughput_per_s']:>9.1f}")
+    handoffs = [r for r in run["stages"] if "bytes_per_frame" in r]
+    if handoffs:
+        print(f"\n{'handoff':<14} {'media':<22} {'ms/frame':>9} {'KB/frame':>9}")
+        for r in handoffs:
+            print(f"{r['stage']:<14} {r['media']:<22} {r['ms_per_frame']:>9.2f} {r['bytes_per_frame'] / 1024:>9.0f}")
+    print(f"\n{'target':<8} {'scenario':<22} {'conc':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>6}")
+    for r in run["requests"]:
+        q = r["request"]
+        print(f"{r['target']:<8} {r['scenario']:<22} {r['concurrency']:>4} {q.get('p50_ms', 0):>9.1f} "
+              f"{q.get('p95_ms', 0):>9.1f} {q.get('p99_ms', 0):>9.1f} {q['throughput_per_s']:>9.1f} {q['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection service offline")
+    parser.add_argument("--targets", default="fastapi,flask", help="Apps to drive (fastapi, flask)")
+    parser.add_argument("--image-sizes", default="640x480,1920x1080,4000x3000", help="Synthetic image sizes (WxH,...)")
+    parser.add_argument("--video-sizes", default="640x360,1280x720", help="Synthetic video sizes (WxH,...)")
+    parser.add_argument("--video-seconds", default="2,10", help="Synthetic video durations in seconds")
+    parser.add_argument("--concurrency", default="1,4", help="Concurrent requests per scenario (comma-separated)")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before each scenario")
+    parser.add_argument("--stage-iterations", type=int, default=20, help="Iterations per stage benchmark")
+    parser.add_argument("--model", help="Real weights to benchmark instead of the stub model")
+    parser.add_argument("--stub-call-ms", type=float, default=5.0, help="Stub model cost per call")
+    parser.add_argument("--stub-image-ms", type=float, default=20.0, help="Stub model cost per image")
+    parser.add_argument("--cache", action="store_true", help="Leave the result cache on (repeated uploads then hit it)")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "binsavvy-bench"),
+                        help="Where synthetic media and scratch files are kept")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail when p95 latency or throughput is worse than the baseline by this fraction")
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    targets = [t for t in args.targets.split(",") if t]
+    concurrency_levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    # The apps read their settings at import, so configure them first
+    if args.model:
+        weights_path = os.path.abspath(args.model)
+    else:
+        weights_path = os.path.join(args.work_dir, "stub.pt")
+        open(weights_path, "a").close()
+        # Spawned worker processes wouldn't see the stub
+        os.environ['EXECUTOR_MODE'] = 'thread'
+    os.environ['YOLO_MODEL_PATH'] = weights_path
+    os.environ.pop('MODEL_CONFIG', None)
+    os.environ.setdefault('JOB_DB_PATH', os.path.join(args.work_dir, 'jobs.db'))
+    if not args.cache:
+        os.environ['RESULT_CACHE_ENABLED'] = 'false'
+
+    import stages
+    if args.model:
+        model = stages.get_worker_model(weights_path)
+    else:
+        model = StubModel(args.stub_call_ms, args.stub_image_ms)
+        stages.load_model = lambda path: model
+
+    print("Generating synthetic media...")
+    images = {f"image-{w}x{h}": make_image(w, h) for w, h in parse_sizes(args.image_sizes)}
+    videos = {}
+    for w, h in parse_sizes(args.video_sizes):
+        for seconds in [float(s) for s in args.video_seconds.split(",") if s]:
+            name = f"video-{w}x{h}-{seconds:g}s"
+            videos[name] = make_video(os.path.join(args.work_dir, f"{name}.mp4"), w, h, seconds)
+
+    scenarios = [(name, "image", f"{name}.jpg", contents, {}) for name, contents in images.items()]
+    for name, path in videos.items():
+        with open(path, "rb") as f:
+            scenarios.append((name, "video", f"{name}.mp4", f.read(), {}))
+
+    run = {
+        "meta": {
+            "timestamp": time.time(),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or f"stub ({args.stub_call_ms:g} ms/call + {args.stub_image_ms:g} ms/image)",
+            "args": vars(args),
+        },
+        "stages": [],
+        "requests": [],
+    }
+
+    print("Benchmarking stages...")
+    run["stages"] = bench_stages(images, videos, model, args.stage_iterations)
+
+    for target in targets:
+        if target == "fastapi":
+            # Its workers load models through stages.load_model, stubbed above
+            import fastapi_app
+        elif target == "flask":
+            import app as flask_app
+            flask_app.registry.loader = stages.load_model
+        else:
+            parser.error(f"Unknown target: {target}")
+        print(f"Benchmarking {target}...")
+        if target == "fastapi":
+            run["requests"] += asyncio.run(bench_fastapi(scenarios, concurrency_levels, args.requests, args.warmup))
+        else:
+            run["requests"] += bench_flask(scenarios, concurrency_levels, args.requests, args.warmup)
+
+    print_summary(run)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(run, baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions")
+
+
+if __name__ == "__main__":
+    main()
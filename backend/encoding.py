@@ -0,0 +1,57 @@
+import json
+from typing import Any, Optional
+
+import numpy as np
+
+# Fast encoders for the columnar response formats. Without orjson the
+# columnar JSON format falls back to the standard library; without msgpack
+# clients asking for MessagePack get plain JSON.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "application/json"
+# Detections as parallel arrays instead of one object per box
+COLUMNAR_JSON = "application/vnd.binsavvy.columnar+json"
+MSGPACK = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """The response format named in an Accept header, or JSON.
+
+    Columnar formats must be asked for explicitly. The first supported
+    format listed wins; quality values are ignored.
+    """
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type == COLUMNAR_JSON:
+            return COLUMNAR_JSON
+        if media_type in _MSGPACK_TYPES and msgpack is not None:
+            return MSGPACK
+    return JSON
+
+
+def _plain(value: Any) -> Any:
+    # NumPy values the encoders can't handle natively
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def encode(payload: Any, media_type: str) -> bytes:
+    """Encode a payload that may hold NumPy arrays (as from DetectionBatch.to_columns)"""
+    if media_type == MSGPACK:
+        # Detections are float32 already, and the other fields (times, densities) need no more precision
+        return msgpack.packb(payload, default=_plain, use_single_float=True)
+    if orjson is not None:
+        return orjson.dumps(payload, default=_plain, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, default=_plain).encode()
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+
+def _init_worker(torch_threads: int, model_loads=None):
+    # Pin torch intra-op parallelism so N workers don't oversubscribe the cores.
+    # For process workers this is per process; for thread workers torch applies
+    # it to the calling thread's OpenMP team.
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except Exception as e:
+        print(f"Could not set torch threads in worker: {e}")
+    try:
+        import cv2
+        cv2.setNumThreads(torch_threads)
+    except Exception:
+        pass
+    if model_loads is not None:
+        # Workers count the models they load on a counter shared with the parent
+        import stages
+        stages.model_loads = model_loads
+
+
+class StageExecutor:
+    """Runs CPU-bound stages (decode, inference, postprocess) off the event loop.
+
+    mode is "thread" or "process". Work submitted in process mode must be a
+    top-level function with picklable arguments. `model_loads` counts the
+    models workers have loaded, so callers can tell when work waited on one.
+    """
+
+    def __init__(self, mode: str = "thread", workers: Optional[int] = None,
+                 torch_threads: Optional[int] = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown executor mode: {mode}")
+        cpu_count = os.cpu_count() or 1
+        self.mode = mode
+        self.workers = max(1, workers or min(4, cpu_count))
+        self.torch_threads = max(1, torch_threads or cpu_count // self.workers)
+        self.model_loads = multiprocessing.get_context("spawn").Value("L", 0)
+
+        self._generator_pool: Optional[ThreadPoolExecutor] = None
+        if mode == "process":
+            # spawn avoids forking a parent that already holds torch/OpenMP threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.torch_threads, self.model_loads),
+            )
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="stage",
+                initializer=_init_worker,
+                initargs=(self.torch_threads, self.model_loads),
+            )
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool and wait for its result, from a thread other than the event loop's"""
+        return self._pool.submit(functools.partial(fn, *args, **kwargs)).result()
+
+    @property
+    def model_copies(self) -> int:
+        """Copies of a model the workers may hold between them: one per worker, and in
+        process mode one per generator thread as well"""
+        return self.workers * (2 if self.mode == "process" else 1)
+
+    async def iterate(self, gen_fn: Callable[..., Iterator], *args, max_buffered: int = 4, **kwargs) -> AsyncIterator:
+        """Run a generator function on a worker thread and yield its items as they arrive.
+
+        Generators can't be shipped to another process, so in process mode the
+        generator runs on a separate thread pool of the same size. At most
+        `max_buffered` items are held for a slow consumer before the worker
+        blocks. Closing the async iterator stops and closes the generator.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue(maxsize=max_buffered)
+        stop = threading.Event()
+        done = object()
+
+        def pump():
+            gen = gen_fn(*args, **kwargs)
+            try:
+                for item in gen:
+                    if stop.is_set():
+                        break
+                    asyncio.run_coroutine_threadsafe(items.put((item, None)), loop).result()
+            except BaseException as e:
+                asyncio.run_coroutine_threadsafe(items.put((done, e)), loop).result()
+                return
+            finally:
+                gen.close()
+            asyncio.run_coroutine_threadsafe(items.put((done, None)), loop).result()
+
+        task = loop.run_in_executor(self._iter_pool(), pump)
+        try:
+            while True:
+                item, error = await items.get()
+                if item is done:
+                    if error is not None:
+                        raise error
+                    break
+                yield item
+        finally:
+            stop.set()
+            # Unblock a worker waiting on a full queue so it can see the stop flag
+            while not task.done():
+                while not items.empty():
+                    items.get_nowait()
+                await asyncio.sleep(0.01)
+
+    def _iter_pool(self):
+        if self.mode == "thread":
+            return self._pool
+        if self._generator_pool is None:
+            self._generator_pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="stage-iter",
+                initializer=_init_worker,
+                initargs=(self.torch_threads, self.model_loads),
+            )
+        return self._generator_pool
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "torch_threads_per_worker": self.torch_threads,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+        if self._generator_pool is not None:
+            self._generator_pool.shutdown(wait=wait)
+
+
+def executor_from_env() -> StageExecutor:
+    """Build an executor from EXECUTOR_MODE, EXECUTOR_WORKERS and TORCH_THREADS_PER_WORKER"""
+    mode = os.environ.get('EXECUTOR_MODE', 'thread').lower()
+    workers = int(os.environ.get('EXECUTOR_WORKERS', 0)) or None
+    torch_threads = int(os.environ.get('TORCH_THREADS_PER_WORKER', 0)) or None
+    return StageExecutor(mode=mode, workers=workers, torch_threads=torch_threads)
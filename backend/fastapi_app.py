@@ -1,20 +1,47 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import time
-from PIL import Image
-import io
 import uvicorn
-from pydantic import BaseModel
-from typing import List, Dict, Optional, Literal
+from pydantic import BaseModel, PrivateAttr
+from typing import Any, List, Dict, Optional, Literal, Union
 import os
 import traceback
-import cv2
-import numpy as np
 import tempfile
 import uuid
-from ultralytics import YOLO
+import functools
+import json
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from admission import UPLOAD_LIMITS, AdmissionRejected, admission_from_env
+from batching import MicroBatcher
+from load_shedding import DEGRADATION_LEVELS, load_shedder_from_env
+from executor import executor_from_env
+from stages import MediaError, ModelRef, decode_image, decode_target_size, load_registry_model, original_scale, run_model, process_video_models, iter_video_file
+from postprocess import DetectionBatch
+from frame_sampler import SamplingStrategy
+from scene_gate import DEFAULT_SCENE_THRESHOLD
+from jobs import JobManager, JobStore, QueueFullError
+from result_cache import CacheEntry, cache_from_env, content_key
+from model_registry import ModelUnavailableError, UnknownModelError, registry_from_env
+from quality import QualityTier, resolve_tier
+from metrics import CONTENT_TYPE, StageTimer, labels, metrics
+from tracking import TrackingOptions
+from uploads import UploadTooLargeError, UploadedFile, file_chunks, peek, pipe_upload, spool_upload, streamable_container
+from tiling import TileOptions, detect_tiles, image_to_bgr, merge_tile_detections, plan_tiles
+from encoding import JSON, encode, negotiate
+from batch_input import BatchInputError, TooManyFilesError, iter_batch_inputs, take
 
-app = FastAPI(title="Waste and Drone Detection API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background job workers start with the server, resuming unfinished jobs
+    job_manager.start()
+    await asyncio.to_thread(registry.preload)
+    yield
+    job_manager.stop(timeout=5)
+    executor.shutdown(wait=False)
+
+app = FastAPI(title="Waste and Drone Detection API", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -25,42 +52,150 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Check if model files exist
-waste_model_path = os.environ.get('YOLO_MODEL_PATH', 'best.pt')
-drone_model_path = os.environ.get('DRONE_MODEL_PATH', 'best2.pt')
+# Worker pool for decode, inference and postprocessing, so the event loop stays free.
+# Workers load their own copy of each model version the registry hands them.
+executor = executor_from_env()
+print(f"Stage executor: {executor.describe()}")
 
-waste_model_exists = os.path.exists(waste_model_path)
-drone_model_exists = os.path.exists(drone_model_path)
+# Threads running background jobs, each with its own model copies
+job_workers = int(os.environ.get('JOB_WORKERS', 1))
 
-# Load the YOLO models
-waste_model = None
-drone_model = None
+# Models are loaded on first use from the MODEL_CONFIG file (or YOLO_MODEL_PATH and
+# DRONE_MODEL_PATH), kept within a memory budget and reloaded when their weights change.
+# Only the workers hold models, so the budget counts every worker's copy.
+registry = registry_from_env(worker_loader=functools.partial(executor.call, load_registry_model),
+                             copies=executor.model_copies + job_workers)
 
-if waste_model_exists:
-    try:
-        waste_model = YOLO(waste_model_path)
-        print(f"Waste model loaded successfully from {waste_model_path}")
-    except Exception as e:
-        print(f"Error loading waste model: {e}")
-        traceback.print_exc()
-else:
-    print(f"Waste model file not found at {waste_model_path}")
+# Micro-batching settings for concurrent image requests
+batch_max_size = int(os.environ.get('BATCH_MAX_SIZE', 8))
+batch_max_wait_ms = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+
+def make_batcher(model_ref, name, tier=None):
+    infer = functools.partial(run_model, model_ref, tier=tier)
+    return MicroBatcher(infer, max_batch_size=batch_max_size, max_wait_ms=batch_max_wait_ms,
+                        name=name, executor=executor)
+
+# Worker jobs a tiled image is split across (tiles are batched within each job)
+tile_workers = int(os.environ.get('TILE_WORKERS', 1))
+
+# Files decoded together and sent to the model as one batch by /detect/batch
+batch_detect_size = int(os.environ.get('BATCH_DETECT_SIZE', 16))
+
+# Content-addressed cache of detection results (RESULT_CACHE_* settings)
+result_cache = cache_from_env()
+
+# One batcher per model and quality setting, created on first use
+batchers = {}
+
+# Caps concurrent inferences per model, queueing a bounded number of requests
+# and turning the rest away with 429/503 (ADMISSION_* settings)
+admission = admission_from_env()
+
+# Serves /detect at cheaper settings while latency or the admission queue is
+# over target (LOAD_SHEDDING_* settings); None unless LOAD_SHEDDING_ENABLED is set
+load_shedder = load_shedder_from_env(lambda: sum(admission.queue_depth().values()))
+
+# Prometheus metrics, served on /metrics. Gauges are read when scraped.
+requests_total = metrics.counter("binsavvy_requests_total", "HTTP requests by route and status")
+request_seconds = metrics.histogram("binsavvy_request_seconds", "HTTP request duration by route, up to the response headers")
+requests_in_flight = metrics.gauge("binsavvy_requests_in_flight", "HTTP requests being handled")
+metrics.gauge("binsavvy_batch_queue_depth", "Images waiting in each micro-batcher",
+              lambda: {labels(batcher=name): batcher.queue_depth for name, batcher in batchers.items()})
+metrics.gauge("binsavvy_job_queue_depth", "Background jobs waiting for a worker",
+              lambda: {labels(): job_manager.queued})
+metrics.gauge("binsavvy_jobs_running", "Background jobs being processed",
+              lambda: {labels(): job_manager.describe()["running"]})
+metrics.gauge("binsavvy_model_loaded", "Whether each model is loaded (1) or not (0)",
+              lambda: {labels(model=model_id): float(status["loaded"]) for model_id, status in registry.status().items()})
+metrics.gauge("binsavvy_model_size_bytes", "Memory held by each loaded model",
+              lambda: {labels(model=model_id): status["size_bytes"] for model_id, status in registry.status().items()})
+metrics.gauge("binsavvy_model_events", "Model loads, reloads and evictions since startup",
+              lambda: {labels(model=model_id, event=event): status[event]
+                       for model_id, status in registry.status().items() for event in ("loads", "reloads", "evictions")})
+metrics.gauge("binsavvy_admission_queue_depth", "Requests waiting for an inference slot, per model",
+              lambda: {labels(model=model_id): depth for model_id, depth in admission.queue_depth().items()})
+metrics.gauge("binsavvy_admission_rejections", "Requests turned away by admission control since startup",
+              lambda: {labels(model=model_id, reason=reason): stats[reason]
+                       for model_id, stats in admission.stats()["models"].items() for reason in ("rejected", "timed_out")})
+metrics.gauge("binsavvy_degradation_level", "Load-shedding level /detect requests are served at",
+              lambda: {labels(): load_shedder.index} if load_shedder is not None else {})
+metrics.gauge("binsavvy_cache_events", "Result cache lookups by outcome since startup",
+              lambda: {labels(event=event): value for event, value in result_cache.stats().items()
+                       if event in result_cache.counters} if result_cache is not None else {})
+metrics.gauge("binsavvy_cache_memory_bytes", "Bytes held by the in-memory result cache",
+              lambda: {labels(): result_cache.stats()["memory_bytes"]} if result_cache is not None else {})
 
-if drone_model_exists:
+# The upload limit each route's body is held to as it arrives. /detect takes
+# images and videos alike, so its form's media_type is checked once parsed.
+ROUTE_UPLOAD_LIMITS = {"/detect": "video", "/detect/video": "video", "/detect/stream": "video",
+                       "/detect/batch": "batch", "/jobs": "video"}
+
+class UploadLimitMiddleware:
+    """Refuses request bodies over their route's upload limit (the image limit
+    for unlisted routes): by Content-Length before any of the body is read,
+    and by counting bytes as it arrives, so a body can't get past the limit
+    by leaving the header out or lying in it"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        media_type = ROUTE_UPLOAD_LIMITS.get(scope["path"], "image")
+        limit = UPLOAD_LIMITS[media_type]
+        detail = f"{media_type.capitalize()} uploads are limited to {limit / (1024 * 1024):g} MB"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            return await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+        
+        received = 0
+        async def receive_within_limit():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised where the body is being read, so the route answers with a 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        await self.app(scope, receive_within_limit, send)
+
+# Added before the metrics middleware so it sits inside it, where a 413 raised
+# while the body is read reaches the route's exception handling as is
+app.add_middleware(UploadLimitMiddleware)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    requests_in_flight.inc()
+    start = time.perf_counter()
+    status = 500
     try:
-        drone_model = YOLO(drone_model_path)
-        print(f"Drone model loaded successfully from {drone_model_path}")
-    except Exception as e:
-        print(f"Error loading drone model: {e}")
-        traceback.print_exc()
-else:
-    print(f"Drone model file not found at {drone_model_path}")
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        requests_in_flight.dec()
+        # Label by route template so job ids don't each get their own series
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        request_seconds.observe(time.perf_counter() - start, path=path)
+        requests_total.inc(path=path, status=status)
+
 
 class Detection(BaseModel):
     box: List[float]
     class_name: str
     confidence: float
     frame: Optional[int] = None
+    track_id: Optional[int] = None
+
+def to_detections(batch: DetectionBatch, columnar: bool = False) -> List[Detection]:
+    # Columnar responses encode the arrays directly, so no per-box objects are needed
+    if columnar:
+        return []
+    # The dicts are built from typed arrays, so pydantic validation can be skipped
+    return [Detection.model_construct(**d) for d in batch.to_dicts()]
 
 class DetectionResponse(BaseModel):
     detections: List[Detection]
@@ -69,6 +204,43 @@ class DetectionResponse(BaseModel):
     waste_density: Optional[float] = None
     frame_count: Optional[int] = None
     fps: Optional[float] = None
+    frames_inferred: Optional[int] = None
+    frames_reused: Optional[int] = None
+    # Tracking mode: frames filled in by the tracker, distinct objects per class and their tracks
+    frames_tracked: Optional[int] = None
+    unique_counts: Optional[Dict[str, int]] = None
+    tracks: Optional[List[Dict[str, Any]]] = None
+    quality: Optional[Dict[str, Any]] = None
+    # Load-shedding level the request was served at
+    degradation: Optional[Dict[str, Any]] = None
+    timings: Optional[Dict[str, float]] = None
+    # Source of `detections`, for columnar encodings
+    _batch: Optional[DetectionBatch] = PrivateAttr(None)
+
+class MultiModelResponse(BaseModel):
+    # One response per requested model, keyed by the name it was requested by
+    models: Dict[str, DetectionResponse]
+    processing_time: float
+    degradation: Optional[Dict[str, Any]] = None
+    timings: Optional[Dict[str, float]] = None
+
+class FileDetections(BaseModel):
+    filename: str
+    detections: List[Detection] = []
+    class_counts: Dict[str, int] = {}
+    waste_density: Optional[float] = None
+    error: Optional[str] = None
+    _batch: Optional[DetectionBatch] = PrivateAttr(None)
+
+class BatchDetectionResponse(BaseModel):
+    results: List[FileDetections]
+    processing_time: float
+    file_count: int
+    failed_count: int
+    class_counts: Dict[str, int]
+    mean_waste_density: Optional[float] = None
+    quality: Optional[Dict[str, Any]] = None
+    timings: Optional[Dict[str, float]] = None
 
 class ErrorResponse(BaseModel):
     error: str
@@ -78,125 +250,408 @@ class ModelStatus(BaseModel):
     loaded: bool
     path: str
     exists: bool
+    aliases: List[str] = []
+    backend: Optional[str] = None
+    runtime_path: Optional[str] = None
+    version: Optional[float] = None
+    size_bytes: int = 0
+    last_used: Optional[float] = None
+    loads: int = 0
+    reloads: int = 0
+    evictions: int = 0
+    error: Optional[str] = None
+
+class JobStatus(BaseModel):
+    id: str
+    status: str
+    model: str
+    media_type: str
+    frames_done: int = 0
+    frames_total: Optional[int] = None
+    created_at: float
+    updated_at: float
+    result: Optional[DetectionResponse] = None
+    error: Optional[str] = None
 
 class HealthResponse(BaseModel):
     status: str
     models: Dict[str, ModelStatus]
+    registry: Dict[str, Any] = {}
+    batching: Dict[str, Dict[str, float]] = {}
+    executor: Dict[str, Any] = {}
+    jobs: Dict[str, Any] = {}
+    admission: Dict[str, Any] = {}
+    load_shedding: Optional[Dict[str, Any]] = None
+    cache: Optional[Dict[str, Any]] = None
+
+def image_response(batch: DetectionBatch, img_area: int, processing_time: float,
+                   quality: Optional[Dict[str, Any]] = None, columnar: bool = False) -> DetectionResponse:
+    response = DetectionResponse(
+        detections=to_detections(batch, columnar),
+        processing_time=processing_time,
+        class_counts=batch.class_counts(),
+        # Waste density is the percentage of the image covered by waste
+        waste_density=batch.density(img_area),
+        quality=quality
+    )
+    response._batch = batch
+    return response
+
+def video_response(result: Dict[str, Any], processing_time: float,
+                   quality: Optional[Dict[str, Any]] = None, columnar: bool = False) -> DetectionResponse:
+    response = DetectionResponse(
+        detections=to_detections(result["detections"], columnar),
+        processing_time=processing_time,
+        class_counts=result["class_counts"],
+        waste_density=result["waste_density"],
+        frame_count=result["frame_count"],
+        fps=result["fps"],
+        frames_inferred=result["frames_inferred"],
+        frames_reused=result["frames_reused"],
+        frames_tracked=result.get("frames_tracked") or None,
+        unique_counts=result.get("unique_counts"),
+        tracks=result.get("tracks"),
+        quality=quality
+    )
+    response._batch = result["detections"]
+    return response
+
+def to_columnar(value: Any) -> Any:
+    """A response as plain data, with detections as parallel arrays"""
+    if isinstance(value, BaseModel):
+        fields = {name: to_columnar(getattr(value, name)) for name in type(value).model_fields}
+        batch = getattr(value, "_batch", None)
+        if batch is not None:
+            fields["detections"] = batch.to_columns()
+        return fields
+    if isinstance(value, dict):
+        return {key: to_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_columnar(item) for item in value]
+    return value
+
+def encoded_response(response: BaseModel, media_type: str):
+    # Columnar formats skip FastAPI's per-object validation and JSON encoding
+    if media_type == JSON:
+        return response
+    return Response(encode(to_columnar(response), media_type), media_type=media_type)
+
+def parse_quality(quality, imgsz, max_det, int8) -> QualityTier:
+    # Speed/accuracy tier, with explicit settings overriding the tier's
+    try:
+        return resolve_tier(quality, imgsz, max_det, int8)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def select_model(model: str, tier: QualityTier):
+    """Look up a model by id or alias, loading it off the event loop on first use.
+
+    Returns the loaded model, the version workers should run for the tier,
+    the batcher for that model and tier, and the quality settings used.
+    """
+    try:
+        loaded = await asyncio.to_thread(registry.get, model)
+        model_path, precision = await asyncio.to_thread(loaded.runtime_path, tier.int8)
+    except UnknownModelError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    model_ref = registry.worker_ref(loaded, model_path)
+    
+    name = f"{loaded.spec.id}:{tier.imgsz}:{tier.max_det}:{precision}"
+    if name not in batchers:
+        batchers[name] = make_batcher(model_ref, name, tier)
+    else:
+        # Point the batcher at the current version, which changes on reloads and evictions
+        batchers[name].infer_fn = functools.partial(run_model, model_ref, tier=tier)
+    return loaded, model_ref, batchers[name], tier.describe(precision)
+
+def check_upload_size(files: List[UploadFile], media_type: str):
+    limit = UPLOAD_LIMITS.get(media_type)
+    # Parsed uploads are spooled to disk, so their size is known before reading
+    if limit is not None and sum(f.size or 0 for f in files) > limit:
+        raise HTTPException(status_code=413, detail=f"{media_type.capitalize()} uploads are limited to {limit / (1024 * 1024):g} MB")
 
-@app.post("/detect", response_model=DetectionResponse, responses={500: {"model": ErrorResponse}})
+@asynccontextmanager
+async def admitted(model_ids):
+    """Hold an inference slot for each model, or fail with 429/503 and a Retry-After"""
+    async with AsyncExitStack() as stack:
+        try:
+            # A fixed order, so multi-model requests can't deadlock each other
+            for model_id in sorted(set(model_ids)):
+                await stack.enter_async_context(admission.admit(model_id))
+        except AdmissionRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+        yield
+
+def parse_tracking(track: bool, keyframe_interval: Optional[int]) -> Optional[TrackingOptions]:
+    # Detector on keyframes only, with tracked boxes in between
+    if not track:
+        return None
+    try:
+        return TrackingOptions(keyframe_interval) if keyframe_interval is not None else TrackingOptions()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def parse_models(model: str) -> List[str]:
+    # A comma-separated list runs several models over one decode of the media
+    names = [name.strip() for name in model.split(",") if name.strip()]
+    if not names:
+        raise HTTPException(status_code=400, detail="No model given")
+    return list(dict.fromkeys(names))
+
+def shared_once(compute):
+    """Wrap an async function so callers passing the same arguments share one call"""
+    tasks = {}
+    
+    async def run(*args):
+        if args not in tasks:
+            tasks[args] = asyncio.ensure_future(compute(*args))
+        # One caller being cancelled mustn't cancel the call for the others
+        return await asyncio.shield(tasks[args])
+    return run
+
+def parse_video_options(sample_fps, sample_stride, max_frames, scene_gate, scene_threshold):
+    # Video frame sampling options
+    try:
+        sampling = SamplingStrategy(target_fps=sample_fps, stride=sample_stride, max_frames=max_frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Skip inference on near-duplicate video frames when requested
+    if not scene_gate:
+        scene_threshold = None
+    elif scene_threshold is None:
+        scene_threshold = DEFAULT_SCENE_THRESHOLD
+    elif scene_threshold < 0:
+        raise HTTPException(status_code=400, detail="scene_threshold must not be negative")
+    return sampling, scene_threshold
+
+@app.post("/detect", response_model=Union[DetectionResponse, MultiModelResponse], responses={500: {"model": ErrorResponse}})
 async def detect(
+    request: Request,
     file: UploadFile = File(...),
     model: str = Form("yolo"),
     media_type: Literal["image", "video"] = Form("image"),
-    confidence: float = Form(0.25)
+    confidence: float = Form(0.25),
+    sample_fps: Optional[float] = Form(None),
+    sample_stride: Optional[int] = Form(None),
+    max_frames: Optional[int] = Form(None),
+    scene_gate: bool = Form(False),
+    scene_threshold: Optional[float] = Form(None),
+    tiled: bool = Form(False),
+    tile_size: int = Form(640),
+    tile_overlap: float = Form(0.2),
+    track: bool = Form(False),
+    keyframe_interval: Optional[int] = Form(None),
+    quality: Optional[str] = Form(None),
+    imgsz: Optional[int] = Form(None),
+    max_det: Optional[int] = Form(None),
+    int8: Optional[bool] = Form(None),
+    allow_degradation: bool = Form(True),
+    timings: bool = Form(False)
 ):
+    """Detect objects in an image or video.
+
+    `model` may list several models separated by commas. The media is then
+    read and decoded once, the models run on it concurrently, and the
+    response holds one result per model.
+
+    Clients can ask for detections as parallel arrays through the Accept
+    header, as application/vnd.binsavvy.columnar+json or application/msgpack.
+
+    For video, track=true runs the model on every keyframe_interval-th frame
+    only and tracks objects through the rest of the (by default, every)
+    frame, adding track ids and per-class counts of distinct objects.
+
+    With load shedding turned on (LOAD_SHEDDING_ENABLED=true; it is off by
+    default), requests under load are served with fewer video frames or a
+    smaller inference size, as reported in `degradation`, unless
+    allow_degradation is false.
+    """
     print(f"Received request: model={model}, media_type={media_type}, confidence={confidence}, file={file.filename}")
+    request_start = time.perf_counter()
+    loads_at_start = executor.model_loads.value
     
-    # Select the appropriate model
-    if model == 'yolo':
-        model_obj = waste_model
-        model_path = waste_model_path
-    elif model == 'best2':
-        model_obj = drone_model
-        model_path = drone_model_path
-    else:
-        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    model_names = parse_models(model)
+    sampling, scene_threshold = parse_video_options(sample_fps, sample_stride, max_frames, scene_gate, scene_threshold)
+    tracking = parse_tracking(track, keyframe_interval)
+    tier = parse_quality(quality, imgsz, max_det, int8)
+    degradation = None
+    if load_shedder is not None:
+        level = load_shedder.current() if allow_degradation else DEGRADATION_LEVELS[0]
+        sampling, scene_threshold, tier, tracking = level.apply(sampling, scene_threshold, tier, tracking)
+        degradation = level.describe()
+    selected = {}
+    for name in model_names:
+        loaded, model_ref, batcher, quality_used = await select_model(name, tier)
+        # Aliases of the same model only run once
+        if all(other[0] is not loaded for other in selected.values()):
+            selected[name] = (loaded, model_ref, batcher, quality_used)
+    timer = StageTimer(model=",".join(loaded.spec.id for loaded, *_ in selected.values()), media_type=media_type)
+    response_format = negotiate(request.headers.get("accept"))
+    columnar = response_format != JSON
     
-    # Check if model is loaded
-    if model_obj is None:
-        raise HTTPException(
-            status_code=500, 
-            detail=f"Model not loaded. Check if the model file exists at {model_path} and the model can be loaded correctly."
-        )
+    # Sliced inference over overlapping tiles, for small objects in large images
+    tiling = None
+    if tiled:
+        try:
+            tiling = TileOptions(tile_size, tile_overlap)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
-    try:
-        # Process based on media type
-        if media_type == 'image':
-            return await process_image(file, model_obj, confidence)
-        elif media_type == 'video':
-            return await process_video(file, model_obj, confidence)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported media type: {media_type}")
-            
-    except Exception as e:
-        print(f"Error processing file: {e}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
-
-async def process_image(file: UploadFile, model, confidence_threshold: float = 0.25):
-    try:
-        # Read image
-        contents = await file.read()
-        
-        # Open and validate the image
+    check_upload_size([file], media_type)
+    async with admitted(loaded.spec.id for loaded, *_ in selected.values()), AsyncExitStack() as uploads:
         try:
-            img = Image.open(io.BytesIO(contents))
-            img.verify()  # Verify that it's a valid image
-            img = Image.open(io.BytesIO(contents))  # Reopen after verify
-        except Exception as e:
-            print(f"Invalid image: {e}")
-            raise HTTPException(status_code=400, detail=f"Invalid image: {str(e)}")
+            start_time = time.time()
+            with timer.stage("read"):
+                if media_type == 'video':
+                    # Copied to disk a chunk at a time rather than read into memory whole
+                    upload = await uploads.enter_async_context(spool_upload(file_chunks(file), suffix=".mp4"))
+                else:
+                    contents = await file.read()
         
-        # Get image dimensions for density calculation
-        img_width, img_height = img.size
-        img_area = img_width * img_height
+            # Process based on media type
+            if media_type == 'image':
+                async def decode(target_size):
+                    with timer.stage("decode"):
+                        return await executor.run(decode_image, contents, target_size)
+                decode = shared_once(decode)
+                runs = [process_image(contents, model_ref, confidence, batcher, tiling, tier, quality_used, timer, decode, columnar)
+                        for _, model_ref, batcher, quality_used in selected.values()]
+            elif media_type == 'video':
+                model_refs = [model_ref for _, model_ref, _, _ in selected.values()]
+                analyse = shared_once(functools.partial(analyse_video, upload, model_refs, sampling=sampling,
+                                                        scene_threshold=scene_threshold, tier=tier, timer=timer,
+                                                        tracking=tracking))
+                runs = [process_video(upload, model_ref, confidence, sampling, scene_threshold, tier, quality_used, timer,
+                                      functools.partial(video_result, analyse, i), columnar, tracking)
+                        for i, (_, model_ref, _, quality_used) in enumerate(selected.values())]
+            else:
+                raise HTTPException(status_code=400, detail=f"Unsupported media type: {media_type}")
+            responses = await asyncio.gather(*runs)
+            for response in responses:
+                response.degradation = degradation
         
+            if len(responses) == 1:
+                response = responses[0]
+            else:
+                response = MultiModelResponse(models=dict(zip(selected, responses)), processing_time=time.time() - start_time,
+                                              degradation=degradation)
+            if timings:
+                response.timings = timer.breakdown()
+            with timer.stage("encode"):
+                response = encoded_response(response, response_format)
+            timer.observe()
+            # A request that waited on a model load says nothing about the steady-state latency
+            if load_shedder is not None and executor.model_loads.value == loads_at_start:
+                load_shedder.observe(media_type, time.perf_counter() - request_start)
+            return response
+    
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error processing file: {e}")
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+
+async def cached_entry(contents, key_parts: List[Any], confidence: float, compute):
+    """Serve detections from the result cache when it covers this confidence.
+
+    `contents` is the upload's bytes, or a sha256 of them. `compute(conf)`
+    must return a CacheEntry for inference at `conf`. Returns the entry and
+    its detections filtered to `confidence`.
+    """
+    if result_cache is None or not result_cache.covers(confidence):
+        if result_cache is not None:
+            result_cache.record_bypass()
+        entry = await compute(confidence)
+        return entry, entry.detections
+    
+    # Hash off the event loop; videos can be large
+    key = await asyncio.to_thread(content_key, contents, result_cache.floor_confidence, *key_parts)
+    entry = await result_cache.get_or_compute(key, lambda: compute(result_cache.floor_confidence))
+    return entry, entry.filtered(confidence)
+
+def model_version(model_ref: ModelRef) -> List[Any]:
+    # Cached results must not outlive the weights that produced them
+    return [model_ref.path, os.path.getmtime(model_ref.path)]
+
+async def detect_tiled(img, model_ref: ModelRef, conf: float, tiling: TileOptions, tier: QualityTier,
+                       timer: StageTimer) -> DetectionBatch:
+    with timer.stage("preprocess"):
+        image = await executor.run(image_to_bgr, img)
+    height, width = image.shape[:2]
+    windows = plan_tiles(width, height, tiling.tile_size, tiling.overlap)
+    
+    # Split the tiles across workers; each worker batches its share through its own model copy
+    groups = max(1, min(tile_workers, len(windows)))
+    size = -(-len(windows) // groups)
+    with timer.stage("inference"):
+        batches = await asyncio.gather(*[
+            executor.run(detect_tiles, model_ref, image, windows[i:i + size], conf, tier=tier)
+            for i in range(0, len(windows), size)
+        ])
+    
+    # Merge duplicate boxes from overlapping tiles
+    with timer.stage("postprocess"):
+        return await executor.run(merge_tile_detections, DetectionBatch.concat(batches))
+
+async def process_image(contents: bytes, model_ref: ModelRef, confidence_threshold: float = 0.25, batcher: Optional[MicroBatcher] = None, tiling: Optional[TileOptions] = None,
+                        tier: Optional[QualityTier] = None, quality: Optional[Dict[str, Any]] = None,
+                        timer: Optional[StageTimer] = None, decode=None, columnar: bool = False):
+    """Detect objects in image bytes. `decode(target_size)` may be given to share one decode between models."""
+    timer = timer or StageTimer()
+    if decode is None:
+        async def decode(target_size):
+            with timer.stage("decode"):
+                return await executor.run(decode_image, contents, target_size)
+    try:
         # Start timing
         start_time = time.time()
         
-        # Run inference with YOLOv8
-        results = model(img, conf=confidence_threshold)
+        async def compute(conf):
+            # Open and validate the image, decoding large JPEGs at reduced size (no smaller
+            # than the tier's inference size) unless tiles will be cut from it at full resolution
+            try:
+                img, original_size = await decode(0 if tiling else decode_target_size(tier))
+            except MediaError as e:
+                print(f"Invalid image: {e}")
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            # Density is measured against the true image dimensions
+            img_width, img_height = original_size
+            
+            if tiling is not None:
+                batch = await detect_tiled(img, model_ref, conf, tiling, tier, timer)
+                return CacheEntry(batch, {"img_area": img_width * img_height})
+            
+            # Run inference with YOLOv8, batched with other concurrent requests when possible
+            with timer.stage("inference"):
+                if batcher is not None:
+                    results = await batcher.submit(img, conf)
+                else:
+                    results = await executor.run(run_model, model_ref, img, conf, tier)
+            
+            # Convert YOLOv8 results to JSON-serializable format, with the class names of the model that ran
+            with timer.stage("postprocess"):
+                batch = await executor.run(DetectionBatch.from_results, results)
+                # Map boxes back to original-image coordinates
+                batch = batch.scaled(*original_scale(img, original_size))
+            return CacheEntry(batch, {"img_area": img_width * img_height})
+        
+        key_parts = ["image", *model_version(model_ref), tier.key() if tier else None]
+        if tiling is not None:
+            key_parts += ["tiled", tiling.tile_size, tiling.overlap]
+        entry, batch = await cached_entry(contents, key_parts, confidence_threshold, compute)
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
-        # Process results
-        detections = []
-        class_counts = {}
-        total_waste_area = 0
-        
-        # Convert YOLOv8 results to JSON-serializable format
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                # Get box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                # Get confidence
-                conf = box.conf[0].item()
-                # Get class
-                cls = int(box.cls[0].item())
-                # Get class name
-                class_name = model.names[cls]
-                
-                # Calculate box area for density
-                box_width = x2 - x1
-                box_height = y2 - y1
-                box_area = box_width * box_height
-                total_waste_area += box_area
-                
-                # Update class counts
-                if class_name in class_counts:
-                    class_counts[class_name] += 1
-                else:
-                    class_counts[class_name] = 1
-                
-                detections.append(Detection(
-                    box=[float(x1), float(y1), float(x2 - x1), float(y2 - y1)],
-                    class_name=class_name,
-                    confidence=float(conf)
-                ))
-        
-        # Calculate waste density (percentage of image covered by waste)
-        waste_density = (total_waste_area / img_area) * 100 if img_area > 0 else 0
-        
-        response = DetectionResponse(
-            detections=detections,
-            processing_time=processing_time,
-            class_counts=class_counts,
-            waste_density=waste_density
-        )
+        with timer.stage("serialize"):
+            response = image_response(batch, entry.meta["img_area"], processing_time, quality, columnar)
         
-        print(f"Processed image with {len(detections)} detections in {processing_time:.2f}s, waste density: {waste_density:.2f}%")
+        print(f"Processed image with {len(response.detections)} detections in {processing_time:.2f}s, waste density: {response.waste_density:.2f}%")
         return response
         
     except Exception as e:
@@ -206,115 +661,81 @@ async def process_image(file: UploadFile, model, confidence_threshold: float = 0
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
-async def process_video(file: UploadFile, model, confidence_threshold: float = 0.25):
+async def analyse_video(upload: UploadedFile, model_refs: List[ModelRef], conf: float, sampling: Optional[SamplingStrategy] = None,
+                        scene_threshold: Optional[float] = None, tier: Optional[QualityTier] = None,
+                        timer: Optional[StageTimer] = None,
+                        tracking: Optional[TrackingOptions] = None) -> List[Dict[str, Any]]:
+    """Run each model over one decode of a video's sampled frames, returning a summary per model"""
+    timer = timer or StageTimer()
+    
+    # Decode, infer and postprocess the sampled frames on the worker pool
+    try:
+        results = await executor.run(process_video_models, upload.path, model_refs, conf, sampling, scene_threshold, tier, tracking,
+                                     seekable=upload.seekable)
+    except MediaError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Pipeline stages overlap, so these add up to more than the wall time.
+    # The models share one pass, so its stages are counted once.
+    for stage, seconds in results[0]["timings"].items():
+        timer.add(stage, seconds)
+    for result in results:
+        del result["timings"]
+    return results
+
+async def video_result(analyse, index: int, conf: float) -> Dict[str, Any]:
+    # One model's summary from a shared analyse_video pass
+    return (await analyse(conf))[index]
+
+async def process_video(upload: UploadedFile, model_ref: ModelRef, confidence_threshold: float = 0.25, sampling: Optional[SamplingStrategy] = None, scene_threshold: Optional[float] = None,
+                        tier: Optional[QualityTier] = None, quality: Optional[Dict[str, Any]] = None,
+                        timer: Optional[StageTimer] = None, analyse=None, columnar: bool = False,
+                        tracking: Optional[TrackingOptions] = None):
+    """Detect objects in an uploaded video. `analyse(conf)` may be given to share one decode between models."""
+    timer = timer or StageTimer()
+    if analyse is None:
+        async def analyse(conf):
+            return (await analyse_video(upload, [model_ref], conf, sampling, scene_threshold, tier, timer, tracking))[0]
     try:
-        # Save the uploaded video to a temporary file
-        temp_dir = tempfile.gettempdir()
-        temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}.mp4")
-        
-        with open(temp_path, "wb") as buffer:
-            contents = await file.read()
-            buffer.write(contents)
-        
-        # Open the video file
-        cap = cv2.VideoCapture(temp_path)
-        if not cap.isOpened():
-            raise HTTPException(status_code=400, detail="Could not open video file")
-        
-        # Get video properties
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        frame_area = frame_width * frame_height
-        
-        print(f"Video properties: {frame_count} frames at {fps} FPS, dimensions: {frame_width}x{frame_height}")
-        
-        # Process a sample of frames (e.g., every 30th frame)
-        sample_interval = max(1, int(frame_count / 10))  # Process ~10 frames
-        frames_to_process = list(range(0, frame_count, sample_interval))
-        
         # Start timing
         start_time = time.time()
         
-        all_detections = []
-        class_counts = {}
-        total_waste_area = 0
-        frames_processed = 0
-        
-        for frame_idx in frames_to_process:
-            # Set the frame position
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = cap.read()
-            
-            if not ret:
-                continue
-                
-            # Convert BGR to RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_pil = Image.fromarray(frame_rgb)
-            
-            # Run inference with YOLOv8
-            results = model(frame_pil, conf=confidence_threshold)
-            
-            frame_waste_area = 0
-            
-            # Process results for this frame
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    # Get box coordinates
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    # Get confidence
-                    conf = box.conf[0].item()
-                    # Get class
-                    cls = int(box.cls[0].item())
-                    # Get class name
-                    class_name = model.names[cls]
-                    
-                    # Calculate box area for density
-                    box_width = x2 - x1
-                    box_height = y2 - y1
-                    box_area = box_width * box_height
-                    frame_waste_area += box_area
-                    
-                    # Update class counts
-                    if class_name in class_counts:
-                        class_counts[class_name] += 1
-                    else:
-                        class_counts[class_name] = 1
-                    
-                    all_detections.append(Detection(
-                        box=[float(x1), float(y1), float(x2 - x1), float(y2 - y1)],
-                        class_name=class_name,
-                        confidence=float(conf),
-                        frame=frame_idx
-                    ))
-            
-            total_waste_area += frame_waste_area
-            frames_processed += 1
+        async def compute(conf):
+            # Copy, since a shared summary is read by every model's request
+            result = dict(await analyse(conf))
+            return CacheEntry(result.pop("detections"), result)
         
-        # Clean up
-        cap.release()
-        os.remove(temp_path)
+        sampling = sampling or SamplingStrategy()
+        # Which tracks exist depends on the confidence, so cached detections can't be re-filtered.
+        # A video still arriving through a pipe can't be hashed until it's been analysed.
+        if tracking is not None or upload.sha256 is None:
+            if result_cache is not None:
+                result_cache.record_bypass()
+            entry = await compute(confidence_threshold)
+            detections = entry.detections
+        else:
+            key_parts = ["video", *model_version(model_ref), sampling.target_fps, sampling.stride, sampling.max_frames, scene_threshold,
+                         tier.key() if tier else None]
+            entry, detections = await cached_entry(upload.sha256, key_parts, confidence_threshold, compute)
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
-        # Calculate average waste density across processed frames
-        avg_waste_density = (total_waste_area / (frame_area * frames_processed)) * 100 if frames_processed > 0 else 0
+        # Class counts and density depend on the confidence, so derive them from the filtered detections
+        meta = entry.meta
+        frames_area = meta["frame_area"] * meta["frames_processed"]
+        result = {
+            **meta,
+            "detections": detections,
+            "class_counts": detections.class_counts(),
+            "waste_density": detections.density(frames_area)
+        }
         
         # Prepare response
-        response = DetectionResponse(
-            detections=all_detections,
-            processing_time=processing_time,
-            class_counts=class_counts,
-            waste_density=avg_waste_density,
-            frame_count=frame_count,
-            fps=fps
-        )
+        with timer.stage("serialize"):
+            response = video_response(result, processing_time, quality, columnar)
         
-        print(f"Processed video with {len(all_detections)} detections across {len(frames_to_process)} frames in {processing_time:.2f}s, avg waste density: {avg_waste_density:.2f}%")
+        print(f"Processed video with {len(response.detections)} detections across {result['frames_sampled']} frames in {processing_time:.2f}s, avg waste density: {result['waste_density']:.2f}%")
         return response
         
     except Exception as e:
@@ -324,22 +745,434 @@ async def process_video(file: UploadFile, model, confidence_threshold: float = 0
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+async def detect_batch_chunk(chunk, model_ref: ModelRef, conf: float, tier: QualityTier,
+                             timer: StageTimer, columnar: bool = False) -> List[FileDetections]:
+    """Decode a chunk of files in parallel, then run them through the model as one batch"""
+    results = [FileDetections(filename=name, error=error) for name, _, error in chunk]
+    pending = [(i, contents) for i, (_, contents, error) in enumerate(chunk) if error is None]
+    
+    with timer.stage("decode"):
+        target_size = decode_target_size(tier)
+        decoded = await asyncio.gather(*[executor.run(decode_image, contents, target_size) for _, contents in pending],
+                                       return_exceptions=True)
+    images = []
+    for (i, _), outcome in zip(pending, decoded):
+        if isinstance(outcome, MediaError):
+            results[i].error = str(outcome)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            images.append((i, *outcome))
+    if not images:
+        return results
+    
+    with timer.stage("inference"):
+        outputs = await executor.run(run_model, model_ref, [img for _, img, _ in images], conf, tier)
+    
+    with timer.stage("postprocess"):
+        for (i, img, original_size), output in zip(images, outputs):
+            batch = DetectionBatch.from_results([output]).scaled(*original_scale(img, original_size))
+            width, height = original_size
+            results[i] = FileDetections(
+                filename=results[i].filename,
+                detections=to_detections(batch, columnar),
+                class_counts=batch.class_counts(),
+                waste_density=batch.density(width * height)
+            )
+            results[i]._batch = batch
+    return results
+
+@app.post("/detect/batch", response_model=BatchDetectionResponse,
+          responses={400: {"model": ErrorResponse}, 413: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def detect_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    model: str = Form("yolo"),
+    confidence: float = Form(0.25),
+    quality: Optional[str] = Form(None),
+    imgsz: Optional[int] = Form(None),
+    max_det: Optional[int] = Form(None),
+    int8: Optional[bool] = Form(None),
+    timings: bool = Form(False)
+):
+    """Detect objects in many images at once, uploaded as files or as zip/tar archives.
+
+    Archives are read one member at a time, and files are decoded and
+    inferred in chunks of BATCH_DETECT_SIZE, so memory use doesn't grow with
+    the size of the upload. Files that can't be decoded get an error entry
+    instead of failing the whole request. The Accept header selects a
+    columnar encoding, as for /detect.
+    """
+    print(f"Received batch request: model={model}, confidence={confidence}, files={[f.filename for f in files]}")
+    
+    tier = parse_quality(quality, imgsz, max_det, int8)
+    loaded, model_ref, _, quality_used = await select_model(model, tier)
+    check_upload_size(files, "batch")
+    timer = StageTimer(model=loaded.spec.id, media_type="batch")
+    response_format = negotiate(request.headers.get("accept"))
+    start_time = time.time()
+    
+    items = iter_batch_inputs([(f.filename, f.file) for f in files])
+    results: List[FileDetections] = []
+    async with admitted([loaded.spec.id]):
+        try:
+            # Read the next chunk while the current one is decoded and inferred
+            with timer.stage("read"):
+                chunk = await asyncio.to_thread(take, items, batch_detect_size)
+            while chunk:
+                next_chunk = asyncio.create_task(asyncio.to_thread(take, items, batch_detect_size))
+                try:
+                    results += await detect_batch_chunk(chunk, model_ref, confidence, tier, timer,
+                                                        columnar=response_format != JSON)
+                finally:
+                    with timer.stage("read"):
+                        chunk = await next_chunk
+        except TooManyFilesError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except BatchInputError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"Error processing batch: {e}")
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    with timer.stage("serialize"):
+        class_counts: Dict[str, int] = {}
+        densities = []
+        for result in results:
+            for name, count in result.class_counts.items():
+                class_counts[name] = class_counts.get(name, 0) + count
+            if result.error is None:
+                densities.append(result.waste_density)
+        response = BatchDetectionResponse(
+            results=results,
+            processing_time=time.time() - start_time,
+            file_count=len(results),
+            failed_count=len(results) - len(densities),
+            class_counts=class_counts,
+            mean_waste_density=sum(densities) / len(densities) if densities else None,
+            quality=quality_used
+        )
+    
+    if timings:
+        response.timings = timer.breakdown()
+    print(f"Processed batch of {response.file_count} files ({response.failed_count} failed) in {response.processing_time:.2f}s")
+    with timer.stage("encode"):
+        encoded = encoded_response(response, response_format)
+    timer.observe()
+    return encoded
+
+def encode_stream_record(record: Dict[str, Any], sse: bool) -> str:
+    data = json.dumps(record)
+    if sse:
+        return f"event: {record['type']}\ndata: {data}\n\n"
+    return data + "\n"
+
+@app.post("/detect/stream", responses={400: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def detect_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    model: str = Form("yolo"),
+    confidence: float = Form(0.25),
+    sample_fps: Optional[float] = Form(None),
+    sample_stride: Optional[int] = Form(None),
+    max_frames: Optional[int] = Form(None),
+    scene_gate: bool = Form(False),
+    scene_threshold: Optional[float] = Form(None),
+    stream_format: Optional[Literal["ndjson", "sse"]] = Form(None),
+    track: bool = Form(False),
+    keyframe_interval: Optional[int] = Form(None),
+    quality: Optional[str] = Form(None),
+    imgsz: Optional[int] = Form(None),
+    max_det: Optional[int] = Form(None),
+    int8: Optional[bool] = Form(None)
+):
+    """Stream a video's detections frame by frame, followed by a summary record.
+
+    Responds with NDJSON, or server-sent events when stream_format=sse or the
+    Accept header asks for text/event-stream.
+    """
+    print(f"Received stream request: model={model}, confidence={confidence}, file={file.filename}")
+    
+    sampling, scene_threshold = parse_video_options(sample_fps, sample_stride, max_frames, scene_gate, scene_threshold)
+    tracking = parse_tracking(track, keyframe_interval)
+    tier = parse_quality(quality, imgsz, max_det, int8)
+    loaded, model_ref, _, quality_used = await select_model(model, tier)
+    check_upload_size([file], "video")
+    
+    if stream_format is None:
+        stream_format = "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+    sse = stream_format == "sse"
+    
+    # The inference slot and the spooled upload are held until the stream
+    # finishes, not just until the response starts
+    resources = AsyncExitStack()
+    try:
+        await resources.enter_async_context(admitted([loaded.spec.id]))
+        upload = await resources.enter_async_context(spool_upload(file_chunks(file), suffix=".mp4"))
+    except BaseException:
+        await resources.aclose()
+        raise
+    
+    start_time = time.time()
+    records = executor.iterate(iter_video_file, upload.path, model_ref, confidence, sampling, scene_threshold, tier=tier,
+                               tracking=tracking)
+    
+    # Open the video before responding so an unreadable file is still a plain 400
+    try:
+        _, video_info = await records.__anext__()
+    except Exception as e:
+        await records.aclose()
+        await resources.aclose()
+        if isinstance(e, MediaError):
+            raise HTTPException(status_code=400, detail=str(e))
+        print(f"Error processing video: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def body():
+        try:
+            yield encode_stream_record({"type": "video", **video_info, "quality": quality_used}, sse)
+            async for kind, payload in records:
+                if kind == "frame":
+                    frame_idx, frame_detections = payload
+                    yield encode_stream_record({
+                        "type": "frame",
+                        "frame": frame_idx,
+                        "detections": frame_detections.to_dicts()
+                    }, sse)
+                elif kind == "summary":
+                    payload.pop("detections", None)
+                    yield encode_stream_record({
+                        "type": "summary",
+                        "processing_time": time.time() - start_time,
+                        **payload
+                    }, sse)
+                    print(f"Streamed video with {payload['detection_count']} detections across {payload['frames_sampled']} frames in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            print(f"Error streaming video: {e}")
+            traceback.print_exc()
+            yield encode_stream_record({"type": "error", "error": str(e)}, sse)
+        finally:
+            await records.aclose()
+            await resources.aclose()
+    
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type)
+
+@app.post("/detect/video", response_model=DetectionResponse,
+          responses={400: {"model": ErrorResponse}, 413: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def detect_video(
+    request: Request,
+    model: str = "yolo",
+    confidence: float = 0.25,
+    sample_fps: Optional[float] = None,
+    sample_stride: Optional[int] = None,
+    max_frames: Optional[int] = None,
+    scene_gate: bool = False,
+    scene_threshold: Optional[float] = None,
+    track: bool = False,
+    keyframe_interval: Optional[int] = None,
+    quality: Optional[str] = None,
+    imgsz: Optional[int] = None,
+    max_det: Optional[int] = None,
+    int8: Optional[bool] = None,
+    timings: bool = False
+):
+    """Detect objects in a video sent as the raw request body, taking /detect's
+    video options as query parameters.
+
+    Videos that can be read front to back (Matroska/WebM, MPEG-TS, and MP4
+    with its index first) are decoded while they are still uploading. Others
+    are written to disk first, as on /detect.
+    """
+    print(f"Received video upload: model={model}, confidence={confidence}, content_type={request.headers.get('content-type')}")
+    
+    sampling, scene_threshold = parse_video_options(sample_fps, sample_stride, max_frames, scene_gate, scene_threshold)
+    tracking = parse_tracking(track, keyframe_interval)
+    tier = parse_quality(quality, imgsz, max_det, int8)
+    loaded, model_ref, _, quality_used = await select_model(model, tier)
+    timer = StageTimer(model=loaded.spec.id, media_type="video")
+    response_format = negotiate(request.headers.get("accept"))
+    
+    # UploadLimitMiddleware holds the body to the same limit
+    limit = UPLOAD_LIMITS["video"]
+    
+    async with admitted([loaded.spec.id]), AsyncExitStack() as uploads:
+        upload = None
+        try:
+            head, chunks = await peek(request.stream())
+            if not head:
+                raise HTTPException(status_code=400, detail="No video in the request body")
+            if streamable_container(head):
+                upload = await uploads.enter_async_context(pipe_upload(chunks, max_bytes=limit))
+            else:
+                with timer.stage("read"):
+                    upload = await uploads.enter_async_context(spool_upload(chunks, suffix=".mp4", max_bytes=limit))
+            response = await process_video(upload, model_ref, confidence, sampling, scene_threshold, tier, quality_used, timer,
+                                           columnar=response_format != JSON, tracking=tracking)
+            # Wait for the rest of a progressive upload, which fails if it was cut short or too large
+            await uploads.aclose()
+        except Exception as e:
+            # A pipe's decoder fails on the truncated video when the upload is stopped for
+            # its size, usually before the upload's own error surfaces; report the cause
+            if upload is not None and upload.feed_error() is not None:
+                e = upload.feed_error()
+            if isinstance(e, HTTPException):
+                raise e
+            if isinstance(e, UploadTooLargeError):
+                raise HTTPException(status_code=413, detail=str(e))
+            print(f"Error processing video: {e}")
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    if timings:
+        response.timings = timer.breakdown()
+    with timer.stage("encode"):
+        response = encoded_response(response, response_format)
+    timer.observe()
+    return response
+
+def run_detection_job(job: Dict[str, Any], progress) -> Dict[str, Any]:
+    """Process one stored job on a job worker thread"""
+    params = job["params"]
+    confidence = params["confidence"]
+    quality = params.get("quality")
+    tier = QualityTier(**params["tier"]) if params.get("tier") else None
+    # The registry's current version, so the job's model copy counts against its memory budget
+    loaded = registry.get(job["model"])
+    model_ref = registry.worker_ref(loaded, loaded.runtime_path(tier.int8 if tier else False)[0])
+    tracking = TrackingOptions(**params["tracking"]) if params.get("tracking") else None
+    start_time = time.time()
+    
+    if job["media_type"] == "video":
+        sampling = SamplingStrategy(**params["sampling"])
+        result = None
+        frames_done = 0
+        frames_total = None
+        for kind, payload in iter_video_file(job["input_path"], model_ref, confidence, sampling,
+                                             params["scene_threshold"], keep_detections=True, tier=tier,
+                                             tracking=tracking):
+            if kind == "video":
+                frames_total = payload["frames_sampled"]
+                progress(0, frames_total)
+            elif kind == "frame":
+                frames_done += 1
+                progress(frames_done, frames_total)
+            else:
+                result = payload
+        response = video_response(result, time.time() - start_time, quality)
+    else:
+        with open(job["input_path"], "rb") as f:
+            img, original_size = decode_image(f.read(), decode_target_size(tier))
+        results = run_model(model_ref, img, confidence, tier)
+        batch = DetectionBatch.from_results(results).scaled(*original_scale(img, original_size))
+        response = image_response(batch, original_size[0] * original_size[1], time.time() - start_time, quality)
+        progress(1, 1)
+    
+    return response.model_dump()
+
+# Background jobs for long-running uploads, kept in SQLite so they survive restarts
+job_dir = os.environ.get('JOB_DIR', os.path.join(tempfile.gettempdir(), 'binsavvy-jobs'))
+os.makedirs(job_dir, exist_ok=True)
+job_store = JobStore(os.environ.get('JOB_DB_PATH', 'jobs.db'))
+job_manager = JobManager(
+    job_store,
+    run_detection_job,
+    workers=job_workers,
+    queue_depth=int(os.environ.get('JOB_QUEUE_DEPTH', 16))
+)
+
+def job_status(job: Dict[str, Any]) -> JobStatus:
+    return JobStatus(**{name: job[name] for name in JobStatus.model_fields if name in job})
+
+@app.post("/jobs", response_model=JobStatus, status_code=202, responses={400: {"model": ErrorResponse}, 503: {"model": ErrorResponse}})
+async def create_job(
+    file: UploadFile = File(...),
+    model: str = Form("yolo"),
+    media_type: Literal["image", "video"] = Form("video"),
+    confidence: float = Form(0.25),
+    sample_fps: Optional[float] = Form(None),
+    sample_stride: Optional[int] = Form(None),
+    max_frames: Optional[int] = Form(None),
+    scene_gate: bool = Form(False),
+    scene_threshold: Optional[float] = Form(None),
+    track: bool = Form(False),
+    keyframe_interval: Optional[int] = Form(None),
+    quality: Optional[str] = Form(None),
+    imgsz: Optional[int] = Form(None),
+    max_det: Optional[int] = Form(None),
+    int8: Optional[bool] = Form(None)
+):
+    """Queue an upload for background detection and return its job id"""
+    print(f"Received job: model={model}, media_type={media_type}, confidence={confidence}, file={file.filename}")
+    
+    check_upload_size([file], media_type)
+    sampling, scene_threshold = parse_video_options(sample_fps, sample_stride, max_frames, scene_gate, scene_threshold)
+    tracking = parse_tracking(track, keyframe_interval)
+    tier = parse_quality(quality, imgsz, max_det, int8)
+    # Checks the model exists, and loads it before the job's turn comes
+    _, _, _, quality_used = await select_model(model, tier)
+    
+    # Keep the upload on disk until a worker has processed it. File and SQLite
+    # calls run on threads so they don't stall the event loop.
+    job_id = uuid.uuid4().hex
+    input_path = os.path.join(job_dir, job_id)
+    buffer = await asyncio.to_thread(open, input_path, "wb")
+    try:
+        try:
+            while chunk := await file.read(1024 * 1024):
+                await asyncio.to_thread(buffer.write, chunk)
+        finally:
+            await asyncio.to_thread(buffer.close)
+    except BaseException:
+        # Don't leave a partial upload behind
+        await asyncio.to_thread(os.remove, input_path)
+        raise
+    
+    params = {
+        "confidence": confidence,
+        "sampling": {"target_fps": sampling.target_fps, "stride": sampling.stride, "max_frames": sampling.max_frames},
+        "scene_threshold": scene_threshold,
+        "tracking": vars(tracking) if tracking else None,
+        "tier": {"name": tier.name, "imgsz": tier.imgsz, "max_det": tier.max_det, "int8": tier.int8},
+        "quality": quality_used
+    }
+    job = await asyncio.to_thread(job_store.create, model, media_type, params, input_path, job_id=job_id)
+    try:
+        job_manager.submit(job_id)
+    except QueueFullError as e:
+        await asyncio.to_thread(job_store.update, job_id, status="failed", error=str(e))
+        await asyncio.to_thread(os.remove, input_path)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    
+    return job_status(job)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus, responses={404: {"model": ErrorResponse}})
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job_status(job)
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
+    job_counts = await asyncio.to_thread(job_store.counts)
     return HealthResponse(
         status="ok",
-        models={
-            "waste": ModelStatus(
-                loaded=waste_model is not None,
-                path=waste_model_path,
-                exists=waste_model_exists
-            ),
-            "drone": ModelStatus(
-                loaded=drone_model is not None,
-                path=drone_model_path,
-                exists=drone_model_exists
-            )
-        }
+        models={model_id: ModelStatus(**status) for model_id, status in registry.status().items()},
+        registry=registry.describe(),
+        batching={name: batcher.stats.snapshot() for name, batcher in batchers.items()},
+        executor=executor.describe(),
+        jobs={**job_manager.describe(), "by_status": job_counts},
+        admission=admission.stats(),
+        load_shedding=load_shedder.stats() if load_shedder is not None else None,
+        cache=result_cache.stats() if result_cache is not None else None
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import os
+import queue
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Above this many frames between two samples, seeking is assumed to be cheaper
+# than decoding straight through. A seek re-decodes from the previous keyframe,
+# so this is roughly the encoder's keyframe interval (x264 defaults to 250).
+DEFAULT_SEEK_THRESHOLD = int(os.environ.get('SAMPLER_SEEK_THRESHOLD', 250))
+
+# Frames sampled per video when no strategy is given
+DEFAULT_SAMPLE_COUNT = 10
+
+
+class SamplingStrategy:
+    """Which frames of a video to analyse.
+
+    With no options the video is sampled at ~10 evenly spaced frames. `stride`
+    takes every Nth frame, `target_fps` picks a stride from the video's frame
+    rate, and `max_frames` caps the total by thinning the plan evenly.
+    """
+
+    def __init__(self, target_fps: Optional[float] = None, stride: Optional[int] = None,
+                 max_frames: Optional[int] = None):
+        if target_fps is not None and target_fps <= 0:
+            raise ValueError("sample_fps must be greater than 0")
+        if stride is not None and stride < 1:
+            raise ValueError("sample_stride must be at least 1")
+        if max_frames is not None and max_frames < 1:
+            raise ValueError("max_frames must be at least 1")
+        self.target_fps = target_fps
+        self.stride = stride
+        self.max_frames = max_frames
+
+    def plan(self, frame_count: int, fps: float) -> List[int]:
+        """Frame indices to sample, in increasing order"""
+        if frame_count <= 0:
+            return []
+
+        if self.stride is not None:
+            stride = self.stride
+        elif self.target_fps is not None and fps > 0:
+            stride = max(1, int(round(fps / self.target_fps)))
+        else:
+            stride = max(1, int(frame_count / DEFAULT_SAMPLE_COUNT))
+        frames = list(range(0, frame_count, stride))
+
+        if self.max_frames is not None and len(frames) > self.max_frames:
+            picks = np.unique(np.linspace(0, len(frames) - 1, self.max_frames).round().astype(int))
+            frames = [frames[i] for i in picks]
+        return frames
+
+
+class FramePool:
+    """Frame buffers that cap.read() decodes into in place, recycled once a frame is done with.
+
+    Buffers are allocated by the first `size` reads and reused after that.
+    take() never blocks: with every buffer in use, the read allocates a
+    fresh frame, which is dropped on release if the pool is already full.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._free = queue.Queue()
+        self.reused = 0
+
+    def take(self) -> Optional[np.ndarray]:
+        try:
+            frame = self._free.get_nowait()
+        except queue.Empty:
+            return None
+        self.reused += 1
+        return frame
+
+    def release(self, frame: np.ndarray):
+        # Called from the consumer thread while the producer takes
+        if self._free.qsize() < self.size:
+            self._free.put(frame)
+
+
+class FrameSampler:
+    """Reads a planned set of frames from an open cv2.VideoCapture.
+
+    Small gaps are skipped with grab(), which decodes without the colour
+    conversion and copy of read(). Only gaps larger than `seek_threshold`
+    use a CAP_PROP_POS_FRAMES seek.
+
+    Frames are BGR, as decoded. With a FramePool they are read into recycled
+    buffers, so a caller must release() each frame once it's done with it
+    and not hold on to it after that.
+    """
+
+    def __init__(self, cap: cv2.VideoCapture, frame_indices: List[int],
+                 seek_threshold: int = DEFAULT_SEEK_THRESHOLD, pool: Optional[FramePool] = None):
+        self.cap = cap
+        self.frame_indices = frame_indices
+        self.seek_threshold = seek_threshold
+        self.pool = pool
+        self.seeks = 0
+        self.grabs = 0
+        self.reads = 0
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        position = 0  # index of the next frame the decoder will return
+        for frame_idx in self.frame_indices:
+            gap = frame_idx - position
+            if gap < 0 or gap > self.seek_threshold:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                self.seeks += 1
+            else:
+                for _ in range(gap):
+                    if not self.cap.grab():
+                        return
+                    self.grabs += 1
+
+            buffer = self.pool.take() if self.pool is not None else None
+            # A buffer of the wrong size (the stream changed resolution) is replaced by a new frame
+            ret, frame = self.cap.read(buffer)
+            position = frame_idx + 1
+            if not ret:
+                if buffer is not None:
+                    self.pool.release(buffer)
+                continue
+            self.reads += 1
+            yield frame_idx, frame
+
+    def release(self, frame: np.ndarray):
+        """Hand a frame's buffer back for a later read to decode into"""
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    def describe(self) -> dict:
+        stats = {"seeks": self.seeks, "grabs": self.grabs, "reads": self.reads}
+        if self.pool is not None:
+            stats["buffers_reused"] = self.pool.reused
+        return stats
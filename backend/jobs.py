@@ -0,0 +1,196 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the job queue is at capacity"""
+
+
+class JobStore:
+    """Job state and results kept in a local SQLite database"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    media_type TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    input_path TEXT NOT NULL,
+                    frames_done INTEGER NOT NULL DEFAULT 0,
+                    frames_total INTEGER,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _row_to_job(self, row) -> Dict[str, Any]:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def create(self, model: str, media_type: str, params: Dict[str, Any], input_path: str,
+               job_id: Optional[str] = None) -> Dict[str, Any]:
+        now = time.time()
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, model, media_type, params, input_path, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, model, media_type, json.dumps(params), input_path, now, now),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id: str, **fields):
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"])
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """Jobs that were queued or running, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobManager:
+    """Runs stored jobs on a pool of worker threads.
+
+    `handler(job, progress)` does the work for one job and returns its result
+    as a JSON-serializable dict. It may call `progress(done, total)` to report
+    frames processed. Jobs left unfinished by a restart are picked up again by
+    start().
+    """
+
+    def __init__(self, store: JobStore, handler: Callable[[Dict[str, Any], Callable[[int, Optional[int]], None]], Dict[str, Any]],
+                 workers: int = 1, queue_depth: int = 16, progress_interval: float = 0.5):
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_depth = max(1, queue_depth)
+        self.progress_interval = progress_interval
+        self._queue = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._running = 0
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._threads:
+            return
+        # Resume jobs that were queued or interrupted mid-run
+        for job in self.store.unfinished():
+            if os.path.exists(job["input_path"]):
+                self.store.update(job["id"], status=QUEUED, frames_done=0)
+                self._queue.put(job["id"])
+            else:
+                self.store.update(job["id"], status=FAILED, error="Input file lost before the job could run")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, job_id: str):
+        with self._lock:
+            if self._queue.qsize() >= self.queue_depth:
+                raise QueueFullError(f"Job queue is full ({self.queue_depth} jobs waiting)")
+            self._queue.put(job_id)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue_depth,
+            "queued": self.queued,
+            "running": self._running,
+        }
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            job = self.store.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                continue
+            with self._lock:
+                self._running += 1
+            try:
+                self._run_job(job)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def _run_job(self, job: Dict[str, Any]):
+        job_id = job["id"]
+        self.store.update(job_id, status=RUNNING)
+        last_update = 0.0
+
+        def progress(done: int, total: Optional[int]):
+            # Throttle database writes for long videos
+            nonlocal last_update
+            now = time.time()
+            if now - last_update >= self.progress_interval or (total is not None and done >= total):
+                last_update = now
+                self.store.update(job_id, frames_done=done, frames_total=total)
+
+        try:
+            result = self.handler(job, progress)
+            self.store.update(job_id, status=COMPLETED, result=result)
+            print(f"Job {job_id} completed")
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            traceback.print_exc()
+            self.store.update(job_id, status=FAILED, error=str(e))
+        finally:
+            try:
+                os.remove(job["input_path"])
+            except OSError:
+                pass
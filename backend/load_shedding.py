@@ -0,0 +1,160 @@
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from frame_sampler import SamplingStrategy
+from quality import QualityTier
+from scene_gate import DEFAULT_SCENE_THRESHOLD
+from tracking import TrackingOptions
+
+# Latency each media type should stay under (as the 95th percentile of recent /detect requests)
+LOAD_SHEDDING_IMAGE_TARGET = float(os.environ.get('LOAD_SHEDDING_IMAGE_TARGET', 2.0))
+LOAD_SHEDDING_VIDEO_TARGET = float(os.environ.get('LOAD_SHEDDING_VIDEO_TARGET', 30.0))
+# Requests waiting for an inference slot that count as overload regardless of latency
+LOAD_SHEDDING_QUEUE_DEPTH = int(os.environ.get('LOAD_SHEDDING_QUEUE_DEPTH', 4))
+# Latencies a window must hold before its percentile counts, so one slow request can't change the level
+LOAD_SHEDDING_MIN_SAMPLES = int(os.environ.get('LOAD_SHEDDING_MIN_SAMPLES', 10))
+# Latencies considered, and the least time between two level changes
+LOAD_SHEDDING_WINDOW = float(os.environ.get('LOAD_SHEDDING_WINDOW', 30.0))
+LOAD_SHEDDING_COOLDOWN = float(os.environ.get('LOAD_SHEDDING_COOLDOWN', 5.0))
+# Full quality comes back once latency is below this fraction of the target
+LOAD_SHEDDING_RECOVER_RATIO = float(os.environ.get('LOAD_SHEDDING_RECOVER_RATIO', 0.5))
+
+
+class DegradationLevel:
+    """How far requests are cut back at one load-shedding level.
+
+    `max_frames` caps the frames sampled per video, `keyframe_scale`
+    stretches the keyframe interval in tracking mode, `imgsz` and `max_det`
+    cap the inference settings and `scene_gate` skips near-duplicate frames.
+    Settings a request already has at or below a cap are left alone.
+    """
+
+    def __init__(self, level: int, name: str, max_frames: Optional[int] = None, keyframe_scale: int = 1,
+                 imgsz: Optional[int] = None, max_det: Optional[int] = None, scene_gate: bool = False):
+        self.level = level
+        self.name = name
+        self.max_frames = max_frames
+        self.keyframe_scale = keyframe_scale
+        self.imgsz = imgsz
+        self.max_det = max_det
+        self.scene_gate = scene_gate
+
+    def apply(self, sampling: SamplingStrategy, scene_threshold: Optional[float], tier: QualityTier,
+              tracking: Optional[TrackingOptions] = None
+              ) -> Tuple[SamplingStrategy, Optional[float], QualityTier, Optional[TrackingOptions]]:
+        """A request's video and inference settings, cut back to this level"""
+        if tracking is not None:
+            # Tracking needs consecutive frames, so infer on fewer keyframes instead of sampling fewer frames
+            if self.keyframe_scale > 1:
+                tracking = TrackingOptions(**{**vars(tracking), "keyframe_interval": tracking.keyframe_interval * self.keyframe_scale})
+        elif self.max_frames is not None and (sampling.max_frames is None or sampling.max_frames > self.max_frames):
+            sampling = SamplingStrategy(sampling.target_fps, sampling.stride, self.max_frames)
+
+        if self.scene_gate and scene_threshold is None:
+            scene_threshold = DEFAULT_SCENE_THRESHOLD
+
+        imgsz = min(tier.imgsz, self.imgsz) if self.imgsz else tier.imgsz
+        max_det = min(tier.max_det, self.max_det) if self.max_det else tier.max_det
+        if (imgsz, max_det) != (tier.imgsz, tier.max_det):
+            tier = QualityTier(f"{tier.name}+degraded", imgsz=imgsz, max_det=max_det, int8=tier.int8)
+        return sampling, scene_threshold, tier, tracking
+
+    def describe(self) -> Dict[str, Any]:
+        return {"level": self.level, "name": self.name}
+
+
+DEGRADATION_LEVELS = [
+    DegradationLevel(0, "none"),
+    DegradationLevel(1, "fewer_frames", max_frames=5, keyframe_scale=2),
+    DegradationLevel(2, "reduced", max_frames=5, keyframe_scale=2, imgsz=480, scene_gate=True),
+    DegradationLevel(3, "minimal", max_frames=3, keyframe_scale=4, imgsz=320, max_det=100, scene_gate=True),
+]
+
+
+class LoadShedder:
+    """Steps requests through DEGRADATION_LEVELS as /detect falls behind.
+
+    Latencies are recorded relative to their media type's target. While the
+    95th percentile of at least `min_samples` recent requests is over target,
+    or too many requests are queued, the level goes up one step per cooldown.
+    Once latency is well under target and nothing is queued it comes back
+    down one step at a time, as it does when too few requests have finished
+    in a whole window. Latencies are forgotten on every change, so each level
+    is judged on requests it served.
+    """
+
+    def __init__(self, targets: Optional[Dict[str, float]] = None, queue_depth: Callable[[], int] = lambda: 0,
+                 max_queue_depth: int = LOAD_SHEDDING_QUEUE_DEPTH, min_samples: int = LOAD_SHEDDING_MIN_SAMPLES,
+                 window: float = LOAD_SHEDDING_WINDOW,
+                 cooldown: float = LOAD_SHEDDING_COOLDOWN, recover_ratio: float = LOAD_SHEDDING_RECOVER_RATIO,
+                 levels: List[DegradationLevel] = DEGRADATION_LEVELS):
+        self.targets = targets or {"image": LOAD_SHEDDING_IMAGE_TARGET, "video": LOAD_SHEDDING_VIDEO_TARGET}
+        self.queue_depth = queue_depth
+        self.max_queue_depth = max_queue_depth
+        self.min_samples = max(1, min_samples)
+        self.window = window
+        self.cooldown = cooldown
+        self.recover_ratio = recover_ratio
+        self.levels = levels
+        self.index = 0
+        self.changed_at = time.monotonic()
+        self.changes = 0
+        # (time, latency / target) of recent requests
+        self._samples = deque()
+
+    def observe(self, media_type: str, seconds: float):
+        """Record how long a request took"""
+        target = self.targets.get(media_type)
+        if target:
+            self._samples.append((time.monotonic(), seconds / target))
+
+    def _pressure(self, now: float) -> Optional[float]:
+        # 95th percentile of recent latency relative to target, or None with too few recent requests
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+        if len(self._samples) < self.min_samples:
+            return None
+        ratios = sorted(ratio for _, ratio in self._samples)
+        return ratios[min(len(ratios) - 1, math.ceil(0.95 * len(ratios)) - 1)]
+
+    def current(self) -> DegradationLevel:
+        """The level to serve the next request at, stepping it if due"""
+        now = time.monotonic()
+        if now - self.changed_at >= self.cooldown:
+            pressure = self._pressure(now)
+            queued = self.queue_depth()
+            if (pressure is not None and pressure > 1) or queued >= self.max_queue_depth:
+                step = 1
+            elif queued == 0 and (pressure < self.recover_ratio if pressure is not None
+                                  else now - self.changed_at >= self.window):
+                step = -1
+            else:
+                step = 0
+            index = min(max(self.index + step, 0), len(self.levels) - 1)
+            if index != self.index:
+                print(f"Load shedding: level {self.levels[self.index].name} -> {self.levels[index].name} "
+                      f"(latency {pressure or 0:.2f}x target, {queued} queued)")
+                self.index = index
+                self.changed_at = now
+                self.changes += 1
+                self._samples.clear()
+        return self.levels[self.index]
+
+    def stats(self) -> Dict[str, Any]:
+        pressure = self._pressure(time.monotonic())
+        return {
+            **self.levels[self.index].describe(),
+            "latency_ratio": pressure,
+            "targets": self.targets,
+            "changes": self.changes,
+        }
+
+
+def load_shedder_from_env(queue_depth: Callable[[], int] = lambda: 0) -> Optional[LoadShedder]:
+    """Build a load shedder from LOAD_SHEDDING_* settings, or None unless LOAD_SHEDDING_ENABLED is set"""
+    if os.environ.get('LOAD_SHEDDING_ENABLED', 'False').lower() != 'true':
+        return None
+    return LoadShedder(queue_depth=queue_depth)
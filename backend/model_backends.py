@@ -0,0 +1,90 @@
+import os
+import threading
+from typing import Any, Optional
+
+import numpy as np
+from ultralytics import YOLO
+
+# Inference backends and the ultralytics export format behind each
+BACKEND_FORMATS = {
+    "pytorch": None,
+    "torchscript": "torchscript",
+    "onnx": "onnx",
+    "openvino": "openvino",
+}
+
+# Backends with an INT8 export, calibrated on INT8_CALIBRATION_DATA (an ultralytics dataset yaml of
+# images like the ones served). Without it INT8 requests run at full precision.
+INT8_BACKENDS = {"openvino"}
+INT8_CALIBRATION_DATA = os.environ.get('INT8_CALIBRATION_DATA') or None
+
+# Forward passes run on a freshly loaded model before it serves requests
+WARMUP_RUNS = int(os.environ.get('MODEL_WARMUP_RUNS', 1))
+
+# Exports write next to the weights under fixed names, so only one may run per file at a time
+_export_lock = threading.Lock()
+
+
+def check_backend(backend: str) -> str:
+    backend = backend.lower()
+    if backend not in BACKEND_FORMATS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKEND_FORMATS)})")
+    return backend
+
+
+def export_path(weights_path: str, backend: str, int8: bool = False) -> str:
+    """Where ultralytics writes the export of `weights_path` for a backend"""
+    stem, _ = os.path.splitext(weights_path)
+    if backend == "openvino":
+        return f"{stem}_{'int8_' if int8 else ''}openvino_model"
+    return f"{stem}.{BACKEND_FORMATS[backend]}"
+
+
+def prepare_weights(weights_path: str, backend: str, imgsz: int = 640, int8: bool = False) -> str:
+    """Path to load for a backend, exporting the PyTorch weights first when needed.
+
+    Exports are cached next to the weights and redone when the weights file
+    is newer than the export.
+    """
+    backend = check_backend(backend)
+    if int8 and backend not in INT8_BACKENDS:
+        raise ValueError(f"No INT8 export for the {backend} backend")
+    if backend == "pytorch":
+        return weights_path
+    target = export_path(weights_path, backend, int8)
+    with _export_lock:
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(weights_path):
+            return target
+        if int8 and INT8_CALIBRATION_DATA is None:
+            # ultralytics would otherwise download and calibrate on a generic sample dataset
+            raise ValueError("INT8 export needs INT8_CALIBRATION_DATA set to a calibration dataset yaml")
+        print(f"Exporting {weights_path} for {backend}{' (int8)' if int8 else ''} at imgsz={imgsz}")
+        # Dynamic input shapes keep batched calls working and let exports use the same
+        # minimal letterbox padding as PyTorch, so detections match across backends
+        options = {"int8": True, "data": INT8_CALIBRATION_DATA} if int8 else {}
+        exported = YOLO(weights_path).export(format=BACKEND_FORMATS[backend], imgsz=imgsz, dynamic=True, **options)
+    return str(exported)
+
+
+def load_model(path: str):
+    """Load weights or an exported model; exports don't record the task, so name it"""
+    return YOLO(path, task="detect")
+
+
+def warmup(model: Any, imgsz: int = 640, runs: Optional[int] = None):
+    """Run blank frames through the model so the first request doesn't pay for
+    graph compilation and buffer allocation"""
+    frame = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(WARMUP_RUNS if runs is None else runs):
+        model(frame)
+
+
+def model_nbytes(model: Any, path: str) -> int:
+    """Memory a loaded model holds: its torch parameters and buffers, or the size on disk for exports"""
+    try:
+        module = model.model
+        return sum(t.numel() * t.element_size() for t in (*module.parameters(), *module.buffers()))
+    except Exception:
+        if os.path.isdir(path):
+            return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+        return os.path.getsize(path) if os.path.exists(path) else 0
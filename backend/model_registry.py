@@ -0,0 +1,358 @@
+import itertools
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import yaml
+
+from model_backends import INT8_BACKENDS, check_backend, load_model, model_nbytes, prepare_weights, warmup
+from stages import ModelRef
+
+
+class UnknownModelError(LookupError):
+    """Raised when a request names a model that isn't configured"""
+
+
+class ModelUnavailableError(RuntimeError):
+    """Raised when a configured model's weights are missing or fail to load"""
+
+
+class ModelSpec:
+    """A configured model: its id, weights path, the names requests may use for
+    it and the inference backend it runs on"""
+
+    def __init__(self, model_id: str, path: str, aliases: Iterable[str] = (), preload: bool = False,
+                 backend: str = "pytorch", imgsz: int = 640):
+        self.id = model_id
+        self.path = path
+        self.aliases = list(aliases)
+        self.preload = preload
+        self.backend = check_backend(backend)
+        self.imgsz = imgsz
+
+
+class LoadedModel:
+    """One loaded version of a model's weights.
+
+    `model` is None when the stage workers hold the only copies. Requests
+    hold on to the LoadedModel they were given, so a reload or eviction never
+    pulls a model out from under an in-flight request.
+    """
+
+    def __init__(self, spec: ModelSpec, model: Any, version: float, path: str, backend: str,
+                 generation: int, nbytes: int):
+        self.spec = spec
+        self.model = model
+        self.version = version
+        # The file actually loaded: the weights, or their export for the backend
+        self.path = path
+        self.backend = backend
+        self.generation = generation
+        self.loaded_at = time.time()
+        self.nbytes = nbytes
+        # Quantized exports of this version, built on first request
+        self._int8_path: Optional[str] = None
+        self._int8_checked = False
+        self._variant_lock = threading.Lock()
+
+    @property
+    def names(self):
+        return self.model.names
+
+    def runtime_path(self, int8: bool = False) -> Tuple[str, str]:
+        """The path workers should load and the precision it runs at.
+
+        The INT8 variant is exported on first use where the backend has one;
+        otherwise, or if the export fails, the full-precision model is used.
+        """
+        if not int8 or self.backend not in INT8_BACKENDS:
+            return self.path, "fp32"
+        with self._variant_lock:
+            if not self._int8_checked:
+                self._int8_checked = True
+                try:
+                    self._int8_path = prepare_weights(self.spec.path, self.backend, self.spec.imgsz, int8=True)
+                except Exception as e:
+                    print(f"Could not export an INT8 {self.spec.id} model, using full precision: {e}")
+        if self._int8_path is None:
+            return self.path, "fp32"
+        return self._int8_path, "int8"
+
+    def paths(self) -> List[str]:
+        """Every file workers may load for this version"""
+        return [self.path, self._int8_path] if self._int8_path is not None else [self.path]
+
+
+class _Slot:
+    def __init__(self, spec: ModelSpec):
+        self.spec = spec
+        self.lock = threading.Lock()
+        self.current: Optional[LoadedModel] = None
+        self.checked_at = 0.0
+        self.last_used = 0.0
+        self.failed_version: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reloading = False
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+
+
+class ModelRegistry:
+    """Loads configured models on first use and keeps them within a memory budget.
+
+    Loaded models are evicted least recently used first once their combined
+    size exceeds `memory_budget_bytes` (0 means no limit). Every
+    `reload_interval` seconds a request also checks the weights file's
+    mtime; a changed file is loaded on a background thread and swapped in
+    once ready, while requests keep using the previous version. Weights
+    should be replaced by renaming a complete file over the old one.
+
+    With a `worker_loader`, the registry keeps no model of its own: stage
+    workers run the versions given by `worker_ref`, and a load asks one
+    worker to load the version and report its size. Each model then counts
+    `copies` times (one per worker) against the budget.
+    """
+
+    def __init__(self, specs: List[ModelSpec], memory_budget_bytes: int = 0, reload_interval: float = 2.0,
+                 loader: Callable[[str], Any] = load_model,
+                 worker_loader: Optional[Callable[[ModelRef], int]] = None, copies: int = 1):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.reload_interval = reload_interval
+        self.loader = loader
+        self.worker_loader = worker_loader
+        self.copies = max(1, copies)
+        self._generations = itertools.count(1)
+        self._slots: Dict[str, _Slot] = {spec.id: _Slot(spec) for spec in specs}
+        self._names: Dict[str, str] = {}
+        for spec in specs:
+            for name in (spec.id, *spec.aliases):
+                self._names[name] = spec.id
+        self._lock = threading.Lock()
+
+    def resolve(self, name: str) -> ModelSpec:
+        """The spec for a model id or alias"""
+        try:
+            return self._slots[self._names[name]].spec
+        except KeyError:
+            raise UnknownModelError(f"Unknown model: {name}")
+
+    def get(self, name: str) -> LoadedModel:
+        """The current version of a model, loading it first if needed"""
+        slot = self._slots[self.resolve(name).id]
+        with slot.lock:
+            if slot.current is None:
+                self._load(slot)
+            elif time.time() - slot.checked_at >= self.reload_interval:
+                self._check_for_update(slot)
+            loaded = slot.current
+            slot.last_used = time.time()
+        self._enforce_budget(keep=slot)
+        return loaded
+
+    def preload(self):
+        """Load the models marked for preloading, logging any that fail"""
+        for slot in self._slots.values():
+            if slot.spec.preload:
+                try:
+                    self.get(slot.spec.id)
+                except ModelUnavailableError as e:
+                    print(e)
+
+    def _load(self, slot: _Slot):
+        path = slot.spec.path
+        slot.checked_at = time.time()
+        if not os.path.exists(path):
+            slot.error = f"Model file not found at {path}"
+            raise ModelUnavailableError(
+                f"Model not loaded. Check if the model file exists at {path} and the model can be loaded correctly."
+            )
+        version = os.path.getmtime(path)
+        try:
+            slot.current = self._build(slot.spec, version)
+        except Exception as e:
+            print(f"Error loading {slot.spec.id} model: {e}")
+            traceback.print_exc()
+            slot.error = str(e)
+            raise ModelUnavailableError(f"Model {slot.spec.id} could not be loaded from {path}: {e}")
+        slot.error = None
+        slot.failed_version = None
+        slot.loads += 1
+        print(f"Loaded {slot.spec.id} model from {slot.current.path} ({slot.current.backend}, {slot.current.nbytes / 1e6:.1f} MB)")
+
+    def _build(self, spec: ModelSpec, version: float) -> LoadedModel:
+        path, backend = spec.path, spec.backend
+        if backend != "pytorch":
+            try:
+                path = prepare_weights(spec.path, backend, spec.imgsz)
+            except Exception as e:
+                # Serving on PyTorch beats not serving at all
+                print(f"Could not export {spec.id} model for {backend}, falling back to pytorch: {e}")
+                path, backend = spec.path, "pytorch"
+        generation = next(self._generations)
+        if self.worker_loader is not None:
+            model = None
+            nbytes = self.worker_loader(ModelRef(path, generation, self.resident()))
+        else:
+            model = self.loader(path)
+            warmup(model, spec.imgsz)
+            nbytes = model_nbytes(model, path)
+        return LoadedModel(spec, model, version, path, backend, generation, nbytes)
+
+    def resident(self) -> FrozenSet[str]:
+        """Paths of every model version the registry holds"""
+        return frozenset(path for slot in self._slots.values() if slot.current is not None
+                         for path in slot.current.paths())
+
+    def worker_ref(self, loaded: LoadedModel, path: str) -> ModelRef:
+        """What workers should run for a loaded model at `path` (its weights or INT8 export)"""
+        return ModelRef(path, loaded.generation, self.resident())
+
+    def _check_for_update(self, slot: _Slot):
+        slot.checked_at = time.time()
+        try:
+            version = os.path.getmtime(slot.spec.path)
+        except OSError:
+            # Keep serving the loaded version if the file is briefly missing mid-replace
+            return
+        if version == slot.current.version or version == slot.failed_version or slot.reloading:
+            return
+        slot.reloading = True
+        threading.Thread(target=self._reload, args=(slot, version), name=f"reload-{slot.spec.id}", daemon=True).start()
+
+    def _reload(self, slot: _Slot, version: float):
+        try:
+            loaded = self._build(slot.spec, version)
+        except Exception as e:
+            print(f"Error reloading {slot.spec.id} model, keeping the previous version: {e}")
+            with slot.lock:
+                slot.failed_version = version
+                slot.error = str(e)
+                slot.reloading = False
+            return
+        with slot.lock:
+            slot.current = loaded
+            slot.error = None
+            slot.failed_version = None
+            slot.reloading = False
+            slot.loads += 1
+            slot.reloads += 1
+        print(f"Reloaded {slot.spec.id} model from {slot.spec.path}")
+        self._enforce_budget(keep=slot)
+
+    def _enforce_budget(self, keep: _Slot):
+        if not self.memory_budget_bytes:
+            return
+        with self._lock:
+            loaded = [s for s in self._slots.values() if s.current is not None]
+            used = sum(s.current.nbytes for s in loaded) * self.copies
+            # Evict least recently used models, never the one just requested
+            for slot in sorted(loaded, key=lambda s: s.last_used):
+                if used <= self.memory_budget_bytes:
+                    break
+                if slot is keep:
+                    continue
+                with slot.lock:
+                    if slot.current is None:
+                        continue
+                    used -= slot.current.nbytes * self.copies
+                    slot.current = None
+                    slot.evictions += 1
+                print(f"Evicted {slot.spec.id} model to stay within the model memory budget")
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Per-model state, keyed by model id"""
+        status = {}
+        for model_id, slot in self._slots.items():
+            current = slot.current
+            status[model_id] = {
+                "loaded": current is not None,
+                "path": slot.spec.path,
+                "exists": os.path.exists(slot.spec.path),
+                "aliases": slot.spec.aliases,
+                "backend": current.backend if current is not None else slot.spec.backend,
+                "runtime_path": current.path if current is not None else None,
+                "version": current.version if current is not None else None,
+                "size_bytes": current.nbytes if current is not None else 0,
+                "last_used": slot.last_used or None,
+                "loads": slot.loads,
+                "reloads": slot.reloads,
+                "evictions": slot.evictions,
+                "error": slot.error,
+            }
+        return status
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "memory_used_bytes": sum(s.current.nbytes for s in self._slots.values() if s.current is not None) * self.copies,
+            "copies_per_model": self.copies,
+            "reload_interval": self.reload_interval,
+        }
+
+
+def load_model_config(config_path: str) -> Dict[str, Any]:
+    """Read a model config file. Relative weights paths are taken from the config file's directory.
+
+    Format:
+
+        memory_budget_mb: 2048
+        reload_interval: 2
+        models:
+          waste:
+            path: best.pt
+            aliases: [yolo]
+            preload: true
+            backend: onnx      # pytorch, torchscript, onnx or openvino
+            imgsz: 640         # input size exports are built for
+    """
+    with open(config_path) as f:
+        config = yaml.safe_load(f) or {}
+    base_dir = os.path.dirname(os.path.abspath(config_path))
+    specs = []
+    for model_id, options in (config.get("models") or {}).items():
+        if not options or "path" not in options:
+            raise ValueError(f"Model {model_id} in {config_path} has no path")
+        path = os.path.join(base_dir, os.path.expanduser(options["path"]))
+        specs.append(ModelSpec(model_id, path, options.get("aliases", []), bool(options.get("preload", False)),
+                               options.get("backend", "pytorch"), int(options.get("imgsz", 640))))
+    return {
+        "specs": specs,
+        "memory_budget_bytes": int(float(config.get("memory_budget_mb", 0)) * 1024 * 1024),
+        "reload_interval": float(config.get("reload_interval", 2.0)),
+    }
+
+
+def registry_from_env(worker_loader: Optional[Callable[[ModelRef], int]] = None, copies: int = 1) -> ModelRegistry:
+    """Build the registry from the MODEL_CONFIG file.
+
+    Without a config file the registry serves the waste and drone models from
+    YOLO_MODEL_PATH and DRONE_MODEL_PATH, under the request names "yolo" and
+    "best2", on the MODEL_BACKEND inference backend. MODEL_MEMORY_BUDGET_MB and MODEL_RELOAD_INTERVAL override the
+    config file's settings.
+    """
+    config_path = os.environ.get('MODEL_CONFIG')
+    if config_path:
+        config = load_model_config(config_path)
+        print(f"Loaded model config from {config_path}: {[spec.id for spec in config['specs']]}")
+    else:
+        backend = os.environ.get('MODEL_BACKEND', 'pytorch')
+        config = {
+            "specs": [
+                ModelSpec("waste", os.environ.get('YOLO_MODEL_PATH', 'best.pt'), ["yolo"], backend=backend),
+                ModelSpec("drone", os.environ.get('DRONE_MODEL_PATH', 'best2.pt'), ["best2"], backend=backend),
+            ],
+            "memory_budget_bytes": 0,
+            "reload_interval": 2.0,
+        }
+    if 'MODEL_MEMORY_BUDGET_MB' in os.environ:
+        config["memory_budget_bytes"] = int(float(os.environ['MODEL_MEMORY_BUDGET_MB']) * 1024 * 1024)
+    if 'MODEL_RELOAD_INTERVAL' in os.environ:
+        config["reload_interval"] = float(os.environ['MODEL_RELOAD_INTERVAL'])
+    for spec in config["specs"]:
+        if not os.path.exists(spec.path):
+            print(f"{spec.id} model file not found at {spec.path}")
+    return ModelRegistry(config["specs"], config["memory_budget_bytes"], config["reload_interval"],
+                         worker_loader=worker_loader, copies=copies)
@@ -0,0 +1,138 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Columnar postprocessing shared by the Flask and FastAPI apps. Detections are
+# kept as parallel NumPy arrays and only turned into per-box objects once, at
+# the very end, instead of looping over r.boxes with .tolist()/.item() calls.
+
+
+def class_name_table(names) -> List[str]:
+    """Turn a model's names mapping ({id: name} or list) into a list indexed by class id"""
+    if isinstance(names, dict):
+        size = max(names) + 1 if names else 0
+        table = [str(i) for i in range(size)]
+        for class_id, name in names.items():
+            table[class_id] = name
+        return table
+    return list(names)
+
+
+class DetectionBatch:
+    """Detections for one or more images/frames as parallel arrays, with track ids in tracking mode"""
+
+    def __init__(self, xyxy: np.ndarray, confidences: np.ndarray, class_ids: np.ndarray,
+                 names, frames: Optional[np.ndarray] = None, track_ids: Optional[np.ndarray] = None):
+        self.xyxy = xyxy.reshape(-1, 4).astype(np.float32, copy=False)
+        self.confidences = confidences.astype(np.float32, copy=False)
+        self.class_ids = class_ids.astype(np.int64, copy=False)
+        self.names = names
+        self.frames = frames
+        self.track_ids = track_ids
+
+    @classmethod
+    def empty(cls, names, with_frames: bool = False) -> "DetectionBatch":
+        return cls(np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64), names,
+                   np.zeros(0, np.int64) if with_frames else None)
+
+    @classmethod
+    def from_results(cls, results, names=None, frame_idx: Optional[int] = None) -> "DetectionBatch":
+        """Pull boxes out of ultralytics Results with one tensor transfer per result"""
+        arrays = []
+        for r in results:
+            if names is None:
+                names = r.names
+            if r.boxes is not None and len(r.boxes):
+                # boxes.data is [x1, y1, x2, y2, conf, cls] per row
+                arrays.append(r.boxes.data.cpu().numpy())
+        data = np.concatenate(arrays) if arrays else np.zeros((0, 6), np.float32)
+        frames = np.full(len(data), frame_idx, np.int64) if frame_idx is not None else None
+        return cls(data[:, :4], data[:, 4], data[:, 5], names, frames)
+
+    @classmethod
+    def concat(cls, batches: Sequence["DetectionBatch"], names=None) -> "DetectionBatch":
+        if not batches:
+            return cls.empty(names)
+        with_frames = all(b.frames is not None for b in batches)
+        with_track_ids = all(b.track_ids is not None for b in batches)
+        return cls(
+            np.concatenate([b.xyxy for b in batches]),
+            np.concatenate([b.confidences for b in batches]),
+            np.concatenate([b.class_ids for b in batches]),
+            names if names is not None else batches[0].names,
+            np.concatenate([b.frames for b in batches]) if with_frames else None,
+            np.concatenate([b.track_ids for b in batches]) if with_track_ids else None,
+        )
+
+    def __len__(self) -> int:
+        return len(self.confidences)
+
+    def select(self, mask) -> "DetectionBatch":
+        return DetectionBatch(self.xyxy[mask], self.confidences[mask], self.class_ids[mask], self.names,
+                              self.frames[mask] if self.frames is not None else None,
+                              self.track_ids[mask] if self.track_ids is not None else None)
+
+    def scaled(self, sx: float, sy: float) -> "DetectionBatch":
+        """The same detections with box coordinates scaled by (sx, sy)"""
+        if sx == 1 and sy == 1:
+            return self
+        factors = np.array([sx, sy, sx, sy], np.float32)
+        return DetectionBatch(self.xyxy * factors, self.confidences, self.class_ids, self.names, self.frames,
+                              self.track_ids)
+
+    def with_frame(self, frame_idx: int) -> "DetectionBatch":
+        """The same detections, attributed to another frame"""
+        return DetectionBatch(self.xyxy, self.confidences, self.class_ids, self.names,
+                              np.full(len(self), frame_idx, np.int64), self.track_ids)
+
+    def with_track_ids(self, track_ids: np.ndarray) -> "DetectionBatch":
+        return DetectionBatch(self.xyxy, self.confidences, self.class_ids, self.names, self.frames, track_ids)
+
+    def areas(self) -> np.ndarray:
+        # float64 so areas and densities match a per-box Python float computation
+        wh = self.xyxy[:, 2:].astype(np.float64) - self.xyxy[:, :2]
+        return wh[:, 0] * wh[:, 1]
+
+    def total_area(self) -> float:
+        return float(self.areas().sum())
+
+    def class_counts(self) -> Dict[str, int]:
+        if not len(self):
+            return {}
+        table = class_name_table(self.names)
+        counts = np.bincount(self.class_ids, minlength=len(table))
+        return {table[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+    def density(self, area: float) -> float:
+        """Percentage of `area` covered by detection boxes"""
+        return (self.total_area() / area) * 100 if area > 0 else 0
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Build JSON-ready detections ([x, y, w, h] boxes) in bulk"""
+        xywh = self.xyxy.astype(np.float64)
+        xywh[:, 2:] -= xywh[:, :2]
+        table = class_name_table(self.names)
+        boxes = xywh.tolist()
+        class_names = [table[c] for c in self.class_ids.tolist()]
+        confidences = self.confidences.astype(np.float64).tolist()
+        if self.frames is None:
+            return [{"box": b, "class_name": n, "confidence": c}
+                    for b, n, c in zip(boxes, class_names, confidences)]
+        if self.track_ids is None:
+            return [{"box": b, "class_name": n, "confidence": c, "frame": f}
+                    for b, n, c, f in zip(boxes, class_names, confidences, self.frames.tolist())]
+        return [{"box": b, "class_name": n, "confidence": c, "frame": f, "track_id": t}
+                for b, n, c, f, t in zip(boxes, class_names, confidences, self.frames.tolist(), self.track_ids.tolist())]
+
+    def to_columns(self) -> Dict[str, Any]:
+        """Detections as parallel arrays ([x, y, w, h] boxes), with class ids indexing one name table"""
+        xywh = self.xyxy.copy()
+        xywh[:, 2:] -= xywh[:, :2]
+        return {
+            "class_names": class_name_table(self.names),
+            "boxes": xywh,
+            "confidences": np.ascontiguousarray(self.confidences),
+            "class_ids": np.ascontiguousarray(self.class_ids),
+            "frames": np.ascontiguousarray(self.frames) if self.frames is not None else None,
+            "track_ids": np.ascontiguousarray(self.track_ids) if self.track_ids is not None else None,
+        }
@@ -0,0 +1,57 @@
+import os
+from typing import Any, Dict, List, Optional
+
+
+class QualityTier:
+    """Inference settings trading accuracy for speed.
+
+    `imgsz` is the model input size, `max_det` caps detections per image and
+    `int8` asks for a quantized model where the backend has one.
+    """
+
+    def __init__(self, name: str, imgsz: int = 640, max_det: int = 300, int8: bool = False):
+        if not 32 <= imgsz <= 4096:
+            raise ValueError("imgsz must be between 32 and 4096")
+        if max_det < 1:
+            raise ValueError("max_det must be at least 1")
+        self.name = name
+        # The model's stride is 32, so round up the way ultralytics would
+        self.imgsz = -(-imgsz // 32) * 32
+        self.max_det = max_det
+        self.int8 = int8
+
+    def predict_args(self) -> Dict[str, Any]:
+        """Keyword arguments for a model call. Always explicit, since ultralytics
+        keeps the last call's settings on a model's predictor."""
+        return {"imgsz": self.imgsz, "max_det": self.max_det}
+
+    def key(self) -> List[Any]:
+        return [self.imgsz, self.max_det, self.int8]
+
+    def describe(self, precision: str = "fp32") -> Dict[str, Any]:
+        return {"tier": self.name, "imgsz": self.imgsz, "max_det": self.max_det, "precision": precision}
+
+
+QUALITY_TIERS = {
+    "fast": QualityTier("fast", imgsz=320, max_det=100, int8=True),
+    "balanced": QualityTier("balanced", imgsz=480, max_det=300),
+    "full": QualityTier("full", imgsz=640, max_det=300),
+}
+
+# Tier used when a request doesn't name one
+DEFAULT_QUALITY_TIER = os.environ.get('QUALITY_TIER', 'full')
+
+
+def resolve_tier(tier: Optional[str] = None, imgsz: Optional[int] = None, max_det: Optional[int] = None,
+                 int8: Optional[bool] = None) -> QualityTier:
+    """A named tier, with any explicitly given settings overriding it"""
+    name = tier or DEFAULT_QUALITY_TIER
+    if name not in QUALITY_TIERS:
+        raise ValueError(f"Unknown quality tier: {name} (expected one of {', '.join(QUALITY_TIERS)})")
+    base = QUALITY_TIERS[name]
+    overrides = {"imgsz": imgsz, "max_det": max_det, "int8": int8}
+    overrides = {k: v for k, v in overrides.items() if v is not None and v != getattr(base, k)}
+    if not overrides:
+        return base
+    settings = {"imgsz": base.imgsz, "max_det": base.max_det, "int8": base.int8, **overrides}
+    return QualityTier(f"{name}+custom", **settings)
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+import numpy as np
+
+from postprocess import DetectionBatch
+
+
+def content_key(contents: Union[bytes, "hashlib._Hash"], *parts: Any) -> str:
+    """Cache key for uploaded bytes (or a sha256 already fed them) plus everything else that changes the result"""
+    digest = hashlib.sha256(contents) if isinstance(contents, bytes) else contents.copy()
+    for part in parts:
+        digest.update(b"\0" + json.dumps(part, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class CacheEntry:
+    """Detections stored at the cache's floor confidence, plus media metadata"""
+
+    def __init__(self, detections: DetectionBatch, meta: Dict[str, Any]):
+        self.detections = detections
+        self.meta = meta
+
+    @property
+    def nbytes(self) -> int:
+        d = self.detections
+        frames = d.frames.nbytes if d.frames is not None else 0
+        # Rough allowance for the metadata and object overhead
+        return d.xyxy.nbytes + d.confidences.nbytes + d.class_ids.nbytes + frames + 1024
+
+    def filtered(self, confidence: float) -> DetectionBatch:
+        """Detections at or above `confidence`"""
+        return self.detections.select(self.detections.confidences >= confidence)
+
+
+class ResultCache:
+    """Content-addressed detection cache with an in-memory LRU and an optional disk tier.
+
+    Entries hold raw detections at `floor_confidence`, so any request with a
+    confidence at or above the floor is served by filtering. Concurrent
+    requests for the same key share one computation.
+    """
+
+    def __init__(self, max_memory_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_ttl: float = 24 * 3600, floor_confidence: float = 0.05):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_ttl = disk_ttl
+        self.floor_confidence = floor_confidence
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "bypassed": 0,
+            "evictions": 0,
+        }
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def covers(self, confidence: float) -> bool:
+        """Whether a request at this confidence can be served from the cache"""
+        return confidence >= self.floor_confidence
+
+    def record_bypass(self):
+        self.counters["bypassed"] += 1
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[CacheEntry]]) -> CacheEntry:
+        entry = self._memory_get(key)
+        if entry is not None:
+            self.counters["memory_hits"] += 1
+            return entry
+
+        # Identical uploads arriving together share one lookup. It runs as a task of its
+        # own, so the first caller going away (a client disconnecting) can't cancel it
+        # for the others, as in shared_once.
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            task = self._inflight[key] = asyncio.ensure_future(self._lookup(key, compute))
+
+            def done(task):
+                if self._inflight.get(key) is task:
+                    del self._inflight[key]
+                # Mark a failure as retrieved when every caller has gone
+                if not task.cancelled():
+                    task.exception()
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def _lookup(self, key: str, compute: Callable[[], Awaitable[CacheEntry]]) -> CacheEntry:
+        entry = None
+        if self.disk_dir:
+            entry = await asyncio.to_thread(self._disk_get, key)
+        if entry is not None:
+            self.counters["disk_hits"] += 1
+        else:
+            self.counters["misses"] += 1
+            entry = await compute()
+            if self.disk_dir:
+                await asyncio.to_thread(self._disk_put, key, entry)
+        self._memory_put(key, entry)
+        return entry
+
+    def _memory_get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key: str, entry: CacheEntry):
+        size = entry.nbytes
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key).nbytes
+            self._memory[key] = entry
+            self._memory_bytes += size
+            # Evict least recently used entries until we're back under budget
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted.nbytes
+                self.counters["evictions"] += 1
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.npz")
+
+    def _disk_get(self, key: str) -> Optional[CacheEntry]:
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.disk_ttl:
+                os.remove(path)
+                return None
+            with np.load(path) as data:
+                meta = json.loads(str(data["meta"]))
+                names = {int(k): v for k, v in meta.pop("names").items()}
+                frames = data["frames"] if meta.pop("has_frames") else None
+                detections = DetectionBatch(data["xyxy"], data["confidences"], data["class_ids"], names, frames)
+            return CacheEntry(detections, meta)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable cache file {path}: {e}")
+            return None
+
+    def _disk_put(self, key: str, entry: CacheEntry):
+        d = entry.detections
+        names = d.names if isinstance(d.names, dict) else dict(enumerate(d.names))
+        meta = {**entry.meta, "names": names, "has_frames": d.frames is not None}
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                np.savez(f, xyxy=d.xyxy, confidences=d.confidences, class_ids=d.class_ids,
+                         frames=d.frames if d.frames is not None else np.zeros(0, np.int64),
+                         meta=np.array(json.dumps(meta)))
+            # Atomic rename so readers never see a partial file
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"Could not write cache file {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["coalesced"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "max_memory_bytes": self.max_memory_bytes,
+            "floor_confidence": self.floor_confidence,
+            "disk_enabled": bool(self.disk_dir),
+        }
+
+
+def cache_from_env() -> Optional[ResultCache]:
+    """Build a cache from RESULT_CACHE_* settings, or None when disabled"""
+    if os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() != 'true':
+        return None
+    return ResultCache(
+        max_memory_bytes=int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+        disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+        disk_ttl=float(os.environ.get('RESULT_CACHE_DISK_TTL', 24 * 3600)),
+        floor_confidence=float(os.environ.get('RESULT_CACHE_FLOOR_CONFIDENCE', 0.05)),
+    )
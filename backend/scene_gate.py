@@ -0,0 +1,46 @@
+import os
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Mean absolute difference (0-1) of the downscaled grayscale frame below which
+# a frame is treated as a near-duplicate of the last inferred frame
+DEFAULT_SCENE_THRESHOLD = float(os.environ.get('SCENE_GATE_THRESHOLD', 0.02))
+# Force a fresh inference after this many consecutive reused frames
+DEFAULT_MAX_REUSE = int(os.environ.get('SCENE_GATE_MAX_REUSE', 30))
+
+
+class SceneChangeGate:
+    """Decides whether a video frame differs enough from the last inferred one to need inference.
+
+    Frames are compared as small grayscale thumbnails against the last frame
+    that was actually inferred, so slow drift still accumulates into a change.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_SCENE_THRESHOLD, max_reuse: int = DEFAULT_MAX_REUSE,
+                 size: Tuple[int, int] = (64, 36)):
+        if threshold < 0:
+            raise ValueError("scene_threshold must not be negative")
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self.size = size
+        self._reference: Optional[np.ndarray] = None
+        self._reused_in_a_row = 0
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.float32) / 255.0
+
+    def should_infer(self, frame: np.ndarray) -> bool:
+        """Return True if the frame needs inference, updating the reference if so"""
+        thumbnail = self._thumbnail(frame)
+        if (self._reference is not None and self._reused_in_a_row < self.max_reuse
+                and float(np.abs(thumbnail - self._reference).mean()) < self.threshold):
+            self._reused_in_a_row += 1
+            return False
+        self._reference = thumbnail
+        self._reused_in_a_row = 0
+        return True
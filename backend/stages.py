@@ -0,0 +1,331 @@
+import io
+import math
+import os
+import multiprocessing
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple, Union
+
+import cv2
+from PIL import Image
+
+from frame_sampler import DEFAULT_SEEK_THRESHOLD, FrameSampler, SamplingStrategy
+from model_backends import load_model, model_nbytes, warmup
+from quality import QualityTier
+from scene_gate import SceneChangeGate
+from tracking import TrackingOptions
+from video_pipeline import VideoPipeline, VideoSummary
+
+# Stage functions run on the StageExecutor pool. They are top-level and take
+# picklable arguments so they work in both thread and process mode.
+
+
+# Longest image side to decode JPEGs down to (the model's input size); 0 decodes at full size
+DECODE_TARGET_SIZE = int(os.environ.get('DECODE_TARGET_SIZE', 640))
+
+
+class MediaError(ValueError):
+    """Raised when an uploaded image or video cannot be decoded"""
+
+
+# Each worker (thread or process) keeps its own model instances, since an
+# ultralytics predictor must not be shared between concurrent callers
+_worker_state = threading.local()
+
+# Model copies each worker keeps; the least recently used copy is dropped beyond this
+WORKER_MAX_MODELS = int(os.environ.get('WORKER_MAX_MODELS', 2))
+
+# Models loaded by workers, a counter the StageExecutor shares with its workers
+model_loads = None
+
+
+class ModelRef:
+    """A model version held by the ModelRegistry, for workers to run.
+
+    `generation` identifies the version, and `resident` lists the paths of
+    every version the registry currently holds. Workers drop their copies of
+    any other path, so the registry's memory budget and evictions cover the
+    worker copies too.
+    """
+
+    def __init__(self, path: str, generation: int, resident: FrozenSet[str] = frozenset()):
+        self.path = path
+        self.generation = generation
+        self.resident = resident
+
+
+def _worker_models() -> OrderedDict:
+    models = getattr(_worker_state, "models", None)
+    if models is None:
+        models = _worker_state.models = OrderedDict()
+        _worker_state.loading = set()
+    return models
+
+
+def _load_warm(model_path: str):
+    model = load_model(model_path)
+    warmup(model)
+    if model_loads is not None:
+        with model_loads.get_lock():
+            model_loads.value += 1
+    return model
+
+
+def _reload_in_background(models, ref: ModelRef):
+    # Load a newer version on the side while this worker keeps running the copy it has
+    loading = _worker_state.loading
+    if ref.path in loading:
+        return
+    loading.add(ref.path)
+
+    def load():
+        try:
+            models[ref.path] = (ref.generation, _load_warm(ref.path))
+        except Exception as e:
+            print(f"Could not reload {ref.path} in worker, keeping the previous version: {e}")
+        finally:
+            loading.discard(ref.path)
+    threading.Thread(target=load, name="worker-reload", daemon=True).start()
+
+
+def _registry_model(models, ref: ModelRef, wait: bool):
+    for path in [path for path in models if path != ref.path and path not in ref.resident]:
+        del models[path]
+    cached = models.get(ref.path)
+    if cached is None or (wait and cached[0] < ref.generation):
+        models[ref.path] = (ref.generation, _load_warm(ref.path))
+    elif cached[0] < ref.generation:
+        _reload_in_background(models, ref)
+
+
+def _path_model(models, model_path: str):
+    cached = models.get(model_path)
+    try:
+        version = os.path.getmtime(model_path)
+    except OSError:
+        if cached is None:
+            raise
+        # The weights are being replaced; keep using this copy
+        version = cached[0]
+    if cached is None or cached[0] != version:
+        try:
+            models[model_path] = (version, _load_warm(model_path))
+        except Exception as e:
+            if cached is None:
+                raise
+            print(f"Could not reload {model_path} in worker, keeping the previous version: {e}")
+            models[model_path] = (version, cached[1])
+
+
+def get_worker_model(model: Union[str, ModelRef], wait: bool = False):
+    """This worker's copy of a model.
+
+    A weights or export path is reloaded when the file changes. A ModelRef's
+    newer generation is loaded in the background while the worker keeps
+    running its current copy, unless `wait` is set.
+    """
+    models = _worker_models()
+    if isinstance(model, ModelRef):
+        _registry_model(models, model, wait)
+        model_path = model.path
+    else:
+        _path_model(models, model)
+        model_path = model
+    models.move_to_end(model_path)
+    while len(models) > max(1, WORKER_MAX_MODELS):
+        models.popitem(last=False)
+    return models[model_path][1]
+
+
+def load_registry_model(ref: ModelRef) -> int:
+    """Load a registry model version in this worker, returning the memory one copy holds"""
+    return model_nbytes(get_worker_model(ref, wait=True), ref.path)
+
+
+def decode_image(contents: bytes, target_size: int = DECODE_TARGET_SIZE) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Validate and decode image bytes in a single pass.
+
+    JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8) as long as
+    the longest side stays at or above `target_size`, since the model resizes
+    to its input size anyway. Returns the image and the original (width,
+    height); boxes found on the image must be scaled back with
+    `original_scale`.
+    """
+    try:
+        img = Image.open(io.BytesIO(contents))
+        original_size = img.size
+        if target_size and max(original_size) > target_size:
+            ratio = target_size / max(original_size)
+            img.draft(None, (math.ceil(original_size[0] * ratio), math.ceil(original_size[1] * ratio)))
+        # load() decodes the whole stream, so corrupt or truncated files fail here
+        img.load()
+    except Exception as e:
+        raise MediaError(f"Invalid image: {str(e)}")
+    return img, original_size
+
+
+def decode_target_size(tier: Optional[QualityTier] = None) -> int:
+    """The size to decode images down to for a tier, so a larger inference size gets the detail it asks for"""
+    if not DECODE_TARGET_SIZE or tier is None:
+        return DECODE_TARGET_SIZE
+    return max(DECODE_TARGET_SIZE, tier.imgsz)
+
+
+def original_scale(img: Image.Image, original_size: Tuple[int, int]) -> Tuple[float, float]:
+    """x and y factors that map boxes on a decoded image back to the original image"""
+    return original_size[0] / img.size[0], original_size[1] / img.size[1]
+
+
+def run_model(model: Union[str, ModelRef, Any], images: Any, conf: float, tier: Optional[QualityTier] = None):
+    """Run a model (or the worker's copy of the model at a weights path or ModelRef) on images"""
+    if isinstance(model, (str, ModelRef)):
+        model = get_worker_model(model)
+    results = model(images, conf=conf, **(tier.predict_args() if tier else {}))
+    if multiprocessing.parent_process() is not None:
+        # Results are pickled back to the parent; the source image isn't needed there
+        for r in results:
+            r.orig_img = None
+    return results
+
+
+def iter_video_models(video_path: str, models: Sequence[Union[str, ModelRef, Any]], confidence_threshold: float = 0.25,
+                      sampling: Optional[SamplingStrategy] = None,
+                      scene_threshold: Optional[float] = None,
+                      keep_detections: bool = False,
+                      tier: Optional[QualityTier] = None,
+                      tracking: Optional[TrackingOptions] = None,
+                      seekable: bool = True) -> Iterator[Tuple[str, Any]]:
+    """Like iter_video_file, but each sampled frame is decoded once and run through every model.
+
+    Frames yield ("frame", (frame_idx, [DetectionBatch per model])) and the
+    summary is a list with one summary per model, in the order given.
+    Timings in each summary are for the shared pass.
+
+    A video that isn't `seekable`, such as a pipe, is decoded front to back.
+    """
+    models = [get_worker_model(model) if isinstance(model, (str, ModelRef)) else model for model in models]
+
+    # Open the video file. A pipe can only be opened once, so it's given to
+    # FFmpeg alone rather than to each backend in turn.
+    cap = cv2.VideoCapture(video_path) if seekable else cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        raise MediaError("Could not open video file")
+
+    try:
+        # Get video properties
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_area = frame_width * frame_height
+
+        print(f"Video properties: {frame_count} frames at {fps} FPS, dimensions: {frame_width}x{frame_height}")
+        if frame_count <= 0 and not seekable:
+            # Frames are planned from the length, which a stream can't always report
+            raise MediaError("Could not determine the video's length while it was uploading")
+
+        # Pick the frames to analyse (~10 evenly spaced frames by default, every frame when tracking)
+        if tracking is not None:
+            sampling = tracking.sampling(sampling)
+        frames_to_process = (sampling or SamplingStrategy()).plan(frame_count, fps)
+        sampler = FrameSampler(cap, frames_to_process, seek_threshold=DEFAULT_SEEK_THRESHOLD if seekable else sys.maxsize)
+
+        yield "video", {
+            "frame_count": frame_count,
+            "fps": fps,
+            "width": frame_width,
+            "height": frame_height,
+            "frames_sampled": len(frames_to_process),
+        }
+
+        # Decode in a producer thread while the models run on batches of frames
+        gate = SceneChangeGate(scene_threshold) if scene_threshold is not None else None
+        pipeline = VideoPipeline(models, confidence_threshold, gate=gate,
+                                 predict_args=tier.predict_args() if tier else None, tracking=tracking)
+        summaries = [VideoSummary(model.names, keep_detections=keep_detections) for model in models]
+        for frame_idx, frame_detections in pipeline.run_all(sampler):
+            for summary, detections in zip(summaries, frame_detections):
+                summary.add(frame_idx, detections)
+            yield "frame", (frame_idx, frame_detections)
+    finally:
+        cap.release()
+
+    print(f"Frame sampler: {sampler.describe()}, inference batches: {pipeline.batches}, "
+          f"frames inferred: {pipeline.frames_inferred}, reused: {pipeline.frames_reused}, "
+          f"tracked: {pipeline.frames_tracked}")
+
+    trackers = pipeline.trackers or [None] * len(models)
+    yield "summary", [{
+        "detections": summary.detections() if keep_detections else None,
+        "detection_count": summary.detection_count,
+        "class_counts": summary.class_counts(),
+        "waste_density": summary.waste_density(frame_area),
+        "frame_area": frame_area,
+        "frames_processed": summary.frames_processed,
+        "frame_count": frame_count,
+        "fps": fps,
+        "frames_sampled": len(frames_to_process),
+        "frames_inferred": pipeline.frames_inferred,
+        "frames_reused": pipeline.frames_reused,
+        "frames_tracked": pipeline.frames_tracked,
+        # Distinct objects, when tracking
+        "unique_counts": tracker.unique_counts() if tracker else None,
+        "tracks": tracker.describe_tracks() if tracker else None,
+        # Seconds per stage, summed over frames
+        "timings": dict(pipeline.timings),
+    } for summary, tracker in zip(summaries, trackers)]
+
+
+def iter_video_file(video_path: str, model: Union[str, ModelRef, Any], confidence_threshold: float = 0.25,
+                    sampling: Optional[SamplingStrategy] = None,
+                    scene_threshold: Optional[float] = None,
+                    keep_detections: bool = False,
+                    tier: Optional[QualityTier] = None,
+                    tracking: Optional[TrackingOptions] = None) -> Iterator[Tuple[str, Any]]:
+    """Decode, infer and postprocess a sample of frames from a video file, one frame at a time.
+
+    Yields ("video", properties) once the file is open, then
+    ("frame", (frame_idx, DetectionBatch)) as each frame completes, and
+    finally ("summary", fields). The summary holds all detections only when
+    `keep_detections` is set, so streaming callers use constant memory.
+
+    With `scene_threshold` set, frames that barely differ from the last
+    inferred frame reuse its detections instead of running the model. With
+    `tracking` set, the model runs on keyframes only and tracked boxes (with
+    track ids) fill the frames in between.
+    """
+    for kind, payload in iter_video_models(video_path, [model], confidence_threshold, sampling,
+                                           scene_threshold, keep_detections, tier, tracking):
+        if kind == "frame":
+            frame_idx, frame_detections = payload
+            payload = (frame_idx, frame_detections[0])
+        elif kind == "summary":
+            payload = payload[0]
+        yield kind, payload
+
+
+def process_video_file(video_path: str, model: Union[str, ModelRef, Any], confidence_threshold: float = 0.25,
+                       sampling: Optional[SamplingStrategy] = None,
+                       scene_threshold: Optional[float] = None,
+                       tier: Optional[QualityTier] = None,
+                       tracking: Optional[TrackingOptions] = None) -> Dict[str, Any]:
+    """Decode, infer and postprocess a sample of frames from a video file"""
+    for kind, payload in iter_video_file(video_path, model, confidence_threshold, sampling,
+                                         scene_threshold, keep_detections=True, tier=tier, tracking=tracking):
+        if kind == "summary":
+            return payload
+
+
+def process_video_models(video_path: str, models: Sequence[Union[str, ModelRef, Any]], confidence_threshold: float = 0.25,
+                         sampling: Optional[SamplingStrategy] = None,
+                         scene_threshold: Optional[float] = None,
+                         tier: Optional[QualityTier] = None,
+                         tracking: Optional[TrackingOptions] = None,
+                         seekable: bool = True) -> List[Dict[str, Any]]:
+    """Decode a sample of frames from a video file once and run every model on them"""
+    for kind, payload in iter_video_models(video_path, models, confidence_threshold, sampling,
+                                           scene_threshold, keep_detections=True, tier=tier, tracking=tracking,
+                                           seekable=seekable):
+        if kind == "summary":
+            return payload
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_request_beyond_the_queue_is_rejected_with_429():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        await admission.acquire("yolo")
+        waiter = asyncio.ensure_future(admission.acquire("yolo"))
+        await asyncio.sleep(0)
+        assert admission.queue_depth() == {"yolo": 1}
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("yolo")
+        admission.release("yolo")
+        await waiter
+        return admission, rejected.value
+
+    admission, rejected = asyncio.run(run())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    stats = admission.stats()["models"]["yolo"]
+    assert (stats["admitted"], stats["queued"], stats["rejected"]) == (2, 1, 1)
+
+
+def test_request_that_waits_too_long_is_rejected_with_503():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        await admission.acquire("yolo")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("yolo")
+        return admission, rejected.value
+
+    admission, rejected = asyncio.run(run())
+    assert rejected.status_code == 503
+    assert admission.stats()["models"]["yolo"]["timed_out"] == 1
+    assert admission.queue_depth() == {"yolo": 0}
+
+
+def test_models_are_admitted_independently():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=0)
+        async with admission.admit("yolo"):
+            async with admission.admit("drone"):
+                pass
+        return admission
+
+    assert asyncio.run(run()).stats()["models"]["drone"]["rejected"] == 0
+
+
+def test_retry_after_follows_hold_times():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, max_queue=0)
+        await admission.acquire("yolo")
+        admission.release("yolo", held=10.0)
+        await admission.acquire("yolo")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await admission.acquire("yolo")
+        return rejected.value
+
+    assert asyncio.run(run()).retry_after == 10
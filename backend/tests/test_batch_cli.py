@@ -0,0 +1,53 @@
+import json
+
+from batch_cli import plan_tasks, read_manifest
+
+
+def write_manifest(path, *lines):
+    path.write_text("".join(line + "\n" for line in lines))
+
+
+def touch(directory, *names):
+    for name in names:
+        (directory / name).write_bytes(b"")
+
+
+def test_resume_skips_finished_and_failed_files(tmp_path):
+    manifest = tmp_path / "out.csv.manifest.jsonl"
+    write_manifest(manifest,
+                   json.dumps({"path": "a.jpg", "status": "done"}),
+                   json.dumps({"path": "b.jpg", "status": "failed"}),
+                   '{"path": "c.jp')  # cut short by a crash
+    assert read_manifest(str(manifest), retry_failed=False) == {"a.jpg", "b.jpg"}
+
+
+def test_retry_failed_redoes_files_whose_last_attempt_failed(tmp_path):
+    manifest = tmp_path / "out.csv.manifest.jsonl"
+    write_manifest(manifest,
+                   json.dumps({"path": "a.jpg", "status": "done"}),
+                   json.dumps({"path": "b.jpg", "status": "failed"}),
+                   json.dumps({"path": "c.jpg", "status": "failed"}),
+                   json.dumps({"path": "c.jpg", "status": "done"}))
+    assert read_manifest(str(manifest), retry_failed=True) == {"a.jpg", "c.jpg"}
+
+
+def test_missing_manifest_means_a_fresh_run(tmp_path):
+    assert read_manifest(str(tmp_path / "none.jsonl"), retry_failed=False) == set()
+
+
+def test_plan_leaves_out_done_files_and_batches_images(tmp_path):
+    touch(tmp_path, "1.jpg", "2.png", "3.jpg", "4.jpg", "clip.mp4", "notes.txt", "pack.zip")
+    done = {str(tmp_path / "1.jpg")}
+    tasks = list(plan_tasks([str(tmp_path)], done, images_per_task=2))
+    assert tasks == [
+        ("images", [str(tmp_path / "2.png"), str(tmp_path / "3.jpg")]),
+        ("video", [str(tmp_path / "clip.mp4")]),
+        ("archive", [str(tmp_path / "pack.zip")]),
+        ("images", [str(tmp_path / "4.jpg")]),
+    ]
+
+
+def test_plan_is_empty_when_everything_is_done(tmp_path):
+    touch(tmp_path, "1.jpg", "clip.mp4")
+    done = {str(tmp_path / "1.jpg"), str(tmp_path / "clip.mp4")}
+    assert list(plan_tasks([str(tmp_path)], done, images_per_task=8)) == []
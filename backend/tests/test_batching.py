@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+from batching import MicroBatcher
+from executor import StageExecutor
+
+
+def submit_all(batcher, requests):
+    """Submit (image, confidence) pairs together and gather the results"""
+    async def run():
+        return await asyncio.gather(*(batcher.submit(image, conf) for image, conf in requests),
+                                    return_exceptions=True)
+    return asyncio.run(run())
+
+
+def test_batches_are_capped_at_max_batch_size():
+    calls = []
+
+    def infer(images, conf):
+        calls.append(list(images))
+        return images
+
+    batcher = MicroBatcher(infer, max_batch_size=4, max_wait_ms=50)
+    results = submit_all(batcher, [(i, 0.25) for i in range(10)])
+    assert results == [[i] for i in range(10)]
+    assert [len(c) for c in calls] == [4, 4, 2]
+    assert batcher.stats.snapshot()["max_batch_size_seen"] == 4
+
+
+def test_lone_request_waits_no_longer_than_max_wait():
+    batcher = MicroBatcher(lambda images, conf: images, max_batch_size=8, max_wait_ms=20)
+
+    async def run():
+        start = time.perf_counter()
+        await batcher.submit("image", 0.25)
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 0.5
+    assert batcher.stats.snapshot()["max_queue_wait_ms"] >= 15
+
+
+def test_batch_runs_at_lowest_confidence_and_each_caller_gets_its_own():
+    confidences = []
+    image = np.zeros((100, 100, 3), np.uint8)
+    boxes = torch.tensor([[0, 0, 10, 10, 0.9, 0], [0, 0, 20, 20, 0.5, 0], [0, 0, 30, 30, 0.2, 0]])
+
+    def infer(images, conf):
+        confidences.append(conf)
+        return [Results(image, "", {0: "plastic"}, boxes=boxes[boxes[:, 4] >= conf]) for _ in images]
+
+    batcher = MicroBatcher(infer, max_batch_size=3, max_wait_ms=50)
+    results = submit_all(batcher, [(image, 0.1), (image, 0.4), (image, 0.8)])
+    assert confidences == [0.1]
+    assert [len(r[0].boxes) for r in results] == [3, 2, 1]
+
+
+def test_inference_error_reaches_every_waiting_caller():
+    def infer(images, conf):
+        if "bad" in images:
+            raise RuntimeError("model crashed")
+        return images
+
+    async def run():
+        batcher = MicroBatcher(infer, max_batch_size=3, max_wait_ms=50)
+        failed = await asyncio.gather(*(batcher.submit(image, 0.25) for image in ("bad", 1, 2)),
+                                      return_exceptions=True)
+        # The batcher keeps serving after a failed batch
+        return failed, await batcher.submit("next", 0.25)
+
+    failed, after = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) and str(r) == "model crashed" for r in failed)
+    assert after == ["next"]
+
+
+def test_batches_run_concurrently_up_to_executor_workers():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def infer(images, conf):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return images
+
+    executor = StageExecutor("thread", workers=3)
+
+    async def run():
+        batcher = MicroBatcher(infer, max_batch_size=2, max_wait_ms=1, executor=executor)
+        # Start the pool's threads (their initializer imports torch) before timing
+        await asyncio.gather(*(executor.run(time.sleep, 0.01) for _ in range(3)))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(batcher.submit(i, 0.25) for i in range(12)))
+        return results, time.perf_counter() - start, batcher
+
+    try:
+        results, elapsed, batcher = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert results == [[i] for i in range(12)]
+    assert batcher.max_in_flight == 3
+    assert peak[0] == 3
+    # Six batches of 50 ms, three at a time
+    assert elapsed < 0.25
@@ -0,0 +1,83 @@
+import cv2
+import numpy as np
+import pytest
+
+from frame_sampler import FramePool, FrameSampler, SamplingStrategy
+
+
+class FakeCapture:
+    """A cv2.VideoCapture stand-in over `frame_count` frames, logging the calls it gets"""
+
+    def __init__(self, frame_count: int):
+        self.frame_count = frame_count
+        self.position = 0
+        self.calls = []
+
+    def set(self, prop, value):
+        assert prop == cv2.CAP_PROP_POS_FRAMES
+        self.calls.append(("seek", value))
+        self.position = value
+
+    def grab(self):
+        if self.position >= self.frame_count:
+            return False
+        self.calls.append(("grab", self.position))
+        self.position += 1
+        return True
+
+    def read(self, buffer=None):
+        if self.position >= self.frame_count:
+            return False, None
+        frame = buffer if buffer is not None else np.empty((4, 4, 3), np.uint8)
+        frame[:] = self.position % 256
+        self.calls.append(("read", self.position))
+        self.position += 1
+        return True, frame
+
+
+def test_small_gaps_are_grabbed_through():
+    cap = FakeCapture(100)
+    sampler = FrameSampler(cap, [0, 3, 5], seek_threshold=10)
+    assert [idx for idx, _ in sampler] == [0, 3, 5]
+    assert cap.calls == [("read", 0), ("grab", 1), ("grab", 2), ("read", 3), ("grab", 4), ("read", 5)]
+    assert sampler.describe() == {"seeks": 0, "grabs": 3, "reads": 3}
+
+
+def test_large_gap_seeks():
+    cap = FakeCapture(1000)
+    sampler = FrameSampler(cap, [0, 500], seek_threshold=10)
+    frames = list(sampler)
+    assert cap.calls == [("read", 0), ("seek", 500), ("read", 500)]
+    assert frames[1][1][0, 0, 0] == 500 % 256
+
+
+def test_going_backwards_seeks():
+    cap = FakeCapture(100)
+    list(FrameSampler(cap, [5, 2], seek_threshold=10))
+    assert ("seek", 2) in cap.calls
+
+
+def test_sampling_stops_at_end_of_stream():
+    cap = FakeCapture(10)
+    assert [idx for idx, _ in FrameSampler(cap, [2, 8, 20], seek_threshold=100)] == [2, 8]
+
+
+def test_pooled_buffers_are_reused_after_release():
+    pool = FramePool(1)
+    sampler = FrameSampler(FakeCapture(10), [0, 1, 2], pool=pool)
+    seen = []
+    for _, frame in sampler:
+        seen.append(id(frame))
+        sampler.release(frame)
+    assert len(set(seen)) == 1
+    assert pool.reused == 2
+
+
+@pytest.mark.parametrize("strategy, expected", [
+    (SamplingStrategy(), list(range(0, 100, 10))),
+    (SamplingStrategy(stride=25), [0, 25, 50, 75]),
+    (SamplingStrategy(target_fps=5), list(range(0, 100, 6))),
+    (SamplingStrategy(stride=1, max_frames=3), [0, 50, 99]),
+])
+def test_plan(strategy, expected):
+    assert strategy.plan(100, 30.0) == expected
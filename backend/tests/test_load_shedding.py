@@ -0,0 +1,72 @@
+import time
+
+from load_shedding import DEGRADATION_LEVELS, LoadShedder, load_shedder_from_env
+
+
+def shedder(queued=0, **options):
+    options = {"targets": {"image": 1.0}, "min_samples": 10, "window": 60, "cooldown": 0, **options}
+    return LoadShedder(queue_depth=lambda: queued, **options)
+
+
+def observe(s, seconds, count):
+    for _ in range(count):
+        s.observe("image", seconds)
+
+
+def test_too_few_slow_requests_do_not_change_the_level():
+    s = shedder()
+    observe(s, 5.0, 9)
+    assert s.current().level == 0
+
+
+def test_slow_window_steps_up_one_level_and_forgets_latencies():
+    s = shedder()
+    observe(s, 5.0, 10)
+    assert s.current().level == 1
+    assert s.stats()["latency_ratio"] is None
+    assert s.current().level == 1
+
+
+def test_queue_depth_steps_up_without_latencies():
+    assert shedder(queued=4, max_queue_depth=4).current().level == 1
+
+
+def test_fast_requests_step_back_down():
+    s = shedder()
+    observe(s, 5.0, 10)
+    s.current()
+    observe(s, 0.1, 10)
+    assert s.current().level == 0
+    assert s.changes == 2
+
+
+def test_latency_between_recover_ratio_and_target_holds_the_level():
+    s = shedder()
+    observe(s, 5.0, 10)
+    s.current()
+    observe(s, 0.8, 10)
+    assert s.current().level == 1
+
+
+def test_cooldown_limits_changes():
+    s = shedder(cooldown=3600)
+    s.changed_at = time.monotonic() - 3600
+    observe(s, 5.0, 10)
+    assert s.current().level == 1
+    observe(s, 5.0, 10)
+    assert s.current().level == 1
+
+
+def test_level_never_passes_the_last():
+    s = shedder()
+    for _ in range(len(DEGRADATION_LEVELS) + 2):
+        observe(s, 5.0, 10)
+        s.current()
+    assert s.current() is DEGRADATION_LEVELS[-1]
+
+
+def test_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("LOAD_SHEDDING_ENABLED", raising=False)
+    assert load_shedder_from_env() is None
+    monkeypatch.setenv("LOAD_SHEDDING_ENABLED", "true")
+    assert isinstance(load_shedder_from_env(), LoadShedder)
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import numpy as np
+
+from postprocess import DetectionBatch
+from result_cache import CacheEntry, ResultCache, content_key
+
+
+def entry(count=1, **meta):
+    return CacheEntry(DetectionBatch(np.zeros((count, 4), np.float32), np.full(count, 0.5, np.float32),
+                                     np.zeros(count, np.int64), {0: "plastic"}), meta)
+
+
+def fetch(cache, key, value=None):
+    """get_or_compute for `key`, returning the entry and whether it had to be computed"""
+    computed = []
+
+    async def compute():
+        computed.append(key)
+        return value or entry(key=key)
+
+    return asyncio.run(cache.get_or_compute(key, compute)), bool(computed)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    size = entry().nbytes
+    cache = ResultCache(max_memory_bytes=2 * size)
+    fetch(cache, "a")
+    fetch(cache, "b")
+    assert fetch(cache, "a")[1] is False
+    fetch(cache, "c")
+    assert cache.counters["evictions"] == 1
+    assert fetch(cache, "a")[1] is False
+    assert fetch(cache, "b")[1] is True
+
+
+def test_entry_larger_than_memory_budget_is_not_kept():
+    cache = ResultCache(max_memory_bytes=entry().nbytes)
+    fetch(cache, "big", entry(count=100))
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_tier_serves_entries_dropped_from_memory(tmp_path):
+    fetch(ResultCache(disk_dir=str(tmp_path)), "a")
+    cache = ResultCache(disk_dir=str(tmp_path))
+    cached, computed = fetch(cache, "a")
+    assert not computed
+    assert cached.meta == {"key": "a"}
+    assert cached.detections.names == {0: "plastic"}
+    assert cache.counters["disk_hits"] == 1
+
+
+def test_disk_entries_expire_after_ttl(tmp_path):
+    fetch(ResultCache(disk_dir=str(tmp_path)), "a")
+    path = os.path.join(tmp_path, "a.npz")
+    os.utime(path, (0, 0))
+    assert fetch(ResultCache(disk_dir=str(tmp_path), disk_ttl=60), "a")[1] is True
+    # Recomputing rewrote it
+    assert os.path.getmtime(path) > 0
+
+
+def test_concurrent_requests_share_one_computation_despite_cancellation():
+    async def run():
+        cache = ResultCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return entry()
+
+        first = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, calls, cache
+
+    result, calls, cache = asyncio.run(run())
+    assert len(result.detections) == 1
+    assert calls == [1]
+    assert cache.counters["coalesced"] == 1
+
+
+def test_filtered_applies_confidence_over_floor():
+    cached = CacheEntry(DetectionBatch(np.zeros((3, 4), np.float32), np.array([0.1, 0.4, 0.9], np.float32),
+                                       np.zeros(3, np.int64), {0: "plastic"}), {})
+    assert cached.filtered(0.4).confidences.tolist() == [np.float32(0.4), np.float32(0.9)]
+
+
+def test_content_key_depends_on_options():
+    assert content_key(b"image", 0.25) != content_key(b"image", 0.5)
+    assert content_key(b"image", {"a": 1, "b": 2}) == content_key(b"image", {"b": 2, "a": 1})
@@ -0,0 +1,46 @@
+import numpy as np
+
+from postprocess import DetectionBatch
+from tiling import merge_tile_detections, plan_tiles
+
+NAMES = {0: "plastic", 1: "metal"}
+
+
+def batch(boxes, confidences, class_ids):
+    return DetectionBatch(np.array(boxes, np.float32), np.array(confidences, np.float32),
+                          np.array(class_ids, np.int64), NAMES)
+
+
+def test_plan_tiles_adds_overlapping_tiles_after_the_whole_image():
+    windows = plan_tiles(1000, 700, 640, 0.2)
+    assert windows[0] == (0, 0, 1000, 700)
+    tiles = windows[1:]
+    assert all(x2 - x1 <= 640 and y2 - y1 <= 640 for x1, y1, x2, y2 in tiles)
+    assert {(x2, y2) for _, _, x2, y2 in tiles} >= {(1000, 700)}
+    assert tiles[1][0] < tiles[0][2]
+
+
+def test_small_image_is_a_single_window():
+    assert plan_tiles(320, 240, 640, 0.2) == [(0, 0, 320, 240)]
+
+
+def test_box_cut_at_tile_edge_is_merged_into_complete_box():
+    # The partial box lies inside the complete one: low IoU, but full intersection over the smaller box
+    merged = merge_tile_detections(batch([[100, 100, 300, 300], [250, 100, 300, 300]], [0.9, 0.8], [0, 0]))
+    assert len(merged) == 1
+    assert merged.xyxy[0].tolist() == [100, 100, 300, 300]
+
+
+def test_higher_confidence_box_wins():
+    merged = merge_tile_detections(batch([[250, 100, 300, 300], [100, 100, 300, 300]], [0.6, 0.9], [0, 0]))
+    assert merged.confidences.tolist() == [np.float32(0.9)]
+
+
+def test_overlapping_boxes_of_different_classes_are_kept():
+    merged = merge_tile_detections(batch([[100, 100, 300, 300], [100, 100, 300, 300]], [0.9, 0.8], [0, 1]))
+    assert sorted(merged.class_ids.tolist()) == [0, 1]
+
+
+def test_boxes_below_threshold_are_kept():
+    merged = merge_tile_detections(batch([[0, 0, 100, 100], [90, 0, 190, 100]], [0.9, 0.8], [0, 0]), threshold=0.5)
+    assert len(merged) == 2
@@ -0,0 +1,69 @@
+import numpy as np
+
+from postprocess import DetectionBatch
+from tracking import Tracker, TrackingOptions
+
+NAMES = {0: "bottle", 1: "can"}
+
+
+def detections(boxes, confidences, class_ids=None):
+    class_ids = class_ids if class_ids is not None else [0] * len(boxes)
+    return DetectionBatch(np.array(boxes, np.float32).reshape(-1, 4), np.array(confidences, np.float32),
+                          np.array(class_ids, np.int64), NAMES)
+
+
+def box(x, y, size=50):
+    return [x, y, x + size, y + size]
+
+
+def test_moving_object_keeps_its_track_id():
+    tracker = Tracker(NAMES, 0.5)
+    ids = []
+    for frame in range(0, 25, 5):
+        tracked = tracker.update(detections([box(100 + 4 * frame, 100)], [0.9]), frame)
+        ids.append(tracked.track_ids.tolist())
+    assert ids == [[1]] * 5
+    assert tracker.unique_counts() == {"bottle": 1}
+
+
+def test_separate_objects_get_separate_tracks():
+    tracker = Tracker(NAMES, 0.5)
+    tracker.update(detections([box(0, 0), box(300, 300)], [0.9, 0.8], [0, 1]), 0)
+    tracked = tracker.update(detections([box(300, 300), box(2, 2)], [0.8, 0.9], [1, 0]), 5)
+    by_id = dict(zip(tracked.track_ids.tolist(), tracked.class_ids.tolist()))
+    assert by_id == {1: 0, 2: 1}
+
+
+def test_prediction_carries_track_across_a_long_gap():
+    # Once the filter has the velocity, a box that no longer overlaps the last one seen still matches
+    tracker = Tracker(NAMES, 0.5)
+    for frame in range(5):
+        tracker.update(detections([box(100 + 10 * frame, 100)], [0.9]), frame)
+    tracked = tracker.update(detections([box(240, 100)], [0.9]), 14)
+    assert tracked.track_ids.tolist() == [1]
+
+
+def test_low_confidence_detection_continues_but_never_starts_a_track():
+    tracker = Tracker(NAMES, 0.5, TrackingOptions(low_confidence=0.1))
+    assert len(tracker.update(detections([box(100, 100)], [0.2]), 0)) == 0
+    tracker.update(detections([box(100, 100)], [0.9]), 5)
+    tracked = tracker.update(detections([box(102, 100)], [0.2]), 10)
+    assert tracked.track_ids.tolist() == [1]
+    assert tracker.tracks[0].hits == 2
+
+
+def test_propagate_predicts_constant_velocity():
+    tracker = Tracker(NAMES, 0.5)
+    for frame in range(0, 50, 10):
+        tracker.update(detections([box(10 * frame, 100)], [0.9]), frame)
+    predicted = tracker.propagate(45).xyxy[0]
+    assert 380 < predicted[0] < 520
+
+
+def test_unmatched_track_is_dropped_after_max_lost():
+    tracker = Tracker(NAMES, 0.5, TrackingOptions(max_lost=1))
+    tracker.update(detections([box(100, 100)], [0.9]), 0)
+    tracker.update(detections([], []), 5)
+    assert len(tracker.tracks) == 1
+    tracker.update(detections([], []), 10)
+    assert tracker.tracks == [] and len(tracker.finished) == 1
@@ -0,0 +1,111 @@
+import os
+from typing import Any, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+from postprocess import DetectionBatch
+from quality import QualityTier
+from stages import ModelRef, get_worker_model
+
+# Tiles per batched model call
+TILE_BATCH_SIZE = int(os.environ.get('TILE_BATCH_SIZE', 8))
+# Overlap (intersection over the smaller box) above which boxes from neighbouring tiles are merged
+TILE_MERGE_THRESHOLD = float(os.environ.get('TILE_MERGE_THRESHOLD', 0.5))
+
+Window = Tuple[int, int, int, int]
+
+
+class TileOptions:
+    """Tile size in pixels and the fraction by which neighbouring tiles overlap"""
+
+    def __init__(self, tile_size: int = 640, overlap: float = 0.2):
+        if tile_size < 32:
+            raise ValueError("tile_size must be at least 32")
+        if not 0 <= overlap < 1:
+            raise ValueError("tile_overlap must be at least 0 and less than 1")
+        self.tile_size = tile_size
+        self.overlap = overlap
+
+
+def _starts(length: int, tile: int, step: int) -> List[int]:
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, step))
+    # Align the last tile with the image edge
+    starts.append(length - tile)
+    return starts
+
+
+def plan_tiles(width: int, height: int, tile_size: int, overlap: float) -> List[Window]:
+    """Overlapping (x1, y1, x2, y2) windows covering the image.
+
+    The whole image is included as the first window, so objects larger than
+    a tile are still seen in one piece.
+    """
+    step = max(1, int(tile_size * (1 - overlap)))
+    windows = [(0, 0, width, height)]
+    if width <= tile_size and height <= tile_size:
+        return windows
+    for y in _starts(height, tile_size, step):
+        for x in _starts(width, tile_size, step):
+            windows.append((x, y, min(x + tile_size, width), min(y + tile_size, height)))
+    return windows
+
+
+def image_to_bgr(img: Union[Image.Image, np.ndarray]) -> np.ndarray:
+    """An HxWx3 BGR array, the layout the model expects for NumPy input"""
+    if isinstance(img, np.ndarray):
+        return img
+    return np.ascontiguousarray(np.asarray(img.convert("RGB"))[:, :, ::-1])
+
+
+def detect_tiles(model: Union[str, ModelRef, Any], image: np.ndarray, windows: List[Window], conf: float,
+                 batch_size: int = TILE_BATCH_SIZE, tier: Optional[QualityTier] = None) -> DetectionBatch:
+    """Run the model over image windows in batches, returning boxes in full-image coordinates"""
+    if isinstance(model, (str, ModelRef)):
+        model = get_worker_model(model)
+
+    batches = []
+    for start in range(0, len(windows), batch_size):
+        chunk = windows[start:start + batch_size]
+        crops = [np.ascontiguousarray(image[y1:y2, x1:x2]) for x1, y1, x2, y2 in chunk]
+        results = model(crops, conf=conf, **(tier.predict_args() if tier else {}))
+        for (x1, y1, _, _), r in zip(chunk, results):
+            batch = DetectionBatch.from_results([r], model.names)
+            offset = np.array([x1, y1, x1, y1], np.float32)
+            batches.append(DetectionBatch(batch.xyxy + offset, batch.confidences, batch.class_ids, model.names))
+    return DetectionBatch.concat(batches, model.names)
+
+
+def merge_tile_detections(detections: DetectionBatch, threshold: float = TILE_MERGE_THRESHOLD) -> DetectionBatch:
+    """Class-aware greedy NMS across tiles.
+
+    Overlap is measured as intersection over the smaller box, so a box cut
+    off at a tile edge is suppressed by the complete box from a neighbouring
+    tile. Each step compares the best remaining box with all others at once.
+    """
+    if len(detections) < 2:
+        return detections
+
+    # Offset boxes per class so boxes of different classes never overlap
+    xyxy = detections.xyxy.astype(np.float64)
+    offsets = detections.class_ids.astype(np.float64)[:, None] * (xyxy.max() + 1)
+    boxes = xyxy + offsets
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    order = np.argsort(-detections.confidences, kind="stable")
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        ix1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        iy1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        ix2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        iy2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        intersection = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+        smaller = np.maximum(np.minimum(areas[best], areas[rest]), 1e-9)
+        order = rest[intersection / smaller <= threshold]
+
+    return detections.select(np.sort(np.array(keep)))
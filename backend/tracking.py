@@ -0,0 +1,287 @@
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from frame_sampler import SamplingStrategy
+from postprocess import DetectionBatch, class_name_table
+
+# Sampled frames per detector run in tracking mode; the frames in between are tracked
+TRACK_KEYFRAME_INTERVAL = int(os.environ.get('TRACK_KEYFRAME_INTERVAL', 5))
+# Detections below the request's confidence but above this only extend existing tracks
+TRACK_LOW_CONFIDENCE = float(os.environ.get('TRACK_LOW_CONFIDENCE', 0.1))
+# Minimum IoU between a track's predicted box and a detection for them to match
+TRACK_IOU_THRESHOLD = float(os.environ.get('TRACK_IOU_THRESHOLD', 0.3))
+# Keyframes a track can go unmatched before it is dropped
+TRACK_MAX_LOST = int(os.environ.get('TRACK_MAX_LOST', 2))
+# Keyframes a track must be matched on to count as a unique object
+TRACK_MIN_HITS = int(os.environ.get('TRACK_MIN_HITS', 2))
+
+# Kalman noise, relative to box size (as in SORT/ByteTrack)
+_STD_POSITION = 1 / 20
+_STD_VELOCITY = 1 / 160
+# 95% chi-square bound for 4 degrees of freedom, gating motion-based matches
+_GATE_DISTANCE = 9.4877
+
+
+class TrackingOptions:
+    """Settings for tracking mode: the detector runs on every `keyframe_interval`-th
+    sampled frame and a tracker carries its boxes through the frames in between"""
+
+    def __init__(self, keyframe_interval: int = TRACK_KEYFRAME_INTERVAL, low_confidence: float = TRACK_LOW_CONFIDENCE,
+                 iou_threshold: float = TRACK_IOU_THRESHOLD, max_lost: int = TRACK_MAX_LOST,
+                 min_hits: int = TRACK_MIN_HITS):
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+        if not 0 < iou_threshold < 1:
+            raise ValueError("iou_threshold must be between 0 and 1")
+        self.keyframe_interval = keyframe_interval
+        self.low_confidence = low_confidence
+        self.iou_threshold = iou_threshold
+        self.max_lost = max_lost
+        self.min_hits = min_hits
+
+    def sampling(self, sampling: Optional[SamplingStrategy]) -> SamplingStrategy:
+        """Tracking needs dense frames, so every frame is sampled unless the request says otherwise"""
+        if sampling is None or (sampling.target_fps is None and sampling.stride is None and sampling.max_frames is None):
+            return SamplingStrategy(stride=1)
+        return sampling
+
+    def key(self) -> List[Any]:
+        return [self.keyframe_interval, self.low_confidence, self.iou_threshold, self.max_lost, self.min_hits]
+
+
+class KeyframeSchedule:
+    """Marks every `interval`-th frame for inference. Has the same interface as SceneChangeGate."""
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self._count = 0
+
+    def should_infer(self, frame: np.ndarray) -> bool:
+        infer = self._count % self.interval == 0
+        self._count += 1
+        return infer
+
+
+def _xyxy_to_cxcywh(box: np.ndarray) -> np.ndarray:
+    return np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2, box[2] - box[0], box[3] - box[1]])
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of every box in `a` against every box in `b` (both xyxy)"""
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)))
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+class _Track:
+    """A constant-velocity Kalman filter over (cx, cy, w, h)"""
+
+    def __init__(self, track_id: int, box: np.ndarray, confidence: float, class_id: int, frame_idx: int,
+                 num_classes: int):
+        self.id = track_id
+        measurement = _xyxy_to_cxcywh(box)
+        self.mean = np.r_[measurement, np.zeros(4)]
+        size = np.r_[measurement[2:], measurement[2:]]
+        self.covariance = np.diag(np.r_[2 * _STD_POSITION * size, 10 * _STD_VELOCITY * size] ** 2)
+        self.frame_idx = frame_idx
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.confidence = confidence
+        self.max_confidence = confidence
+        self.hits = 1
+        self.lost = 0
+        # Summed confidence per class; the track's class is the best-supported one
+        self.class_scores = np.zeros(num_classes)
+        self.class_scores[class_id] += confidence
+
+    @property
+    def class_id(self) -> int:
+        return int(self.class_scores.argmax())
+
+    @property
+    def xyxy(self) -> np.ndarray:
+        cx, cy, w, h = self.mean[:4]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self, frame_idx: int):
+        dt = frame_idx - self.frame_idx
+        if dt <= 0:
+            return
+        transition = np.eye(8)
+        transition[:4, 4:] = dt * np.eye(4)
+        size = np.r_[self.mean[2:4], self.mean[2:4]]
+        noise = np.diag(np.r_[_STD_POSITION * size, _STD_VELOCITY * size] ** 2) * dt
+        self.mean = transition @ self.mean
+        self.covariance = transition @ self.covariance @ transition.T + noise
+        self.frame_idx = frame_idx
+
+    def _innovation_covariance(self) -> np.ndarray:
+        size = np.r_[self.mean[2:4], self.mean[2:4]]
+        return self.covariance[:4, :4] + np.diag((_STD_POSITION * size) ** 2)
+
+    def gating_distance(self, boxes: np.ndarray) -> np.ndarray:
+        """Squared Mahalanobis distance from the predicted box to each of `boxes` (xyxy)"""
+        residuals = np.stack([_xyxy_to_cxcywh(box) for box in boxes]) - self.mean[:4]
+        solved = np.linalg.solve(self._innovation_covariance(), residuals.T)
+        return (residuals * solved.T).sum(axis=1)
+
+    def update(self, box: np.ndarray, confidence: float, class_id: int, frame_idx: int):
+        measurement = _xyxy_to_cxcywh(box)
+        innovation_cov = self._innovation_covariance()
+        gain = np.linalg.solve(innovation_cov, self.covariance[:4, :]).T
+        self.mean = self.mean + gain @ (measurement - self.mean[:4])
+        self.covariance = self.covariance - gain @ self.covariance[:4, :]
+        self.confidence = confidence
+        self.max_confidence = max(self.max_confidence, confidence)
+        self.class_scores[class_id] += confidence
+        self.last_frame = frame_idx
+        self.hits += 1
+        self.lost = 0
+
+
+class Tracker:
+    """ByteTrack-style multi-object tracker fed with detections on keyframes only.
+
+    On keyframes, tracks are matched to confident detections by IoU, then
+    still-active tracks to the low-confidence leftovers; unmatched confident
+    detections start new tracks. Between keyframes each track's Kalman
+    filter predicts its box.
+    """
+
+    def __init__(self, names, confidence_threshold: float, options: Optional[TrackingOptions] = None):
+        self.names = names
+        self.confidence_threshold = confidence_threshold
+        self.options = options or TrackingOptions()
+        self.num_classes = len(class_name_table(names))
+        self.tracks: List[_Track] = []
+        self.finished: List[_Track] = []
+        self._next_id = 1
+
+    def _associate(self, tracks: List[_Track], boxes: np.ndarray, threshold: float, by_motion: bool = False):
+        """Match tracks to boxes by IoU of at least `threshold`, or with `by_motion`,
+        by Kalman distance within the gate"""
+        if not tracks or not len(boxes):
+            return [], list(range(len(tracks))), list(range(len(boxes)))
+        if by_motion:
+            scores = -np.stack([t.gating_distance(boxes) for t in tracks])
+            threshold = -_GATE_DISTANCE
+        else:
+            scores = iou_matrix(np.stack([t.xyxy for t in tracks]), boxes)
+        # Greedy matching, best first; with few objects per frame it almost
+        # always agrees with an optimal assignment
+        matches = []
+        matched_rows, matched_cols = set(), set()
+        for flat in np.argsort(-scores, axis=None):
+            r, c = divmod(int(flat), scores.shape[1])
+            if scores[r, c] < threshold:
+                break
+            if r not in matched_rows and c not in matched_cols:
+                matches.append((r, c))
+                matched_rows.add(r)
+                matched_cols.add(c)
+        return (matches, [r for r in range(len(tracks)) if r not in matched_rows],
+                [c for c in range(len(boxes)) if c not in matched_cols])
+
+    def _output(self, frame_idx: int) -> DetectionBatch:
+        # Only tracks matched on the latest keyframe are reported; lost ones wait to be re-found
+        active = [t for t in self.tracks if t.lost == 0]
+        if not active:
+            return DetectionBatch.empty(self.names, with_frames=True).with_track_ids(np.zeros(0, np.int64))
+        return DetectionBatch(
+            np.stack([t.xyxy for t in active]),
+            np.array([t.confidence for t in active]),
+            np.array([t.class_id for t in active]),
+            self.names,
+            np.full(len(active), frame_idx, np.int64),
+            np.array([t.id for t in active], np.int64),
+        )
+
+    def update(self, detections: DetectionBatch, frame_idx: int) -> DetectionBatch:
+        """Match a keyframe's detections to the tracks, returning the tracked boxes"""
+        for track in self.tracks:
+            track.predict(frame_idx)
+        confident = detections.confidences >= self.confidence_threshold
+        high = np.flatnonzero(confident)
+        low = np.flatnonzero(~confident & (detections.confidences >= min(self.confidence_threshold,
+                                                                          self.options.low_confidence)))
+
+        def apply(track, index):
+            track.update(detections.xyxy[index], float(detections.confidences[index]),
+                         int(detections.class_ids[index]), frame_idx)
+
+        # Confident detections against every track, including recently lost ones
+        matches, unmatched_tracks, unmatched_high = self._associate(
+            self.tracks, detections.xyxy[high], self.options.iou_threshold)
+        for r, c in matches:
+            apply(self.tracks[r], high[c])
+
+        # Keyframes can be far enough apart that a moving object no longer
+        # overlaps its predicted box, so fall back to the filter's motion gate
+        remaining = [self.tracks[r] for r in unmatched_tracks]
+        matches, unmatched, unmatched_by_motion = self._associate(
+            remaining, detections.xyxy[high[unmatched_high]], 0, by_motion=True)
+        for r, c in matches:
+            apply(remaining[r], high[unmatched_high[c]])
+        unmatched_tracks = [unmatched_tracks[r] for r in unmatched]
+        unmatched_high = [unmatched_high[c] for c in unmatched_by_motion]
+
+        # Low-confidence detections can only continue tracks that weren't lost
+        remaining = [self.tracks[r] for r in unmatched_tracks if self.tracks[r].lost == 0]
+        # ByteTrack's second association uses a stricter IoU
+        matches, _, _ = self._associate(remaining, detections.xyxy[low], 0.5)
+        for r, c in matches:
+            apply(remaining[r], low[c])
+
+        for track in self.tracks:
+            if track.last_frame != frame_idx:
+                track.lost += 1
+
+        for c in unmatched_high:
+            index = high[c]
+            self.tracks.append(_Track(self._next_id, detections.xyxy[index], float(detections.confidences[index]),
+                                      int(detections.class_ids[index]), frame_idx, self.num_classes))
+            self._next_id += 1
+
+        kept = []
+        for track in self.tracks:
+            (kept if track.lost <= self.options.max_lost else self.finished).append(track)
+        self.tracks = kept
+        return self._output(frame_idx)
+
+    def propagate(self, frame_idx: int) -> DetectionBatch:
+        """Predicted boxes for a frame between keyframes"""
+        for track in self.tracks:
+            track.predict(frame_idx)
+        return self._output(frame_idx)
+
+    def confirmed(self) -> List[_Track]:
+        return sorted((t for t in self.finished + self.tracks if t.hits >= self.options.min_hits),
+                      key=lambda t: t.id)
+
+    def unique_counts(self) -> Dict[str, int]:
+        """Distinct objects per class, counting tracks seen on at least `min_hits` keyframes"""
+        table = class_name_table(self.names)
+        counts: Dict[str, int] = {}
+        for track in self.confirmed():
+            name = table[track.class_id]
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    def describe_tracks(self) -> List[Dict[str, Any]]:
+        table = class_name_table(self.names)
+        return [{
+            "track_id": t.id,
+            "class_name": table[t.class_id],
+            "first_frame": t.first_frame,
+            "last_frame": t.last_frame,
+            "hits": t.hits,
+            "max_confidence": t.max_confidence,
+        } for t in self.confirmed()]
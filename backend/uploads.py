@@ -0,0 +1,184 @@
+import asyncio
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+# Bytes read from an upload at a time when copying it to disk
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+# Leading bytes of an upload inspected to tell whether its container can be decoded as it arrives
+SNIFF_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload grows past its size limit while being written out"""
+
+
+class UploadedFile:
+    """An upload on disk, or arriving through a named pipe when not `seekable`.
+
+    `sha256` has been fed every byte once the file is complete; it is None
+    for pipes, which are read while the upload is still arriving.
+    """
+
+    def __init__(self, path: str, seekable: bool = True):
+        self.path = path
+        self.seekable = seekable
+        self.size = 0
+        self.sha256 = hashlib.sha256() if seekable else None
+        # Task writing a pipe's upload into it
+        self._feeder: Optional[asyncio.Task] = None
+
+    def feed_error(self) -> Optional[BaseException]:
+        """The error that cut a pipe's upload short, such as UploadTooLargeError.
+
+        The decoder then sees the video end early and usually fails first,
+        so its error should give way to this one.
+        """
+        if self._feeder is None or not self._feeder.done() or self._feeder.cancelled():
+            return None
+        return self._feeder.exception()
+
+
+async def file_chunks(file, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """The contents of an UploadFile, a chunk at a time"""
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def peek(chunks: AsyncIterator[bytes], size: int = SNIFF_BYTES) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """The first `size` (or more) bytes of a chunked upload, and the whole upload again"""
+    head = []
+    length = 0
+    iterator = chunks.__aiter__()
+    while length < size:
+        try:
+            chunk = await iterator.__anext__()
+        except StopAsyncIteration:
+            break
+        head.append(chunk)
+        length += len(chunk)
+
+    async def replay():
+        for chunk in head:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+    return b"".join(head), replay()
+
+
+def _check_size(upload: UploadedFile, chunk: bytes, max_bytes: Optional[int]):
+    upload.size += len(chunk)
+    if max_bytes is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(f"Upload is larger than {max_bytes / (1024 * 1024):g} MB")
+
+
+@asynccontextmanager
+async def spool_upload(chunks: AsyncIterator[bytes], suffix: str = "",
+                       max_bytes: Optional[int] = None) -> AsyncIterator[UploadedFile]:
+    """Write an upload to a temporary file a chunk at a time, hashing it on the way.
+
+    The file is removed when the block exits, however it exits.
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    upload = UploadedFile(path)
+
+    def write(f, chunk):
+        upload.sha256.update(chunk)
+        f.write(chunk)
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                _check_size(upload, chunk, max_bytes)
+                await asyncio.to_thread(write, f, chunk)
+        yield upload
+    finally:
+        os.remove(path)
+
+
+async def _feed_pipe(path: str, chunks: AsyncIterator[bytes], upload: UploadedFile, max_bytes: Optional[int]):
+    # Opening a pipe to write fails rather than blocks while nothing has it open to
+    # read, so wait for the decoder to open it without tying up a thread
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            await asyncio.sleep(0.01)
+    os.set_blocking(fd, True)
+
+    def write(chunk):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fd, view):]
+
+    try:
+        async for chunk in chunks:
+            _check_size(upload, chunk, max_bytes)
+            await asyncio.to_thread(write, chunk)
+    except BrokenPipeError:
+        # The decoder has closed the video, having read all the frames it wanted
+        pass
+    finally:
+        os.close(fd)
+
+
+@asynccontextmanager
+async def pipe_upload(chunks: AsyncIterator[bytes], suffix: str = "",
+                      max_bytes: Optional[int] = None) -> AsyncIterator[UploadedFile]:
+    """Feed an upload to a decoder through a named pipe as it arrives.
+
+    The decoder opens the yielded file's path and reads it front to back
+    while the rest of the upload is still coming in. Leaving the block waits
+    for the upload to finish, raising its error if it failed, and the pipe
+    is removed however the block exits.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, f"upload{suffix}")
+    os.mkfifo(path)
+    upload = UploadedFile(path, seekable=False)
+    writer = upload._feeder = asyncio.create_task(_feed_pipe(path, chunks, upload, max_bytes))
+    try:
+        yield upload
+        await writer
+    finally:
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _mp4_streamable(head: bytes) -> bool:
+    # Walk the top-level boxes: the moov box (the index) must come before the media data
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], "big")
+        kind = head[offset + 4:offset + 8]
+        if kind in (b"moov", b"moof"):
+            return True
+        if kind == b"mdat":
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = int.from_bytes(head[offset + 8:offset + 16], "big")
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+def streamable_container(head: bytes) -> bool:
+    """Whether a video starting with `head` can be decoded front to back, without seeking.
+
+    Matroska/WebM and MPEG-TS can. MP4/MOV can only when the index comes
+    first ("faststart" or fragmented files); most cameras write it last.
+    """
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return True
+    if len(head) > 376 and head[0] == head[188] == head[376] == 0x47:
+        return True
+    return head[4:8] == b"ftyp" and _mp4_streamable(head)
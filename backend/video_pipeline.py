@@ -0,0 +1,231 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from frame_sampler import FramePool, FrameSampler
+from postprocess import DetectionBatch, class_name_table
+from scene_gate import SceneChangeGate
+from tracking import KeyframeSchedule, Tracker, TrackingOptions
+
+# Frames per batched model call and decoded frames buffered ahead of the model
+VIDEO_BATCH_SIZE = int(os.environ.get('VIDEO_BATCH_SIZE', 8))
+VIDEO_QUEUE_SIZE = int(os.environ.get('VIDEO_QUEUE_SIZE', 16))
+
+_END = object()
+
+
+class _ProducerError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class VideoPipeline:
+    """Overlaps frame decoding with batched inference.
+
+    A producer thread decodes the sampled frames into a bounded queue while
+    the calling thread runs the model on batches of queued frames. Iterating
+    yields (frame_idx, DetectionBatch) per frame, in frame order.
+
+    Frames go to the model as the decoder's BGR arrays, which is the order
+    ultralytics expects for arrays, and are decoded into a pool of buffers
+    that are reused once a batch has been postprocessed.
+
+    With a SceneChangeGate, frames the gate judges unchanged skip inference
+    and reuse the detections of the last inferred frame.
+
+    `model` may also be a list of models, which all run on each decoded
+    batch (in parallel threads); `run_all` then yields one DetectionBatch
+    per model for every frame.
+
+    With TrackingOptions, the model only runs on keyframes and a Tracker per
+    model carries the boxes through the frames in between, giving every
+    detection a track id. The gate is replaced by the keyframe schedule.
+    """
+
+    def __init__(self, model, confidence_threshold: float = 0.25,
+                 batch_size: int = VIDEO_BATCH_SIZE, queue_size: int = VIDEO_QUEUE_SIZE,
+                 gate: Optional[SceneChangeGate] = None, predict_args: Optional[Dict[str, Any]] = None,
+                 tracking: Optional[TrackingOptions] = None):
+        self.models = list(model) if isinstance(model, (list, tuple)) else [model]
+        self.confidence_threshold = confidence_threshold
+        self.trackers = None
+        if tracking is not None:
+            gate = KeyframeSchedule(tracking.keyframe_interval)
+            self.trackers = [Tracker(m.names, confidence_threshold, tracking) for m in self.models]
+            # Weaker detections are still used to keep existing tracks alive
+            self.confidence_threshold = min(confidence_threshold, tracking.low_confidence)
+        # Extra model call settings, such as a quality tier's imgsz and max_det
+        self.predict_args = predict_args or {}
+        self.batch_size = max(1, batch_size)
+        self.queue_size = max(1, queue_size)
+        self.gate = gate
+        self.batches = 0
+        self.frames_inferred = 0
+        self.frames_reused = 0
+        self.frames_tracked = 0
+        # Seconds spent per stage; decode and preprocess (the scene gate) run on the producer thread
+        self.timings = {"decode": 0.0, "preprocess": 0.0, "inference": 0.0, "postprocess": 0.0}
+
+    def _produce(self, sampler: FrameSampler, frames: queue.Queue, stop: threading.Event):
+        def put(item):
+            # Block while the queue is full, but give up if the consumer has stopped
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            decode_start = time.perf_counter()
+            for frame_idx, frame in sampler:
+                preprocess_start = time.perf_counter()
+                self.timings["decode"] += preprocess_start - decode_start
+                # Near-duplicate frames are passed through without an image
+                if self.gate is not None and not self.gate.should_infer(frame):
+                    sampler.release(frame)
+                    item = (frame_idx, None)
+                else:
+                    item = (frame_idx, frame)
+                self.timings["preprocess"] += time.perf_counter() - preprocess_start
+                if not put(item):
+                    return
+                decode_start = time.perf_counter()
+        except BaseException as e:
+            put(_ProducerError(e))
+            return
+        put(_END)
+
+    def _next_batch(self, frames: queue.Queue) -> Tuple[List[Tuple[int, Any]], bool]:
+        # Wait for one frame, then take whatever else is already decoded. The
+        # first frame goes through alone, and batches grow while the decoder
+        # stays ahead of the model.
+        batch = []
+        while len(batch) < self.batch_size:
+            if batch:
+                try:
+                    item = frames.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                item = frames.get()
+            if item is _END:
+                return batch, True
+            if isinstance(item, _ProducerError):
+                raise item.error
+            batch.append(item)
+        return batch, False
+
+    def _infer(self, pool: Optional[ThreadPoolExecutor], images: List[np.ndarray]) -> List[Iterator[Any]]:
+        def call(model):
+            return iter(model(images, conf=self.confidence_threshold, **self.predict_args))
+
+        if pool is None:
+            return [call(model) for model in self.models]
+        return list(pool.map(call, self.models))
+
+    def run_all(self, sampler: FrameSampler) -> Iterator[Tuple[int, List[DetectionBatch]]]:
+        if sampler.pool is None:
+            # Enough buffers for a full queue, the batch being inferred and the frame being decoded
+            sampler.pool = FramePool(self.queue_size + self.batch_size + 1)
+        frames = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(sampler, frames, stop),
+                                    name="video-decode", daemon=True)
+        # Torch releases the GIL during inference, so models can share a batch in parallel
+        pool = ThreadPoolExecutor(len(self.models), thread_name_prefix="video-infer") if len(self.models) > 1 else None
+        producer.start()
+        try:
+            previous = None
+            done = False
+            while not done:
+                batch, done = self._next_batch(frames)
+                if not batch:
+                    break
+                # Run inference with YOLOv8 on the whole batch of frames that need it
+                images = [image for _, image in batch if image is not None]
+                start = time.perf_counter()
+                results = self._infer(pool, images) if images else []
+                self.timings["inference"] += time.perf_counter() - start
+                if images:
+                    self.batches += 1
+                for frame_idx, image in batch:
+                    if self.trackers is not None:
+                        yield frame_idx, self._track(frame_idx, image, results)
+                        continue
+                    if image is None and previous is not None:
+                        self.frames_reused += 1
+                        yield frame_idx, [detections.with_frame(frame_idx) for detections in previous]
+                        continue
+                    start = time.perf_counter()
+                    previous = [DetectionBatch.from_results([next(model_results)], model.names, frame_idx)
+                                for model, model_results in zip(self.models, results)]
+                    self.timings["postprocess"] += time.perf_counter() - start
+                    self.frames_inferred += 1
+                    yield frame_idx, previous
+                # The batch's detections are extracted, so the results no longer need its frames
+                for _, image in batch:
+                    if image is not None:
+                        sampler.release(image)
+        finally:
+            stop.set()
+            producer.join()
+            if pool is not None:
+                pool.shutdown()
+
+    def _track(self, frame_idx: int, image, results: List[Iterator[Any]]) -> List[DetectionBatch]:
+        # Keyframes update the trackers with fresh detections; other frames use their predictions
+        start = time.perf_counter()
+        if image is None:
+            self.frames_tracked += 1
+            tracked = [tracker.propagate(frame_idx) for tracker in self.trackers]
+        else:
+            self.frames_inferred += 1
+            tracked = [tracker.update(DetectionBatch.from_results([next(model_results)], model.names, frame_idx), frame_idx)
+                       for tracker, model, model_results in zip(self.trackers, self.models, results)]
+        self.timings["postprocess"] += time.perf_counter() - start
+        return tracked
+
+    def run(self, sampler: FrameSampler) -> Iterator[Tuple[int, DetectionBatch]]:
+        for frame_idx, batches in self.run_all(sampler):
+            yield frame_idx, batches[0]
+
+
+class VideoSummary:
+    """Aggregates per-frame detections into class counts and average density"""
+
+    def __init__(self, names, keep_detections: bool = True):
+        self.names = names
+        self.keep_detections = keep_detections
+        self.frames_processed = 0
+        self.detection_count = 0
+        self.total_waste_area = 0.0
+        self._counts = np.zeros(len(class_name_table(names)), np.int64)
+        self._batches: List[DetectionBatch] = []
+
+    def add(self, frame_idx: int, batch: DetectionBatch):
+        self.frames_processed += 1
+        self.detection_count += len(batch)
+        self.total_waste_area += batch.total_area()
+        if len(batch):
+            self._counts += np.bincount(batch.class_ids, minlength=len(self._counts))
+        if self.keep_detections:
+            self._batches.append(batch)
+
+    def class_counts(self) -> Dict[str, int]:
+        table = class_name_table(self.names)
+        return {table[i]: int(self._counts[i]) for i in np.flatnonzero(self._counts)}
+
+    def waste_density(self, frame_area: float) -> float:
+        # Average waste density across processed frames
+        area = frame_area * self.frames_processed
+        return (self.total_waste_area / area) * 100 if area > 0 else 0
+
+    def detections(self) -> DetectionBatch:
+        return DetectionBatch.concat(self._batches, self.names)